@@ -1,7 +1,12 @@
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from . import tts_api, llm_api, asr_api, common_api, music_api, diary_api, process_api, auth_api
+from ..llm import http_client, context_manager
+from ..common.text_batch import text_batch_pool
+from ..asr.vad_batch import shutdown_batched_vad
+from ..asr.fun import preload_funasr
 try:
     from server.rag.api.routes import router as rag_router
 except Exception:
@@ -10,10 +15,24 @@ from ALT_pure.config.load_config import config
 from pathlib import Path
 from datetime import datetime
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 应用生命周期内共享的LLM连接池：启动时创建，关闭时释放
+    await http_client.startup()
+    await context_manager.startup()
+    await diary_api.enrich_queue.start()
+    await preload_funasr()
+    yield
+    await diary_api.enrich_queue.stop()
+    await http_client.shutdown()
+    text_batch_pool.shutdown()
+    await shutdown_batched_vad()
+
 app = FastAPI(
     title="ALT系统API",
     description="这是一个ALT系统的API接口",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
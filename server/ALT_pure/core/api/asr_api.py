@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from ...core.asr.whisper_asr import audio_to_text
+from ...core.asr.stream_asr import StreamSession
 import os
+import json
 import uuid
 import tempfile
 
@@ -112,6 +114,59 @@ async def upload_and_transcribe(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"音频识别失败: {str(e)}")
 
+@router.websocket("/ws")
+async def asr_websocket(websocket: WebSocket, platform: str = None, language: str = None, model_size: str = "small"):
+    """
+    流式语音识别WebSocket接口（浏览器麦克风）
+
+    查询参数:
+    - platform: asr后端，paraformer / local / whisper（默认: config中choose.asr，未配置时为whisper）
+    - language: 语言代码，仅whisper使用（默认: 自动检测）
+    - model_size: whisper模型大小（默认: small）
+
+    客户端发送:
+    - 二进制帧: 16kHz单声道16bit小端PCM，长度任意
+    - 文本帧: {"type": "end"} 表示音频结束，服务端识别完剩余片段后发送done并关闭连接
+
+    服务端发送(JSON):
+    - {"type": "ready", "platform": ..., "sample_rate": 16000}
+    - {"type": "speech_start", "id": 0}
+    - {"type": "partial", "id": 0, "text": "人声进行中的识别结果"}
+    - {"type": "speech_end", "id": 0, "duration": 1.2}
+    - {"type": "final", "id": 0, "text": "这段人声的识别结果", "duration": 1.2}
+    - {"type": "error", "message": "错误信息"} / {"type": "done"}
+    """
+    await websocket.accept()
+    try:
+        session = StreamSession(websocket.send_json, platform, language, model_size)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=1008)
+        return
+
+    try:
+        await session.start()
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    await session.send({"type": "error", "message": "无法解析的控制消息"})
+                    continue
+                if isinstance(control, dict) and control.get("type") == "end":
+                    await session.finish()
+                    await websocket.close()
+                    break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+
 @router.get("/supported-models", response_model=dict)
 async def supported_models():
     """
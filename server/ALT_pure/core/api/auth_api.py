@@ -107,6 +107,23 @@ async def get_current_user(
         
     return user
 
+async def get_optional_user(
+    access_token: Optional[str] = Cookie(None),
+    token_header: Optional[str] = Depends(oauth2_scheme)
+):
+    # 与get_current_user相同，但未登录或凭证无效时返回None而不是401
+    token = access_token or token_header
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return excel_auth.get_user_by_username(username=username)
+
 # 用户注册
 @router.post("/register", response_model=User)
 async def register(user_create: UserCreate):
@@ -211,7 +228,7 @@ async def generate_diary_intro(
         """
         
         # 调用LLM生成前言
-        intro = await llm.chat(prompt, "你是一位专业的日记前言撰写助手")
+        intro = await llm.complete("你是一位专业的日记前言撰写助手", prompt)
         
         return {"generated_intro": intro}
     except Exception as e:
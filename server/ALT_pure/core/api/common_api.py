@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from ...core.common.text_processor import TextProcessor
+from ...core.common.text_batch import text_batch_pool
 from ...core.common.task_manager import TaskManager
 from typing import List, Any, Optional
 import asyncio
+import json
 
 # 创建APIRouter实例
 router = APIRouter()
@@ -31,6 +34,28 @@ class TextMergerRequest(BaseModel):
     """
     texts: List[str]  # 要合并的文本列表
 
+class TextCleanBatchRequest(BaseModel):
+    """
+    批量文本清洗请求模型
+    """
+    texts: List[str]  # 要清洗的文本列表
+    stream: bool = False  # 为True时以NDJSON逐条返回，按完成顺序
+
+class TextCutterBatchRequest(BaseModel):
+    """
+    批量文本切割请求模型
+    """
+    texts: List[str]  # 要切割的文本列表
+    language: str = 'auto'  # 语言代码，对所有文本生效
+    stream: bool = False
+
+class TextMergerBatchRequest(BaseModel):
+    """
+    批量文本合并请求模型
+    """
+    batches: List[List[str]]  # 每个元素是一组要合并的文本
+    stream: bool = False
+
 @router.post("/text/clean", response_model=dict)
 async def clean_text(request: TextCleanRequest):
     """
@@ -107,6 +132,81 @@ async def merge_text(request: TextMergerRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文本合并失败: {str(e)}")
 
+async def _run_batch(op: str, items: list, stream: bool, keys: tuple, language: str = "auto", message: str = ""):
+    """
+    批量接口的公共部分：校验数量，stream为False时返回同序数组(字段名keys[0])，
+    为True时返回NDJSON，每行{"index": 序号, keys[1]: 结果}
+    """
+    key, item_key = keys
+    if len(items) > text_batch_pool.max_items:
+        raise HTTPException(status_code=413, detail=f"单次最多处理{text_batch_pool.max_items}条文本")
+    if not stream:
+        try:
+            results = await text_batch_pool.map(op, items, language)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"{message}失败: {str(e)}")
+        return {
+            "success": True,
+            key: results,
+            "count": len(results),
+            "message": f"{message}成功"
+        }
+
+    async def generator():
+        try:
+            async for index, result in text_batch_pool.iter(op, items, language):
+                yield json.dumps({"index": index, item_key: result}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"{message}失败: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generator(), media_type="application/x-ndjson; charset=utf-8")
+
+@router.post("/text/clean/batch")
+async def clean_text_batch(request: TextCleanBatchRequest):
+    """
+    批量文本清洗API接口
+
+    参数:
+    - texts: 要清洗的文本列表
+    - stream: 是否以NDJSON流式返回（默认: False）
+
+    返回:
+    - stream=False: {"success": True, "cleaned_texts": ["清洗后的文本", ...], "count": 数量, "message": "批量文本清洗成功"}
+    - stream=True: 每行 {"index": 序号, "cleaned_text": "清洗后的文本"}，按完成顺序
+    """
+    return await _run_batch("clean", request.texts, request.stream, ("cleaned_texts", "cleaned_text"), message="批量文本清洗")
+
+@router.post("/text/cut/batch")
+async def cut_text_batch(request: TextCutterBatchRequest):
+    """
+    批量文本切割API接口
+
+    参数:
+    - texts: 要切割的文本列表
+    - language: 语言代码，可选值: 'auto', 'zh', 'en', 'fr', 'de', 'ja'（默认: auto）
+    - stream: 是否以NDJSON流式返回（默认: False）
+
+    返回:
+    - stream=False: {"success": True, "sentences": [["句子1", ...], ...], "count": 数量, "message": "批量文本切割成功"}
+    - stream=True: 每行 {"index": 序号, "sentences": ["句子1", ...]}
+    """
+    return await _run_batch("cut", request.texts, request.stream, ("sentences", "sentences"), request.language, message="批量文本切割")
+
+@router.post("/text/merge/batch")
+async def merge_text_batch(request: TextMergerBatchRequest):
+    """
+    批量文本合并API接口
+
+    参数:
+    - batches: 文本列表的列表，每组单独合并
+    - stream: 是否以NDJSON流式返回（默认: False）
+
+    返回:
+    - stream=False: {"success": True, "merged_texts": [["合并后的文本", ...], ...], "count": 数量, "message": "批量文本合并成功"}
+    - stream=True: 每行 {"index": 序号, "merged_text": ["合并后的文本", ...]}
+    """
+    return await _run_batch("merge", request.batches, request.stream, ("merged_texts", "merged_text"), message="批量文本合并")
+
 @router.get("/text/max-split-length", response_model=dict)
 async def get_max_split_length():
     """
@@ -9,13 +9,19 @@ from typing import List, Dict, Optional, Any
 import re
 import logging
 from datetime import datetime
+import hashlib
 import sqlite3
 
 from ..llm.qwen import LLM
-from .auth_api import get_current_user
+from .auth_api import get_current_user, get_optional_user
+from ..llm.response_cache import response_cache
+from ..llm.structured import parse_json
+from ..common.job_queue import JobQueue
+from ...config.load_config import config
 from .constants import (
     TIMELINE_PROMPT, PROBLEM_SOLUTION_PROMPT, KEY_POINTS_PROMPT, AUTO_STRUCTURE_PROMPT,
-    EXTRACT_KEY_POINTS_PROMPT, ASSOCIATION_PROMPT, KNOWLEDGE_PROMPT, PLAN_PROMPT, REVIEW_PROMPT
+    EXTRACT_KEY_POINTS_PROMPT, ASSOCIATION_PROMPT, KNOWLEDGE_PROMPT, PLAN_PROMPT, REVIEW_PROMPT,
+    ENRICH_PROMPT
 )
 
 # 配置日志
@@ -76,6 +82,40 @@ def _ensure_index_schema(conn: sqlite3.Connection) -> None:
     )
     conn.commit()
 
+def _upsert_index_row(c: sqlite3.Cursor, user_id: str, file: Path, meta: Dict[str, Any]) -> None:
+    """
+    按元数据写入或更新一篇日记的索引行，元数据缺少预览时读取全文。
+    """
+    if "preview" in meta and "word_count" in meta:
+        content_preview = meta.get("preview", "")
+        word_count = int(meta.get("word_count", 0))
+        ext = file.suffix.lstrip(".")
+    else:
+        content, ext = _read_file_content(file)
+        content_preview = content[:100] + ("..." if len(content) > 100 else "")
+        word_count = len(content.replace("\n", " ").split())
+    title = _extract_title(content_preview, file.name)
+    date_str = _parse_diary_date(file.name) or meta.get("created_at_date") or datetime.fromtimestamp(file.stat().st_mtime).strftime("%Y-%m-%d")
+    tags_text = json.dumps(meta.get("tags", []), ensure_ascii=False)
+    mood = meta.get("mood", "")
+    last_mod = file.stat().st_mtime
+    c.execute(
+        """
+        INSERT INTO diaries(user_id, filename, title, date, tags, mood, word_count, preview, last_modified, format)
+        VALUES(?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(user_id, filename) DO UPDATE SET
+            title=excluded.title,
+            date=excluded.date,
+            tags=excluded.tags,
+            mood=excluded.mood,
+            word_count=excluded.word_count,
+            preview=excluded.preview,
+            last_modified=excluded.last_modified,
+            format=excluded.format
+        """,
+        (user_id, file.name, title, date_str, tags_text, mood, word_count, content_preview, last_mod, ext)
+    )
+
 def _safe_user_file_path(storage_dir: Path, filename: str) -> Path:
     """
     安全拼接并校验用户文件路径，防止路径穿越。
@@ -105,6 +145,7 @@ class StructureRequest(BaseModel):
 
 class KeyPointsRequest(BaseModel):
     content: str
+    filename: Optional[str] = None  # 已保存的日记，后台补全过且内容未变化时直接返回结果
 
 class AssociationRequest(BaseModel):
     current_content: str
@@ -189,6 +230,111 @@ def _get_diary_metadata(file_path: Path) -> Dict[str, Any]:
             logger.warning(f"Failed to read metadata for {file_path}: {e}")
     return {}
 
+def _write_diary_metadata(file_path: Path, meta_data: Dict[str, Any]) -> None:
+    """
+    原子写入日记的元数据（Sidecar JSON），后台补全与保存同时发生时不会读到半个文件。
+    """
+    meta_path = file_path.with_name(f"{file_path.name}.meta.json")
+    tmp_path = meta_path.with_name(f"{meta_path.name}.tmp")
+    tmp_path.write_text(json.dumps(meta_data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, meta_path)
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+# 后台补全写入元数据的字段，内容未变化时保存会原样保留
+ENRICHED_FIELDS = ("summary", "tags", "mood", "mood_emoji", "mood_color", "mood_keyword", "soul_insight",
+                   "key_points", "enriched_hash", "enriched_at")
+
+def get_enriched_metadata(user_id: Any, filename: Optional[str], content: str) -> Optional[Dict[str, Any]]:
+    """
+    读取后台补全的结果：日记元数据的enriched_hash与content一致时返回元数据，否则返回None，由调用方回退到LLM。
+    """
+    if not filename:
+        return None
+    try:
+        file_path = _safe_user_file_path(get_user_storage_dir(user_id), filename)
+    except HTTPException:
+        return None
+    meta = _get_diary_metadata(file_path)
+    if not meta.get("enriched_hash") or meta["enriched_hash"] != _content_hash(content):
+        return None
+    return meta
+
+async def _extract_key_points(content: str) -> str:
+    """
+    要点提取，/extract-key-points接口和后台补全共用同一个缓存key。
+    """
+    prompt = EXTRACT_KEY_POINTS_PROMPT.format(content=content)
+    role = "你是一位专业的信息提取分析师"
+    return await response_cache.get_or_compute(
+        "diary/extract-key-points", "extract", prompt, lambda: llm.complete(role, prompt))
+
+async def _enrich_diary(key: str, payload: Dict[str, Any]) -> None:
+    """
+    后台任务：为保存后的日记生成摘要、标签、情绪和要点，写回元数据和索引。
+    """
+    user_id = str(payload["user_id"])
+    file_path = _safe_user_file_path(get_user_storage_dir(user_id), payload["filename"])
+    if not file_path.exists():
+        return
+    content, _ = _read_file_content(file_path)
+    content_hash = _content_hash(content)
+    if content_hash != payload.get("content_hash"):
+        # 文件已再次保存，新的任务会处理最新内容
+        return
+    if not content.strip():
+        return
+
+    text = await llm.complete("你是一位细致的日记整理助手", ENRICH_PROMPT.format(content=content), json_mode=True)
+    insights = parse_json(text)
+    if not isinstance(insights, dict):
+        raise ValueError(f"无法解析LLM返回: {text[:100]}")
+    key_points = await _extract_key_points(content)
+
+    # LLM请求期间日记可能被再次保存，写回前重新读取校验，避免旧内容的结果覆盖新内容的元数据和索引
+    if not file_path.exists():
+        return
+    latest, _ = _read_file_content(file_path)
+    if _content_hash(latest) != content_hash:
+        logger.info(f"日记在补全期间被修改，跳过写回: {key}")
+        return
+
+    meta = _get_diary_metadata(file_path)
+    tags = insights.get("tags") or []
+    meta.update({
+        "summary": str(insights.get("summary") or ""),
+        "tags": [str(t) for t in tags] if isinstance(tags, list) else [str(tags)],
+        "mood": str(insights.get("mood") or ""),
+        "mood_emoji": str(insights.get("mood_emoji") or ""),
+        "mood_color": str(insights.get("mood_color") or ""),
+        "mood_keyword": str(insights.get("mood_keyword") or ""),
+        "soul_insight": str(insights.get("soul_insight") or ""),
+        "key_points": key_points or "",
+        "enriched_hash": content_hash,
+        "enriched_at": int(datetime.now().timestamp())
+    })
+    _write_diary_metadata(file_path, meta)
+
+    conn = sqlite3.connect(str(_index_db_path()))
+    try:
+        _ensure_index_schema(conn)
+        _upsert_index_row(conn.cursor(), user_id, file_path, meta)
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"日记补全完成: {key}")
+
+_enrich_config = config.get("diary_enrich", {}) or {}
+# 保存日记后在后台补全摘要、标签、情绪和要点，任务持久化在diary_index.db中，重启后继续
+enrich_queue = JobQueue(
+    "diary_enrich",
+    _enrich_diary,
+    _index_db_path,
+    max_workers=int(_enrich_config.get("max_workers", 2)),
+    max_attempts=int(_enrich_config.get("max_attempts", 3))
+)
+
 def _parse_diary_date(filename: str) -> str:
     """
     从文件名解析日期。
@@ -243,7 +389,7 @@ async def generate_intro(request: IntroRequest, current_user: dict = Depends(get
             f"补充：{hint}。"
             f"要求：避免重复，用中文输出，适合开篇，简洁自然。"
         )
-        text = await llm.chat(prompt, "你是贴心的写作助手")
+        text = await llm.complete("你是贴心的写作助手", prompt)
         if not text:
             text = f"{now}，给自己一个轻松的开场。"
         clean = text.strip()
@@ -289,11 +435,11 @@ async def save_diary(diary: DiaryContent, current_user: dict = Depends(get_curre
     _save_file_content(file_path, diary.content, diary.format)
     
     # 写入或更新元数据缓存，提升时光机性能
-    meta_path = file_path.with_name(f"{file_path.name}.meta.json")
     preview = diary.content[:100] + ("..." if len(diary.content) > 100 else "")
     word_count = len(diary.content.replace("\n", " ").split())
     created_ts = int(Path(file_path).stat().st_mtime)
     created_date = datetime.fromtimestamp(created_ts).strftime("%Y-%m-%d")
+    content_hash = _content_hash(diary.content)
     meta_data = {
         "summary": "",
         "tags": [],
@@ -304,13 +450,52 @@ async def save_diary(diary: DiaryContent, current_user: dict = Depends(get_curre
         "created_at": created_ts,
         "created_at_date": created_date
     }
+    # 内容未变化时保留已有的AI补全结果，否则交给后台重新补全
+    old_meta = _get_diary_metadata(file_path)
+    enriched = old_meta.get("enriched_hash") == content_hash
+    if enriched:
+        for field in ENRICHED_FIELDS:
+            if field in old_meta:
+                meta_data[field] = old_meta[field]
     try:
-        meta_path.write_text(json.dumps(meta_data, ensure_ascii=False), encoding="utf-8")
+        _write_diary_metadata(file_path, meta_data)
     except Exception as e:
         logger.warning(f"Failed to write metadata for {file_path}: {e}")
-            
+
+    if not enriched and _enrich_config.get("enabled", True):
+        try:
+            enrich_queue.enqueue(
+                f"{current_user['id']}/{filename}",
+                {"user_id": current_user['id'], "filename": filename, "content_hash": content_hash}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to enqueue enrichment for {file_path}: {e}")
+
     return {"status": "success", "filename": filename}
 
+@router.get("/insights/{filename}")
+async def get_diary_insights(filename: str, current_user: dict = Depends(get_current_user)):
+    """
+    获取后台预先生成的日记摘要、标签、情绪和要点，以及补全任务状态。
+    """
+    storage_dir = get_user_storage_dir(current_user['id'])
+    file_path = _safe_user_file_path(storage_dir, filename)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    meta = _get_diary_metadata(file_path)
+    job = enrich_queue.status(f"{current_user['id']}/{filename}")
+    return {
+        "summary": meta.get("summary", ""),
+        "tags": meta.get("tags", []),
+        "mood": meta.get("mood", ""),
+        "mood_emoji": meta.get("mood_emoji", ""),
+        "mood_color": meta.get("mood_color", ""),
+        "mood_keyword": meta.get("mood_keyword", ""),
+        "soul_insight": meta.get("soul_insight", ""),
+        "key_points": meta.get("key_points", ""),
+        "status": job["status"] if job else ("done" if meta.get("enriched_hash") else "none")
+    }
+
 @router.post("/index/scan")
 async def scan_index(current_user: dict = Depends(get_current_user)):
     try:
@@ -322,36 +507,7 @@ async def scan_index(current_user: dict = Depends(get_current_user)):
         count = 0
         for file in files:
             try:
-                meta = _get_diary_metadata(file)
-                if "preview" in meta and "word_count" in meta:
-                    content_preview = meta.get("preview", "")
-                    word_count = int(meta.get("word_count", 0))
-                    ext = file.suffix.lstrip(".")
-                else:
-                    content, ext = _read_file_content(file)
-                    content_preview = content[:100] + ("..." if len(content) > 100 else "")
-                    word_count = len(content.replace("\n", " ").split())
-                title = _extract_title(content_preview, file.name)
-                date_str = _parse_diary_date(file.name) or meta.get("created_at_date") or datetime.fromtimestamp(file.stat().st_mtime).strftime("%Y-%m-%d")
-                tags_text = json.dumps(meta.get("tags", []), ensure_ascii=False)
-                mood = meta.get("mood", "")
-                last_mod = file.stat().st_mtime
-                c.execute(
-                    """
-                    INSERT INTO diaries(user_id, filename, title, date, tags, mood, word_count, preview, last_modified, format)
-                    VALUES(?,?,?,?,?,?,?,?,?,?)
-                    ON CONFLICT(user_id, filename) DO UPDATE SET
-                        title=excluded.title,
-                        date=excluded.date,
-                        tags=excluded.tags,
-                        mood=excluded.mood,
-                        word_count=excluded.word_count,
-                        preview=excluded.preview,
-                        last_modified=excluded.last_modified,
-                        format=excluded.format
-                    """,
-                    (str(current_user['id']), file.name, title, date_str, tags_text, mood, word_count, content_preview, last_mod, ext)
-                )
+                _upsert_index_row(c, str(current_user['id']), file, _get_diary_metadata(file))
                 count += 1
             except Exception:
                 continue
@@ -444,7 +600,9 @@ async def structure_diary_content(request: StructureRequest):
             prompt = AUTO_STRUCTURE_PROMPT.format(content=content)
         
         # 调用LLM进行结构化处理
-        structured_content = await llm.chat(prompt, "你是一位专业的内容结构化整理助手")
+        role = "你是一位专业的内容结构化整理助手"
+        structured_content = await response_cache.get_or_compute(
+            "diary/structure", template_type, prompt, lambda: llm.complete(role, prompt))
         
         if not structured_content:
             raise HTTPException(status_code=500, detail="LLM处理失败，返回空结果")
@@ -455,16 +613,16 @@ async def structure_diary_content(request: StructureRequest):
         raise HTTPException(status_code=500, detail="结构化处理失败")
 
 @router.post("/extract-key-points")
-async def extract_key_points(request: KeyPointsRequest):
+async def extract_key_points(request: KeyPointsRequest, current_user: Optional[dict] = Depends(get_optional_user)):
     """
     AI驱动的日记要点智能挖掘系统接口
     """
     try:
-        content = request.content
-        prompt = EXTRACT_KEY_POINTS_PROMPT.format(content=content)
-        
-        # 调用LLM进行要点提取
-        key_points = await llm.chat(prompt, "你是一位专业的信息提取分析师")
+        # 登录用户传入filename且后台已为相同内容提取过要点时直接返回，否则调用LLM(同样内容命中缓存)
+        meta = get_enriched_metadata(current_user['id'], request.filename, request.content) if current_user else None
+        if meta and meta.get("key_points"):
+            return {"key_points": meta["key_points"]}
+        key_points = await _extract_key_points(request.content)
         
         if not key_points:
             raise HTTPException(status_code=500, detail="LLM处理失败，返回空结果")
@@ -486,7 +644,7 @@ async def get_associations(request: AssociationRequest):
         )
         
         # 调用LLM生成联想建议
-        associations = await llm.chat(prompt, "你是一位创意写作助手，擅长提供富有启发性的思路建议")
+        associations = await llm.complete("你是一位创意写作助手，擅长提供富有启发性的思路建议", prompt)
         
         if not associations:
             raise HTTPException(status_code=500, detail="LLM处理失败，返回空结果")
@@ -625,7 +783,8 @@ async def learning_assistant(request: LearningAssistantRequest):
             prompt = REVIEW_PROMPT.format(subject=subject, content=content)
             role = "你是一位专业的记忆专家，擅长制定科学的复习计划"
         
-        result = await llm.chat(prompt, role)
+        result = await response_cache.get_or_compute(
+            "diary/learn", type_, prompt, lambda: llm.complete(role, prompt))
         
         if not result:
             raise HTTPException(status_code=500, detail="LLM处理失败，返回空结果")
@@ -1,15 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from ..llm.qwen import LLM
+from ..llm.http_client import get_client
+from ..llm.response_cache import response_cache
+from ..llm.structured import complete_model, stream_partial
+from .auth_api import get_optional_user
+from .diary_api import get_enriched_metadata
 from ...config.load_config import config
-import httpx
+from ...log.load_log import logger
 from typing import Optional, List
-import asyncio
 import json
 import re
+import uuid
 from datetime import datetime, timedelta
 
+TAG = __name__
+
 router = APIRouter()
 
 # 初始化LLM实例
@@ -20,10 +28,12 @@ class ChatRequest(BaseModel):
     role: str = "你是助手"
     message: str
     stream: Optional[bool] = False
+    conversation_id: Optional[str] = "default"
 
 
 class ChatResponse(BaseModel):
     response: str
+    conversation_id: Optional[str] = None
 
 class TaskScheduleItem(BaseModel):
     time: str
@@ -38,6 +48,11 @@ class TaskPlanResponse(BaseModel):
     error: Optional[str] = None
 
 
+class MoodAlchemyRequest(BaseModel):
+    message: str
+    filename: Optional[str] = None  # 已保存的日记，后台补全过且内容未变化时直接返回结果
+
+
 class MoodAlchemyResponse(BaseModel):
     mood_color: str
     mood_keyword: str
@@ -69,20 +84,34 @@ async def llm_health():
         base = config.get("llm", {"ollama": {"base_url": "http://localhost:11434"}}).get("ollama", {"base_url": "http://localhost:11434"}).get("base_url", "http://localhost:11434")
         url = base.rstrip("/") + "/api/tags"
         try:
-            async with httpx.AsyncClient(timeout=3) as client:
-                resp = await client.get(url)
-                ok = resp.status_code < 400
-                return {"platform": "ollama", "reachable": ok}
+            resp = await get_client("ollama").get(url, timeout=3)
+            ok = resp.status_code < 400
+            return {"platform": "ollama", "reachable": ok}
         except Exception:
             return {"platform": "ollama", "reachable": False}
     return {"platform": None, "configured": False}
 
+@router.get("/cache-stats")
+async def cache_stats():
+    """
+    AI接口响应缓存的命中统计（按endpoint）
+    """
+    return response_cache.stats()
+
 @router.post("/mood-alchemy", response_model=MoodAlchemyResponse)
-async def mood_alchemy(request: TaskPlanRequest):
+async def mood_alchemy(request: MoodAlchemyRequest, current_user: Optional[dict] = Depends(get_optional_user)):
     """
     情绪炼金术接口
     """
     try:
+        # 登录用户传入filename且后台已为相同内容生成过时直接返回，否则调用LLM
+        meta = get_enriched_metadata(current_user["id"], request.filename, request.message) if current_user else None
+        if meta and all(meta.get(field) for field in ("mood_color", "mood_keyword", "soul_insight")):
+            return MoodAlchemyResponse(
+                mood_color=meta["mood_color"],
+                mood_keyword=meta["mood_keyword"],
+                soul_insight=meta["soul_insight"]
+            )
         prompt = f"""
         用户输入: "{request.message}"
         
@@ -101,41 +130,15 @@ async def mood_alchemy(request: TaskPlanRequest):
         }}
         """
         
-        response_text = await llm.chat(prompt, "你是情绪炼金术师")
-        
-        if not response_text:
-             return MoodAlchemyResponse(
+        result = await complete_model(llm, "你是情绪炼金术师", prompt, MoodAlchemyResponse,
+                                      endpoint="llm/mood-alchemy", template="mood")
+        if result is None:
+            return MoodAlchemyResponse(
                 mood_color="#cccccc",
                 mood_keyword="未知",
                 soul_insight="情绪如雾，暂时无法看清。"
             )
-
-        # Clean up response
-        clean_text = response_text.strip()
-        if clean_text.startswith("```"):
-            newline_idx = clean_text.find("\n")
-            if newline_idx != -1:
-                clean_text = clean_text[newline_idx+1:]
-        if clean_text.endswith("```"):
-            clean_text = clean_text[:-3]
-        clean_text = clean_text.strip()
-        
-        try:
-            data = json.loads(clean_text)
-            return MoodAlchemyResponse(**data)
-        except json.JSONDecodeError:
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
-                try:
-                    data = json.loads(json_match.group(0))
-                    return MoodAlchemyResponse(**data)
-                except Exception:
-                    pass
-            return MoodAlchemyResponse(
-                mood_color="#ff9b9b",
-                mood_keyword="复杂",
-                soul_insight="你的情绪丰富多彩，难以言喻。"
-            )
+        return result
             
     except Exception as e:
         print(f"Mood alchemy error: {e}")
@@ -251,15 +254,26 @@ async def llm_ui():
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, current_user: Optional[dict] = Depends(get_optional_user)):
     """
-    同步聊天接口
+    同步聊天接口，对话记忆按登录用户和conversation_id隔离
+    未登录用户按客户端的conversation_id隔离(未提供或为default时分配一个新的并在响应中返回)，记忆只保存在内存中
     """
     try:
-        response = await llm.chat(request.message, request.role)
+        if current_user:
+            user_id = current_user["id"]
+            conversation_id = request.conversation_id or "default"
+        else:
+            user_id = "anonymous"
+            conversation_id = request.conversation_id
+            if not conversation_id or conversation_id == "default":
+                conversation_id = uuid.uuid4().hex
+        response = await llm.chat(request.message, request.role,
+                                  user_id=user_id, conversation_id=conversation_id,
+                                  persist=current_user is not None)
         if response is None:
             raise HTTPException(status_code=500, detail="LLM未正确配置或返回空响应")
-        return ChatResponse(response=response)
+        return ChatResponse(response=response, conversation_id=conversation_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -281,30 +295,23 @@ async def stream_generator(role: str, message: str):
     流式响应生成器
     """
     try:
-        for text in llm.request(role, message):
+        async for text in llm.request_async(role, message):
             yield text
-            # 添加小延迟以模拟流式效果
-            await asyncio.sleep(0.01)
     except Exception as e:
         yield f"Error: {str(e)}"
 
 
-@router.post("/plan-tasks", response_model=TaskPlanResponse)
-async def plan_tasks(request: TaskPlanRequest):
-    """
-    任务规划接口
-    """
-    try:
-        current_time = datetime.now().strftime("%H:%M")
-        prompt = f"""
-        用户想要做的事情: "{request.message}"
+def build_plan_prompt(message: str) -> str:
+    current_time = datetime.now().strftime("%H:%M")
+    return f"""
+        用户想要做的事情: "{message}"
         当前时间: {current_time}
         
         请你作为一位贴心的任务规划助手，为用户安排合理的时间表，并给出一句简短的建议或鼓励。
         
         要求:
         1. 返回格式必须是纯JSON，不要包含markdown代码块标记。
-        2. JSON结构如下:
+        2. JSON结构如下(先输出suggestion，再输出schedule):
         {{
             "suggestion": "简短的建议或鼓励",
             "schedule": [
@@ -314,75 +321,44 @@ async def plan_tasks(request: TaskPlanRequest):
         }}
         3. 时间安排要合理，基于当前时间往后规划。
         """
-        
-        response_text = await llm.chat(prompt, "你是任务规划助手")
-        if not response_text:
-            now = datetime.now()
-            hour = now.hour
-            if hour >= 22 or hour <= 5:
-                suggestion = "深夜里还在学习的宝最棒了！"
-            elif hour < 9:
-                suggestion = "清晨开始，效率加倍！"
-            elif hour < 18:
-                suggestion = "坚持不懈，马上见到成效！"
-            else:
-                suggestion = "晚间也要照顾好自己，适度休息～"
-            parts = [p.strip() for p in re.split(r"[，,；;。.\n]+", request.message) if p.strip()]
-            if not parts:
-                parts = [request.message.strip()]
-            base = now
-            step = 45
-            schedule = []
-            for i, p in enumerate(parts[:4]):
-                t = (base + timedelta(minutes=i * step)).strftime("%H:%M")
-                schedule.append(TaskScheduleItem(time=t, task=p))
-            return TaskPlanResponse(suggestion=suggestion, schedule=schedule)
-
-        # Clean up response if it contains markdown code blocks
-        clean_text = response_text.strip()
-        # Remove ```json or ``` at start
-        if clean_text.startswith("```"):
-            # Find first newline
-            newline_idx = clean_text.find("\n")
-            if newline_idx != -1:
-                clean_text = clean_text[newline_idx+1:]
-        # Remove ``` at end
-        if clean_text.endswith("```"):
-            clean_text = clean_text[:-3]
-             
-        clean_text = clean_text.strip()
-        
-        try:
-            data = json.loads(clean_text)
-            return TaskPlanResponse(**data)
-        except json.JSONDecodeError:
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
-                try:
-                    data = json.loads(json_match.group(0))
-                    return TaskPlanResponse(**data)
-                except Exception:
-                    pass
-            now = datetime.now()
-            hour = now.hour
-            if hour >= 22 or hour <= 5:
-                suggestion = "深夜里还在学习的宝最棒了！"
-            elif hour < 9:
-                suggestion = "清晨开始，效率加倍！"
-            elif hour < 18:
-                suggestion = "坚持不懈，马上见到成效！"
-            else:
-                suggestion = "晚间也要照顾好自己，适度休息～"
-            parts = [p.strip() for p in re.split(r"[，,；;。.\n]+", request.message) if p.strip()]
-            if not parts:
-                parts = [request.message.strip()]
-            base = now
-            step = 45
-            schedule = []
-            for i, p in enumerate(parts[:4]):
-                t = (base + timedelta(minutes=i * step)).strftime("%H:%M")
-                schedule.append(TaskScheduleItem(time=t, task=p))
-            return TaskPlanResponse(suggestion=suggestion, schedule=schedule)
+
+
+def fallback_plan(message: str) -> TaskPlanResponse:
+    # LLM不可用或输出无法校验时，按标点拆分用户输入，每45分钟安排一项
+    now = datetime.now()
+    hour = now.hour
+    if hour >= 22 or hour <= 5:
+        suggestion = "深夜里还在学习的宝最棒了！"
+    elif hour < 9:
+        suggestion = "清晨开始，效率加倍！"
+    elif hour < 18:
+        suggestion = "坚持不懈，马上见到成效！"
+    else:
+        suggestion = "晚间也要照顾好自己，适度休息～"
+    parts = [p.strip() for p in re.split(r"[，,；;。.\n]+", message) if p.strip()]
+    if not parts:
+        parts = [message.strip()]
+    step = 45
+    schedule = []
+    for i, p in enumerate(parts[:4]):
+        t = (now + timedelta(minutes=i * step)).strftime("%H:%M")
+        schedule.append(TaskScheduleItem(time=t, task=p))
+    return TaskPlanResponse(suggestion=suggestion, schedule=schedule)
+
+
+@router.post("/plan-tasks", response_model=TaskPlanResponse)
+async def plan_tasks(request: TaskPlanRequest):
+    """
+    任务规划接口
+    """
+    try:
+        prompt = build_plan_prompt(request.message)
+        # prompt中含当前时间(精确到分钟)，缓存只在同一分钟内的重试间命中
+        result = await complete_model(llm, "你是任务规划助手", prompt, TaskPlanResponse,
+                                      endpoint="llm/plan-tasks", template="plan")
+        if result is None:
+            return fallback_plan(request.message)
+        return result
             
     except Exception as e:
         print(f"Plan tasks error: {e}")
@@ -391,3 +367,29 @@ async def plan_tasks(request: TaskPlanRequest):
             schedule=[], 
             error=str(e)
         )
+
+
+@router.post("/plan-tasks/stream")
+async def plan_tasks_stream(request: TaskPlanRequest):
+    """
+    流式任务规划接口，NDJSON：每行一个到目前为止的部分结果，suggestion先于schedule出现；
+    最后一行带"done": true，为校验后的完整结果(校验失败时为兜底规划)
+    """
+    return StreamingResponse(plan_stream_generator(request.message),
+                             media_type="application/x-ndjson; charset=utf-8")
+
+
+async def plan_stream_generator(message: str):
+    last = None
+    try:
+        async for partial in stream_partial(llm, "你是任务规划助手", build_plan_prompt(message)):
+            if isinstance(partial, dict):
+                last = partial
+                yield json.dumps({"partial": partial, "done": False}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        logger.bind(tag=TAG).error(f"Plan tasks stream error: {e}")
+    try:
+        final = TaskPlanResponse(**last) if last is not None else fallback_plan(message)
+    except Exception:
+        final = fallback_plan(message)
+    yield json.dumps({"partial": jsonable_encoder(final), "done": True}, ensure_ascii=False) + "\n"
@@ -5,11 +5,11 @@ from typing import List, Optional, Dict
 import uuid
 import threading
 import time
-import re
 import os
 import concurrent.futures
 from ...core.llm.qwen import LLM
 from ...core.tts.huoshan import TTS
+from ...core.common.text_processor import StreamSegmenter
 from ...log.load_log import logger
 
 TAG = __name__
@@ -35,14 +35,12 @@ def process_thread(text: str, session_id: str):
         llm = LLM()
         tts = TTS()
 
-        buffer = ""
-        split_pattern = r'([\.?!。？！\n]+)'
+        # 增量分句，首段快速切分的阈值见config的text_processor.stream
+        segmenter = StreamSegmenter(tts.text_processor)
 
         role = "你是助手"
 
         first_audio_done = False
-        fast_start_min_chars = 8
-        fast_start_max_chars = 20
         processing_finished = False
         pending_count = 0
         executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
@@ -93,6 +91,15 @@ def process_thread(text: str, session_id: str):
 
             future.add_done_callback(on_done)
 
+        def speak(sentence: str):
+            # 首段同步生成，尽快出声；之后的段并发生成
+            nonlocal first_audio_done
+            if not first_audio_done:
+                _generate_audio(tts, sentence, session_id)
+                first_audio_done = True
+            else:
+                submit_async(sentence)
+
         for chunk in llm.request(role, text):
             sessions[session_id]["queue"].append({
                 "type": "text",
@@ -100,55 +107,11 @@ def process_thread(text: str, session_id: str):
                 "timestamp": time.time()
             })
 
-            buffer += chunk
-
-            if not first_audio_done:
-                stripped_len = len(buffer.strip())
-                if stripped_len >= fast_start_min_chars:
-                    window = buffer[:fast_start_max_chars]
-                    pm = re.search(r'([\.?!。？！,，;；:：、\n])', window)
-                    cut_idx = pm.end() if pm else min(len(buffer), fast_start_max_chars)
-                    sentence = buffer[:cut_idx]
-                    buffer = buffer[cut_idx:]
-                    if sentence.strip():
-                        _generate_audio(tts, sentence, session_id)
-                        first_audio_done = True
-
-            while True:
-                match = re.search(split_pattern, buffer)
-                if match:
-                    end_idx = match.end()
-                    sentence = buffer[:end_idx]
-                    buffer = buffer[end_idx:]
-                    if sentence.strip():
-                        if not first_audio_done:
-                            _generate_audio(tts, sentence, session_id)
-                            first_audio_done = True
-                        else:
-                            submit_async(sentence)
-                else:
-                    if len(buffer) > 50:
-                        comma_match = re.search(r'([,，])', buffer)
-                        if comma_match:
-                            end_idx = comma_match.end()
-                            sentence = buffer[:end_idx]
-                            buffer = buffer[end_idx:]
-                            if sentence.strip():
-                                if not first_audio_done:
-                                    _generate_audio(tts, sentence, session_id)
-                                    first_audio_done = True
-                                else:
-                                    submit_async(sentence)
-                        else:
-                            pass
-                    break
+            for sentence in segmenter.feed(chunk):
+                speak(sentence)
 
-        if buffer.strip():
-            if not first_audio_done:
-                _generate_audio(tts, buffer, session_id)
-                first_audio_done = True
-            else:
-                submit_async(buffer)
+        for sentence in segmenter.flush():
+            speak(sentence)
 
         processing_finished = True
         if pending_count == 0:
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, UploadFile, File
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from ...core.tts.huoshan import TTS
+import asyncio
 import os
 import uuid
 
@@ -36,8 +37,9 @@ async def text_to_audio(request: TextToAudioRequest):
         # 生成唯一的文件名，避免冲突
         unique_filename = f"{uuid.uuid4().hex}_{request.filename}"
         
-        # 调用TTS模块进行文本转语音
-        success = tts.text_to_audio(request.text, unique_filename)
+        # 调用TTS模块进行文本转语音；整段朗读按batch优先级执行，不挤占对话播报的并发名额
+        # text_to_audio内部使用asyncio.run，放到工作线程中执行
+        success = await asyncio.to_thread(tts.text_to_audio, request.text, unique_filename, "batch")
         
         if success:
             # 构建音频文件的完整路径
@@ -98,8 +100,9 @@ async def text_to_audio_direct(request: TextToAudioRequest):
         # 生成唯一的文件名
         unique_filename = f"{uuid.uuid4().hex}_{request.filename}"
         
-        # 调用TTS模块进行文本转语音
-        success = tts.text_to_audio(request.text, unique_filename)
+        # 调用TTS模块进行文本转语音；整段朗读按batch优先级执行，不挤占对话播报的并发名额
+        # text_to_audio内部使用asyncio.run，放到工作线程中执行
+        success = await asyncio.to_thread(tts.text_to_audio, request.text, unique_filename, "batch")
         
         if success:
             # 构建音频文件的完整路径
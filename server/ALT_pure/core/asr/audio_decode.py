@@ -0,0 +1,242 @@
+# FunASR.read_audio的解码层，返回目标采样率的单声道float32一维张量：
+# 1.PCM wav(16/32bit整数或32bit浮点)直接用np.memmap读取data块，不经过解码后端；16kHz单声道时只做一次int16->float转换(float32的wav不复制)
+# 2.其它采样率/声道数的wav在进程内混音，重采样器(Resample的卷积核)按(原采样率,目标采样率)缓存，不再每个文件新建
+# 3.mp3/m4a等格式依次尝试可用的后端：sox_effects、torchaudio.load、soundfile、ffmpeg(imageio_ffmpeg)，后端是否可用只检测一次
+# 4.除路径外也接受内存中的音频文件(bytes/bytearray/memoryview/二进制文件对象)
+# 基准: 在server目录下运行 python -m ALT_pure.core.asr.audio_decode_bench [--audio test.wav] [--repeat 20]
+import io
+import os
+import struct
+import subprocess
+import tempfile
+from collections import namedtuple
+from functools import lru_cache
+from typing import BinaryIO, Optional, Tuple, Union
+import numpy as np
+import torch
+import torchaudio
+from ALT_pure.log.load_log import logger
+TAG=__name__
+
+WavInfo=namedtuple("WavInfo",["tag","channels","rate","bits","offset","size"])
+WAVE_FORMAT_PCM=1
+WAVE_FORMAT_IEEE_FLOAT=3
+WAVE_FORMAT_EXTENSIBLE=0xFFFE
+_WAV_DTYPES={(WAVE_FORMAT_PCM,16): np.int16,(WAVE_FORMAT_PCM,32): np.int32,(WAVE_FORMAT_IEEE_FLOAT,32): np.float32}
+_SCALES={np.dtype(np.int16): 1/32768,np.dtype(np.int32): 1/2147483648}
+
+AudioSource=Union[str,os.PathLike,bytes,bytearray,memoryview,BinaryIO]
+
+
+def read_wav_header(f:BinaryIO)->Optional[WavInfo]:
+    # 从文件开头解析RIFF/WAVE头，返回格式和data块的位置；不是wav时返回None
+    header=f.read(12)
+    if len(header)<12 or header[:4]!=b"RIFF" or header[8:12]!=b"WAVE":
+        return None
+    fmt=None
+    while True:
+        chunk=f.read(8)
+        if len(chunk)<8:
+            raise ValueError("wav文件缺少data块")
+        name,size=struct.unpack("<4sI",chunk)
+        if name==b"fmt ":
+            body=f.read(size)
+            fmt=struct.unpack("<HHIIHH",body[:16])
+            if fmt[0]==WAVE_FORMAT_EXTENSIBLE and size>=26:
+                # 扩展格式的真实格式是SubFormat GUID的前两个字节
+                fmt=(struct.unpack("<H",body[24:26])[0],)+fmt[1:]
+            f.seek(size&1,1)
+        elif name==b"data":
+            if fmt is None:
+                raise ValueError("wav文件缺少fmt块")
+            return WavInfo(fmt[0],fmt[1],fmt[2],fmt[5],f.tell(),size)
+        else:
+            f.seek(size+(size&1),1)
+
+
+def sniff(data)->Optional[str]:
+    # 根据容器头判断内存中的数据是不是音频文件，返回格式名；裸PCM返回None
+    # 不按mp3帧同步字判断：静音的int16 PCM(-1为FF FF)也会匹配，没有ID3标签的mp3需要以文件路径或文件对象传入
+    head=bytes(memoryview(data).cast("B")[:12])
+    if head[:4]==b"RIFF" and head[8:12]==b"WAVE":
+        return "wav"
+    if head[:3]==b"ID3":
+        return "mp3"
+    if head[4:8]==b"ftyp":
+        return "m4a"
+    if head[:4]==b"OggS":
+        return "ogg"
+    if head[:4]==b"fLaC":
+        return "flac"
+    return None
+
+
+def _read_wav(path:Optional[str],data:Optional[memoryview])->Optional[Tuple[np.ndarray,int]]:
+    # PCM wav返回((帧数,)或(帧数,声道数)的采样, 采样率)，不复制数据；压缩格式等返回None交给解码后端
+    if path is not None:
+        with open(path,"rb") as f:
+            info=read_wav_header(f)
+        length=os.path.getsize(path)
+    else:
+        info=read_wav_header(io.BytesIO(data))
+        length=len(data)
+    if info is None:
+        return None
+    dtype=_WAV_DTYPES.get((info.tag,info.bits))
+    if dtype is None or info.channels<1:
+        return None
+    frame=info.channels*info.bits//8
+    # data块的长度可能写错(录音中断)，以实际长度为准
+    frames=min(info.size,length-info.offset)//frame
+    if frames<=0:
+        return np.zeros(0,dtype=dtype),info.rate
+    if path is not None:
+        # 写时复制的映射：转换时可以原地修改而不影响文件，float32单声道可以直接交给torch
+        samples=np.memmap(path,dtype=dtype,mode="c",offset=info.offset,shape=(frames*info.channels,))
+    else:
+        samples=np.frombuffer(data,dtype=dtype,count=frames*info.channels,offset=info.offset)
+    if info.channels>1:
+        samples=samples.reshape(frames,info.channels)
+    return samples,info.rate
+
+
+@lru_cache(maxsize=16)
+def get_resampler(orig_freq:int,new_freq:int)->torchaudio.transforms.Resample:
+    # 卷积核只在创建时计算，按采样率对缓存；forward不修改模块状态，多线程共用是安全的
+    return torchaudio.transforms.Resample(orig_freq=orig_freq,new_freq=new_freq)
+
+
+def _finish(samples:np.ndarray,rate:int,sampling_rate:int)->torch.Tensor:
+    # 整数采样归一化到[-1,1)，多声道取平均，采样率不同时重采样
+    if samples.dtype in _SCALES:
+        wav=torch.from_numpy(samples.astype(np.float32))
+        wav*=_SCALES[samples.dtype]
+    else:
+        if not samples.flags.writeable:
+            samples=samples.copy()
+        wav=torch.from_numpy(samples)
+    if wav.dim()>1:
+        wav=wav.mean(dim=1)
+    if rate!=sampling_rate:
+        wav=get_resampler(rate,sampling_rate)(wav.unsqueeze(0)).squeeze(0)
+    return wav
+
+
+def _tiny_wav()->bytes:
+    # 探测后端用的10ms静音wav
+    pcm=np.zeros(160,dtype=np.int16).tobytes()
+    return (b"RIFF"+struct.pack("<I",36+len(pcm))+b"WAVE"
+            +b"fmt "+struct.pack("<IHHIIHH",16,WAVE_FORMAT_PCM,1,16000,32000,2,16)
+            +b"data"+struct.pack("<I",len(pcm))+pcm)
+
+
+def _probe(name:str)->bool:
+    if name=="sox":
+        torchaudio.sox_effects.apply_effects_tensor(torch.zeros(1,160),16000,[["channels","1"]])
+    elif name=="torchaudio":
+        torchaudio.load(io.BytesIO(_tiny_wav()))
+    elif name=="soundfile":
+        import soundfile
+        soundfile.read(io.BytesIO(_tiny_wav()))
+    elif name=="ffmpeg":
+        import imageio_ffmpeg
+        imageio_ffmpeg.get_ffmpeg_exe()
+    return True
+
+
+@lru_cache(maxsize=1)
+def available_backends()->Tuple[str,...]:
+    # 检测一次可用的解码后端(按尝试顺序)，结果在进程内缓存
+    backends=[]
+    for name in ("sox","torchaudio","soundfile","ffmpeg"):
+        try:
+            _probe(name)
+            backends.append(name)
+        except Exception as e:
+            logger.bind(tag=TAG).debug(f"音频解码后端{name}不可用: {e}")
+    return tuple(backends)
+
+
+def _decode_sox(path,data,sampling_rate):
+    if path is None:
+        raise ValueError("sox_effects只支持文件路径")
+    wav,sr=torchaudio.sox_effects.apply_effects_file(path,effects=[["channels","1"],["rate",str(sampling_rate)]])
+    return wav.squeeze(0)
+
+
+def _decode_torchaudio(path,data,sampling_rate):
+    wav,sr=torchaudio.load(path if path is not None else io.BytesIO(data))
+    if wav.size(0)>1:
+        wav=wav.mean(dim=0,keepdim=True)
+    if sr!=sampling_rate:
+        wav=get_resampler(sr,sampling_rate)(wav)
+    return wav.squeeze(0)
+
+
+def _decode_soundfile(path,data,sampling_rate):
+    import soundfile
+    samples,sr=soundfile.read(path if path is not None else io.BytesIO(data),dtype="float32")
+    return _finish(samples,sr,sampling_rate)
+
+
+def _decode_ffmpeg(path,data,sampling_rate):
+    # ffmpeg一次完成解码、混音和重采样，输出float32 PCM到标准输出
+    # 内存中的文件先写入临时文件：m4a的moov可能在文件末尾，从管道读取时ffmpeg无法回跳，会得到空的输出
+    import imageio_ffmpeg
+    temp=None
+    if path is None:
+        fd,temp=tempfile.mkstemp(prefix="decode_",suffix="."+(sniff(data) or "bin"))
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+        path=temp
+    try:
+        cmd=[
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-v","error",
+            "-i",path,
+            "-f","f32le",
+            "-ac","1",
+            "-ar",str(sampling_rate),
+            "pipe:1"
+        ]
+        result=subprocess.run(cmd,capture_output=True,check=False)
+    finally:
+        if temp is not None:
+            os.remove(temp)
+    if result.returncode!=0 or not result.stdout:
+        raise RuntimeError(result.stderr.decode("utf-8",errors="ignore").strip() or "ffmpeg没有输出音频")
+    return torch.from_numpy(np.frombuffer(result.stdout,dtype=np.float32).copy())
+
+
+_DECODERS={
+    "sox": _decode_sox,
+    "torchaudio": _decode_torchaudio,
+    "soundfile": _decode_soundfile,
+    "ffmpeg": _decode_ffmpeg,
+}
+
+
+def decode_audio(source:AudioSource,sampling_rate:int=16000)->torch.Tensor:
+    # 用户接口，source为音频路径或内存中的音频文件，返回sampling_rate的单声道float32一维张量
+    path=data=None
+    if isinstance(source,(bytes,bytearray,memoryview)):
+        data=memoryview(source).cast("B")
+    elif hasattr(source,"read"):
+        data=memoryview(source.read())
+    else:
+        path=os.fspath(source)
+
+    wav=_read_wav(path,data)
+    if wav is not None:
+        return _finish(wav[0],wav[1],sampling_rate)
+
+    backends=available_backends()
+    if not backends:
+        raise RuntimeError("没有可用的音频解码后端，请安装 Sox (UNIX OS) / Soundfile / ffmpeg (imageio-ffmpeg)")
+    errors=[]
+    for name in backends:
+        try:
+            return _DECODERS[name](path,data,sampling_rate)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    raise RuntimeError("音频解码失败; "+"; ".join(errors))
@@ -0,0 +1,119 @@
+# FunASR.read_audio解码基准：在server目录下运行 python -m ALT_pure.core.asr.audio_decode_bench [--audio test.wav] [--seconds 30] [--repeat 20]
+# 用ffmpeg(imageio_ffmpeg)从同一段音频生成16kHz单声道wav、44.1kHz双声道wav、mp3和m4a，比较每次解码的耗时(墙钟，ffmpeg子进程也计入)
+# legacy为原来的read_audio(每次检测后端、先试sox_effects、每个文件新建Resample)，当前torchaudio不支持时显示n/a
+# uncached为新的解码层但每次清空后端检测和重采样器缓存；path/bytes为新的解码层分别传入路径和内存中的文件
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import wave
+import numpy as np
+import torchaudio
+from . import audio_decode
+from .audio_decode import decode_audio
+
+SAMPLE_RATE=16000
+FORMATS=(
+    ("wav 16k mono",".wav",["-ar","16000","-ac","1","-c:a","pcm_s16le"]),
+    ("wav 44.1k stereo",".wav",["-ar","44100","-ac","2","-c:a","pcm_s16le"]),
+    ("mp3 44.1k stereo",".mp3",["-ar","44100","-ac","2","-c:a","libmp3lame","-b:a","128k"]),
+    ("m4a 44.1k stereo",".m4a",["-ar","44100","-ac","2","-c:a","aac","-b:a","128k"]),
+)
+
+
+def legacy_read_audio(path:str,sampling_rate:int=16000):
+    # 原来的FunASR.read_audio
+    list_backends=torchaudio.list_audio_backends()
+    assert len(list_backends)>0
+    try:
+        effects=[["channels","1"],["rate",str(sampling_rate)]]
+        wav,sr=torchaudio.sox_effects.apply_effects_file(path,effects=effects)
+    except Exception:
+        wav,sr=torchaudio.load(path)
+        if wav.size(0)>1:
+            wav=wav.mean(dim=0,keepdim=True)
+        if sr!=sampling_rate:
+            transform=torchaudio.transforms.Resample(orig_freq=sr,new_freq=sampling_rate)
+            wav=transform(wav)
+            sr=sampling_rate
+    assert sr==sampling_rate
+    return wav.squeeze(0)
+
+
+def uncached(path:str):
+    audio_decode.available_backends.cache_clear()
+    audio_decode.get_resampler.cache_clear()
+    return decode_audio(path,SAMPLE_RATE)
+
+
+def make_inputs(source:str,directory:str)->list:
+    import imageio_ffmpeg
+    inputs=[]
+    for label,suffix,args in FORMATS:
+        path=os.path.join(directory,label.replace(" ","_").replace(".","")+suffix)
+        cmd=[imageio_ffmpeg.get_ffmpeg_exe(),"-v","error","-y","-i",source]+args+[path]
+        subprocess.run(cmd,check=True)
+        inputs.append((label,path))
+    return inputs
+
+
+def synth_wav(path:str,seconds:float):
+    # 没有给出音频时生成噪声中夹杂谐波的合成音频
+    rng=np.random.default_rng(0)
+    t=np.arange(int(seconds*SAMPLE_RATE))/SAMPLE_RATE
+    pitch=sum(np.sin(2*np.pi*f*t)/k for k,f in enumerate((180,360,540,720),1))
+    audio=(np.sin(2*np.pi*0.3*t)>0)*pitch*np.abs(np.sin(2*np.pi*4*t))*6000+rng.normal(0,200,len(t))
+    with wave.open(path,"wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(np.clip(audio,-32768,32767).astype(np.int16).tobytes())
+
+
+def measure(func,arg,repeat:int)->float:
+    # 返回每次调用的毫秒数；不支持时返回None
+    try:
+        func(arg)
+    except Exception:
+        return None
+    start=time.perf_counter()
+    for _ in range(repeat):
+        func(arg)
+    return (time.perf_counter()-start)/repeat*1000
+
+
+def run(source:str,repeat:int):
+    print(f"backends: {', '.join(audio_decode.available_backends()) or 'none'}")
+    with tempfile.TemporaryDirectory() as directory:
+        inputs=make_inputs(source,directory)
+        modes=(
+            ("legacy",legacy_read_audio,False),
+            ("uncached",uncached,False),
+            ("path",lambda p: decode_audio(p,SAMPLE_RATE),False),
+            ("bytes",lambda b: decode_audio(b,SAMPLE_RATE),True),
+        )
+        print(f"{'input':20s}{'size KB':>9s}"+"".join(f"{name+' ms':>13s}" for name,_,_ in modes))
+        for label,path in inputs:
+            with open(path,"rb") as f:
+                data=f.read()
+            row=f"{label:20s}{len(data)/1024:9.0f}"
+            for name,func,in_memory in modes:
+                ms=measure(func,data if in_memory else path,repeat)
+                row+=f"{'n/a':>13s}" if ms is None else f"{ms:13.2f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="FunASR.read_audio解码基准")
+    parser.add_argument("--audio",type=str,default=None,help="源音频(任意ffmpeg能读取的格式)，不传则使用合成音频")
+    parser.add_argument("--seconds",type=float,default=30,help="合成音频的时长(秒)")
+    parser.add_argument("--repeat",type=int,default=20,help="每种输入解码的次数")
+    args=parser.parse_args()
+    if args.audio:
+        run(args.audio,args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            source=os.path.join(directory,"source.wav")
+            synth_wav(source,args.seconds)
+            run(source,args.repeat)
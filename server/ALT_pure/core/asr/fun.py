@@ -1,129 +1,160 @@
 import warnings
 warnings.filterwarnings("ignore", message="Couldn't find ffmpeg or avconv - defaulting to ffmpeg, but may not work")
 import os
-import torchaudio
+import numpy as np
+import torch
 import logging
-from funasr import AutoModel
+import threading
 from pathlib import Path
 from ALT_pure.log.load_log import logger
 from ALT_pure.config.load_config import config
 import asyncio
 from functools import partial
+from .audio_decode import decode_audio, sniff
 TAG=__name__
 
 logging.getLogger("root").setLevel(logging.ERROR)
+
+
+def is_pcm(audio)->bool:
+    # 内存中的PCM缓冲区(bytes/bytearray/memoryview)，其它按文件路径处理
+    return isinstance(audio,(bytes,bytearray,memoryview))
+
+
+def pcm_to_tensor(pcm)->torch.Tensor:
+    # 16kHz单声道int16 PCM转为[-1,1)的float32一维张量，frombuffer不复制原缓冲区
+    samples=np.frombuffer(pcm,dtype=np.int16).astype(np.float32)
+    samples*=1.0/32768.0
+    return torch.from_numpy(samples)
+
+
+MODEL_PATH=Path(os.path.join(os.path.dirname(__file__), "../common/model/funasr"))
+VAD_PATH=Path(os.path.join(os.path.dirname(__file__), "../common/model/fsmn_vad"))
+PUNC_PATH=Path(os.path.join(os.path.dirname(__file__), "../common/model/ct_punc"))
+
+
+class _FunASRModel:
+    # 进程内共享的FunASR AutoModel(paraformer+fsmn_vad+ct_punc)，所有FunASR/ASR实例共用一份
+    # 第一次使用时才导入funasr并加载(加锁，只加载一次)；config asr.local.model不是local时不加载
+    # 同一个AutoModel的generate不保证线程安全，按顺序执行
+    def __init__(self):
+        self.logger=logger.bind(tag=TAG)
+        self._model=None
+        self._failed=False
+        self._load_lock=threading.Lock()
+        self._generate_lock=threading.Lock()
+
+    @property
+    def enabled(self)->bool:
+        return config.get('asr',{'local':{'model': "none"}}).get('local',{'model': "none"}).get('model', "none") == "local"
+
+    @property
+    def loaded(self)->bool:
+        return self._model is not None
+
+    def get(self):
+        # 返回加载好的模型；未启用或加载失败返回None(加载失败后不再重试，与原来在__init__中加载一次相同)
+        if self._model is not None:
+            return self._model
+        if not self.enabled or self._failed:
+            return None
+        with self._load_lock:
+            if self._model is None and not self._failed:
+                try:
+                    from funasr import AutoModel
+                    self._model=AutoModel(
+                        model=MODEL_PATH,
+                        vad_model=VAD_PATH,
+                        punc_model=PUNC_PATH,
+                        trust_remote_code=False,
+                        disable_update=True,
+                        disable_log=True,
+                    )
+                except Exception as e:
+                    self.logger.error(f"local model 加载失败: {e}")
+                    self._failed=True
+        return self._model
+
+    def generate(self,**kwargs):
+        # 阻塞调用，需在线程中执行；模型不可用时返回None
+        model=self.get()
+        if model is None:
+            return None
+        with self._generate_lock:
+            return model.generate(**kwargs)
+
+
+funasr_model=_FunASRModel()
+
+
+async def preload_funasr():
+    # 应用启动时调用：config asr.local.preload为true时在线程中提前加载模型，避免第一次识别时等待
+    local=(config.get("asr",{}) or {}).get("local",{}) or {}
+    if funasr_model.enabled and local.get("preload",False):
+        await asyncio.to_thread(funasr_model.get)
+
+
 class FunASR:
+    # 模型由funasr_model在第一次识别时加载并在进程内共享，创建实例不加载模型
     def __init__(self):
         self.logger = logger.bind(tag=TAG)
-        self.model_path = Path(os.path.join(os.path.dirname(__file__), "../common/model/funasr"))
-        self.vad_path = Path(os.path.join(os.path.dirname(__file__), "../common/model/fsmn_vad"))
-        self.punc_path = Path(os.path.join(os.path.dirname(__file__), "../common/model/ct_punc"))
-        self.model=None
-        if config.get('asr',{'local':{'model': "none"}}).get('local',{'model': "none"}).get('model', "none") == "local":
-            try:
-                self.model=AutoModel(
-                    model=self.model_path,
-                    vad_model=self.vad_path,
-                    punc_model=self.punc_path,
-                    trust_remote_code=False,
-                    disable_update=True,
-                    disable_log=True,
-                )
-            except Exception as e:
-                self.logger.error("local model 加载失败")
-                self.model=None
-
-    async def audio_to_text_local(self,audio_path):
-        if self.model is None:
+
+    async def audio_to_text_local(self,audio):
+        # audio可以是音频路径，也可以是内存中的16kHz单声道int16 PCM(如VAD.utterances产出的memoryview)
+        if not funasr_model.enabled:
             self.logger.error("请先config配置模型,本次返回空")
             return ""
-        if not os.path.exists(audio_path):
-            self.logger.error(f"音频文件不存在: {audio_path}")
-            return ""
-        loop = asyncio.get_event_loop()
-        audio_data = await loop.run_in_executor(
-            None,
-            partial(self.read_audio, sampling_rate=16000),
-            audio_path
-        )
-        # audio_data = self.read_audio(audio_path, sampling_rate=16000)
-
-        # res = self.model.generate(
-        #     input=audio_data,
-        #     batch_size_s=3000
-        # )
-        res = await loop.run_in_executor(
-            None,
-            partial(
-                self.model.generate,
-                input=audio_data,
-                batch_size_s=3000
-            )
-        )
-        if res is None:
+        res=await self._generate(audio)
+        if not res:
             return ""
 
         return res[0]['text']
 
-    async def get_time_pos_local(self,audio_path):
-        if self.model is None:
+    async def get_time_pos_local(self,audio):
+        if not funasr_model.enabled:
             self.logger.error("请在config中将local的model设置为“local”,本次返回空")
             return []
-        if not os.path.exists(audio_path):
-            self.logger.error(f"音频文件不存在: {audio_path}")
+        res=await self._generate(audio)
+        if res is None:
             return []
+
+        return res
+
+    async def _generate(self,audio):
+        # 读取(或转换)音频并识别，读取和推理都在线程池中进行；文件不存在或模型不可用返回None
         loop = asyncio.get_event_loop()
+        # 先确认模型可用(第一次使用时在线程中加载)，加载失败时不再解码音频
+        if not funasr_model.loaded and await loop.run_in_executor(None, funasr_model.get) is None:
+            self.logger.error("local model 不可用,本次返回空")
+            return None
+        if not is_pcm(audio) and not os.path.exists(audio):
+            self.logger.error(f"音频文件不存在: {audio}")
+            return None
         audio_data = await loop.run_in_executor(
             None,
-            partial(self.read_audio, sampling_rate=16000),
-            audio_path
+            partial(self.load_input, sampling_rate=16000),
+            audio
         )
-        # audio_data = self.read_audio(audio_path, sampling_rate=16000)
-
-        # res = self.model.generate(
-        #     input=audio_data,
-        #     batch_size_s=3000
-        # )
-        res = await loop.run_in_executor(
+        return await loop.run_in_executor(
             None,
             partial(
-                self.model.generate,
+                funasr_model.generate,
                 input=audio_data,
                 batch_size_s=3000
             )
         )
 
-        return res
+    @staticmethod
+    def load_input(audio,sampling_rate:int=16000):
+        # 音频路径按文件读取；PCM缓冲区直接转成float张量，不经过临时文件；内存中的wav/mp3等文件按文件解码
+        if is_pcm(audio) and sniff(audio) is None:
+            return pcm_to_tensor(audio)
+        return FunASR.read_audio(audio,sampling_rate)
 
     @staticmethod
-    def read_audio(path: str, sampling_rate: int = 16000):
-        # 读取音频
-        list_backends = torchaudio.list_audio_backends()
-
-        assert len(list_backends) > 0, 'The list of available backends is empty, please install backend manually. \
-                                        \n Recommendations: \n \tSox (UNIX OS) \n \tSoundfile (Windows OS, UNIX OS) \n \tffmpeg (Windows OS, UNIX OS)'
-
-        try:
-            effects = [
-                ['channels', '1'],
-                ['rate', str(sampling_rate)]
-            ]
-
-            wav, sr = torchaudio.sox_effects.apply_effects_file(path, effects=effects)
-        except:
-            wav, sr = torchaudio.load(path)
-
-            if wav.size(0) > 1:
-                wav = wav.mean(dim=0, keepdim=True)
-
-            if sr != sampling_rate:
-                transform = torchaudio.transforms.Resample(orig_freq=sr,
-                                                           new_freq=sampling_rate)
-                wav = transform(wav)
-                sr = sampling_rate
-
-        assert sr == sampling_rate
-        return wav.squeeze(0)
+    def read_audio(path,sampling_rate:int=16000):
+        # 读取音频，path可以是路径或内存中的音频文件；wav直接memmap读取，其它格式交给缓存过的解码后端
+        return decode_audio(path,sampling_rate)
 
 # if __name__ == "__main__":
 #     funasr = FunASR()
@@ -2,14 +2,37 @@ import asyncio
 import time
 from ALT_pure.config.load_config import config
 from ALT_pure.log.load_log import logger
-from dashscope.audio.asr import Recognition
+from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
 import dashscope
 from http import HTTPStatus
 import os
-from core.asr.vad import VAD
+from ALT_pure.core.asr.vad import VAD
 import uuid
-from core.asr.fun import FunASR
+from ALT_pure.core.asr.fun import FunASR, is_pcm
+from ALT_pure.core.common.rate_limiter import get_guard, RetriableError
 TAG=__name__
+# 这些状态码视为可重试：限流和上游繁忙
+RETRIABLE_STATUS={429,500,502,503,504}
+# 流式发送PCM时每帧的字节数(100ms)
+PCM_FRAME_BYTES=3200
+
+
+class _SentenceCollector(RecognitionCallback):
+    # 流式识别回调：收集已结束的句子；Recognition.stop()返回时接收线程已结束
+    def __init__(self):
+        self.sentences=[]
+        self.response=None
+        self.error=None
+
+    def on_event(self,result:RecognitionResult)->None:
+        self.response=result
+        sentence=result.get_sentence()
+        if isinstance(sentence,dict) and RecognitionResult.is_sentence_end(sentence):
+            self.sentences.append(sentence)
+
+    def on_error(self,result:RecognitionResult)->None:
+        self.error=result
+
 
 class ASR:
     def __init__(self):
@@ -24,6 +47,8 @@ class ASR:
         self.vad=None
 
         self.recognition=None
+        self.recognition_options={}
+        # FunASR不持有模型，本地模型在第一次识别时由fun.funasr_model加载，所有ASR实例共用
         self.funasr=FunASR()
 
     def __enter__(self):
@@ -31,10 +56,10 @@ class ASR:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._cleanup()
-    async def audio_to_text(self,input_audio_path:str=""):
-        # 音频转文本，用户接口,传入音频路径则读取音频文件，否则则录制
+    async def audio_to_text(self,input_audio_path=""):
+        # 音频转文本，用户接口,传入音频路径则读取音频文件，传入PCM缓冲区(16kHz单声道int16)则直接识别，否则则录制
         record_mood=False
-        if input_audio_path=="":
+        if not is_pcm(input_audio_path) and input_audio_path=="":
             record_mood=True
 
         if not self._is_loaded:
@@ -49,13 +74,13 @@ class ASR:
 
         if self._is_loaded:
             if record_mood:
-                audio_path=self._record_audio()
+                audio_path=self._record_pcm()
             else:
                 audio_path=input_audio_path
 
-            if (audio_path == "")or (not os.path.exists(audio_path)):
+            if not self._valid_audio(audio_path):
                 # print(audio_path)
-                self.logger.warning(f"无效音频路径 {audio_path}，本次返回空文本")
+                self.logger.warning(f"无效音频 {self._describe(audio_path)}，本次返回空文本")
                 return ""
             else:
                 if self.platform == "paraformer":
@@ -68,10 +93,10 @@ class ASR:
 
         return ""
 
-    async def get_time_pos(self,input_audio_path:str=""):
-        # 【数字人组件】用户接口,传入音频路径则读取音频文件，否则则录制，获取音频中的时间轴
+    async def get_time_pos(self,input_audio_path=""):
+        # 【数字人组件】用户接口,传入音频路径或PCM缓冲区则直接识别，否则则录制，获取音频中的时间轴
         record_mood=False
-        if input_audio_path=="":
+        if not is_pcm(input_audio_path) and input_audio_path=="":
             record_mood=True
 
         if not self._is_loaded:
@@ -86,13 +111,13 @@ class ASR:
 
         if self._is_loaded:
             if record_mood:
-                audio_path=self._record_audio()
+                audio_path=self._record_pcm()
             else:
                 audio_path=input_audio_path
 
-            if (audio_path == "")or (not os.path.exists(audio_path)):
+            if not self._valid_audio(audio_path):
                 # print(audio_path)
-                self.logger.warning(f"无效音频路径 {audio_path}，本次返回空列表")
+                self.logger.warning(f"无效音频 {self._describe(audio_path)}，本次返回空列表")
                 return []
             else:
                 if self.platform == "paraformer":
@@ -117,6 +142,33 @@ class ASR:
             self.vad=VAD()
         return self.vad.record_audio(filename)
 
+    def _record_pcm(self)->memoryview:
+        # 录音人声片段，直接返回内存中的PCM，不写临时文件
+        if not self.vad:
+            self.vad=VAD()
+        return self.vad.record_pcm()
+
+    async def listen(self,max_count:int=None):
+        # 用户接口，异步生成器：持续录音，每段人声识别完成后产出一次文本(空文本跳过)
+        if not self.vad:
+            self.vad=VAD()
+        async for pcm in self.vad.utterances(max_count):
+            text=await self.audio_to_text(pcm)
+            if text:
+                yield text
+
+    @staticmethod
+    def _valid_audio(audio)->bool:
+        if is_pcm(audio):
+            return len(audio)>0
+        return audio!="" and os.path.exists(audio)
+
+    @staticmethod
+    def _describe(audio)->str:
+        if is_pcm(audio):
+            return f"<PCM {len(audio)} bytes>"
+        return str(audio)
+
 
     def _check(self)->bool:
         flag= True
@@ -143,20 +195,22 @@ class ASR:
     async def _request_paraformer(self, audio_path):
         try:
             if self.recognition is None:
+                self.recognition_options=dict(
+                    language_hints=self.language,
+                    disfluency_removal_enabled=False,
+                    semantic_punctuation_enabled=True
+                )
                 self.recognition = Recognition(
                     model=self.model,
                     format="wav",
                     sample_rate=16000,
-                    language_hints=self.language,
-                    disfluency_removal_enabled=False,
-                    semantic_punctuation_enabled=True,
-                    callback= None
+                    callback= None,
+                    **self.recognition_options
                 )
 
 
-            loop=asyncio.get_event_loop()
             start_time=time.time()
-            raw_result=await loop.run_in_executor(None,self.recognition.call,audio_path)
+            raw_result=await get_guard("paraformer",self.api_key).call(self._recognize_once,audio_path)
             end_time=time.time()
             # self.logger.info(f"paraformer请求耗时:{end_time-start_time}")
 
@@ -184,21 +238,23 @@ class ASR:
     async def _get_time_pos(self, audio_path):
         try:
             if self.recognition is None:
+                self.recognition_options=dict(
+                    language_hints=self.language,
+                    timestamp_alignment_enabled=True,
+                    disfluency_removal_enabled=False,
+                    semantic_punctuation_enabled=True
+                )
                 self.recognition = Recognition(
                     model=self.model,
                     format="wav",
                     sample_rate=16000,
-                    language_hints=self.language,
-                    timestamp_alignment_enabled=True,
-                    disfluency_removal_enabled=False,
-                    semantic_punctuation_enabled=True,
-                    callback= None
+                    callback= None,
+                    **self.recognition_options
                 )
 
 
-            loop=asyncio.get_event_loop()
             start_time=time.time()
-            raw_result=await loop.run_in_executor(None,self.recognition.call,audio_path)
+            raw_result=await get_guard("paraformer",self.api_key).call(self._recognize_once,audio_path)
             end_time=time.time()
             # self.logger.info(f"paraformer请求耗时:{end_time-start_time}")
 
@@ -223,6 +279,40 @@ class ASR:
             self.logger.warning(f"paraformer请求失败:{e}")
             return []
 
+    async def _recognize_once(self, audio_path):
+        loop=asyncio.get_event_loop()
+        if is_pcm(audio_path):
+            raw_result=await loop.run_in_executor(None,self._recognize_pcm,audio_path)
+        else:
+            raw_result=await loop.run_in_executor(None,self.recognition.call,audio_path)
+        if raw_result.status_code in RETRIABLE_STATUS:
+            raise RetriableError(f"paraformer返回{raw_result.status_code}")
+        return raw_result
+
+    def _recognize_pcm(self, pcm)->RecognitionResult:
+        # PCM缓冲区走流式识别：按100ms分帧发送后stop，等待接收线程结束，结果与call()的返回值格式相同
+        # Recognition.call只接受文件路径，流式接口需要单独的format="pcm"实例，参数与self.recognition相同
+        collector=_SentenceCollector()
+        recognition=Recognition(
+            model=self.model,
+            format="pcm",
+            sample_rate=16000,
+            callback=collector,
+            **self.recognition_options
+        )
+        recognition.start()
+        try:
+            view=memoryview(pcm)
+            for offset in range(0,len(view),PCM_FRAME_BYTES):
+                recognition.send_audio_frame(view[offset:offset+PCM_FRAME_BYTES])
+        finally:
+            recognition.stop()
+        if collector.error is not None:
+            return collector.error
+        if collector.response is None:
+            raise RuntimeError("paraformer流式识别没有返回结果")
+        return RecognitionResult(collector.response,sentences=collector.sentences)
+
     def _debug(self):
         self.logger.info(f"paraformer参数:{self.platform}")
         self.logger.info(f"api_key:{self.api_key}")
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Optional
+from ALT_pure.log.load_log import logger
+from ALT_pure.config.load_config import config
+import numpy as np
+from .vad import load_silero, silero_utils, PrecomputedProb, UtteranceSegmenter
+from .vad_batch import get_batched_vad
+TAG=__name__
+
+PLATFORMS=("paraformer","local","whisper")
+SAMPLE_RATE=16000
+
+
+class _ModelPool:
+    # 空闲的Silero模型，连接结束后归还复用，新连接不必每次从磁盘加载；同一时间一个模型只属于一路流
+    def __init__(self,max_idle:int=8):
+        self.max_idle=max_idle
+        self._idle=[]
+        self._lock=threading.Lock()
+
+    def acquire(self):
+        # 返回(model, VADIterator)；没有空闲模型时加载新的(阻塞，需在线程中调用)
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        onnx=bool(config.get("vad",{"onnx":False}).get("onnx",False))
+        model,utils=load_silero(onnx)
+        return model,utils[3]
+
+    def release(self,entry):
+        with self._lock:
+            if len(self._idle)<self.max_idle:
+                self._idle.append(entry)
+
+
+_model_pool=_ModelPool()
+_asr_instances={}
+
+
+def _get_asr(platform:str):
+    # paraformer/local共用进程内的ASR实例：PCM输入时每次识别使用独立的Recognition，实例本身不持有单次识别的状态
+    # local的模型由fun.funasr_model在第一次识别时加载，识别按顺序执行
+    asr=_asr_instances.get(platform)
+    if asr is None:
+        from .paraformer import ASR  # 按需导入，只用whisper时不导入dashscope
+        asr=ASR()
+        asr.platform=platform
+        _asr_instances[platform]=asr
+    return asr
+
+
+async def transcribe(platform:str,pcm,language:Optional[str]=None,model_size:str="small")->str:
+    # 把一段16kHz单声道int16 PCM交给指定的ASR后端识别
+    if platform=="whisper":
+        from .whisper_asr import audio_to_text
+        device=config.get("asr",{}).get("whisper",{}).get("device","cpu")
+        return await asyncio.to_thread(audio_to_text,pcm,model_size,language,device)
+    return await _get_asr(platform).audio_to_text(pcm)
+
+
+class StreamSession:
+    # 一个WebSocket连接上的流式识别：收到的PCM送入UtteranceSegmenter切分，切出的人声片段按顺序交给ASR后端
+    # 人声进行中每隔partial_interval秒把已录到的音频识别一次作为partial结果(上一次还没完成则跳过这一次)
+    # 发出的消息：speech_start / partial / speech_end / final / done，都带有人声片段的序号id
+    # 有批量VAD(BatchedVAD)时所有连接共享一个ONNX会话按tick批量推理，否则每个连接从池中取一个模型单独推理
+    def __init__(self,send:Callable[[dict],Awaitable[None]],platform:Optional[str]=None,
+                 language:Optional[str]=None,model_size:str="small"):
+        self.logger=logger.bind(tag=TAG)
+        options=(config.get("asr",{}) or {}).get("stream",{}) or {}
+        self.platform=platform or config.get("choose",{"asr":None}).get("asr",None) or "whisper"
+        if self.platform not in PLATFORMS:
+            raise ValueError(f"不支持的asr平台: {self.platform}，可选: {', '.join(PLATFORMS)}")
+        self.language=language
+        self.model_size=model_size
+        self.partial_interval=float(options.get("partial_interval",1.0))
+        self.max_seconds=float(options.get("max_seconds",30))
+        self._send=send
+        self._send_lock=asyncio.Lock()
+        self.segmenter=None
+        self._model=None
+        self._batched=None
+        self._slot=None
+        self._queue=asyncio.Queue()
+        self._worker=None
+        self._partial_task=None
+        self._partial_at=0
+        self.current_id=0
+
+    async def start(self):
+        # 取得本连接的VAD(批量调度器的槽位或池中的模型)并启动识别协程
+        self._batched=get_batched_vad()
+        if self._batched is not None:
+            self._slot=self._batched.open()
+            model,iterator_cls=PrecomputedProb(),silero_utils()[3]
+        else:
+            self._model=await asyncio.to_thread(_model_pool.acquire)
+            model,iterator_cls=self._model
+        vad=config.get("vad",{}) or {}
+        self.segmenter=UtteranceSegmenter(
+            model,
+            iterator_cls,
+            confidence=vad.get("confidence",0.5),
+            silence=vad.get("silence",1),
+            min_cont_frames=int(vad.get("min_cont_frames",5)),
+            pre_roll_frames=int(vad.get("pre_roll_frames",9)),
+            max_seconds=self.max_seconds,
+            sample_rate=SAMPLE_RATE
+        )
+        self._worker=asyncio.create_task(self._run())
+        await self.send({"type": "ready","platform": self.platform,"sample_rate": SAMPLE_RATE})
+
+    async def feed(self,data:bytes):
+        # 用户接口，送入一段PCM；VAD推理在线程中(或由批量调度器)进行，同一连接内按顺序处理
+        triggered=self.segmenter.triggered
+        if self._batched is not None:
+            frames=self.segmenter.split(data)
+            if not frames:
+                return
+            batch=np.frombuffer(b"".join(frames),dtype=np.int16).reshape(len(frames),-1).astype(np.float32)
+            batch*=1.0/32768.0
+            probs=await self._batched.infer(self._slot,batch)
+            segments=self.segmenter.feed_scored(frames,probs)
+        else:
+            segments=await asyncio.to_thread(self.segmenter.feed,data)
+        for segment in segments:
+            await self._end_utterance(segment)
+            triggered=False
+        if self.segmenter.triggered:
+            if not triggered:
+                self._partial_at=0
+                await self.send({"type": "speech_start","id": self.current_id})
+            self._maybe_partial()
+
+    async def finish(self):
+        # 用户接口，客户端说明音频已结束：取出进行中的人声，等待所有片段识别完成
+        segment=self.segmenter.flush()
+        if segment is not None:
+            await self._end_utterance(segment)
+        await self._queue.join()
+        await self.send({"type": "done"})
+
+    async def close(self):
+        # 连接断开时调用，取消未完成的识别并归还VAD模型
+        for task in (self._worker,self._partial_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._slot is not None:
+            self._batched.close(self._slot)
+            self._slot=None
+        if self._model is not None:
+            if self.segmenter is not None:
+                self.segmenter.reset()
+            _model_pool.release(self._model)
+            self._model=None
+
+    async def send(self,message:dict):
+        async with self._send_lock:
+            await self._send(message)
+
+    async def _end_utterance(self,segment):
+        utterance_id=self.current_id
+        self.current_id+=1
+        duration=round(len(segment)/2/SAMPLE_RATE,2)
+        await self.send({"type": "speech_end","id": utterance_id,"duration": duration})
+        self._queue.put_nowait((utterance_id,bytes(segment),duration))
+
+    def _maybe_partial(self):
+        if self.partial_interval<=0:
+            return
+        if self._partial_task is not None and not self._partial_task.done():
+            return
+        elapsed=(len(self.segmenter.buffer)/2)/SAMPLE_RATE
+        if elapsed-self._partial_at<self.partial_interval:
+            return
+        self._partial_at=elapsed
+        self._partial_task=asyncio.create_task(self._partial(self.current_id,bytes(self.segmenter.buffer)))
+
+    async def _partial(self,utterance_id:int,pcm:bytes):
+        try:
+            text=await transcribe(self.platform,pcm,self.language,self.model_size)
+        except Exception as e:
+            self.logger.warning(f"流式识别partial失败: {e}")
+            return
+        # 这段人声已经结束时丢弃，避免partial出现在final之后
+        if text and utterance_id==self.current_id:
+            await self.send({"type": "partial","id": utterance_id,"text": text})
+
+    async def _run(self):
+        while True:
+            utterance_id,pcm,duration=await self._queue.get()
+            try:
+                text=await transcribe(self.platform,pcm,self.language,self.model_size)
+                await self.send({"type": "final","id": utterance_id,"text": text or "","duration": duration})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"流式识别失败: {e}")
+                await self.send({"type": "error","id": utterance_id,"message": str(e)})
+            finally:
+                self._queue.task_done()
@@ -1,6 +1,9 @@
 import os
+import sys
 import glob
 import wave
+import asyncio
+from collections import deque
 import torch
 import numpy as np
 import pyaudio
@@ -10,14 +13,180 @@ TAG=__name__
 MODEL_PATH=os.path.join(os.path.dirname(__file__), "../common/model/silero_vad")  # 就是你复制的文件夹
 TEMP_PATH=os.path.join(os.path.dirname(__file__), "temp")
 
+
+def load_silero(onnx:bool=False):
+    # 从本地加载Silero VAD，返回(model, utils)；onnx=True但缺少onnxruntime时退回TorchScript模型
+    if onnx:
+        try:
+            return torch.hub.load(
+                repo_or_dir=MODEL_PATH,
+                model="silero_vad",
+                source="local",
+                trust_repo=True,
+                onnx=True,
+                force_onnx_cpu=True
+            )
+        except ImportError as e:
+            logger.bind(tag=TAG).warning(f"onnxruntime不可用，改用TorchScript模型: {e}")
+    return torch.hub.load(
+        repo_or_dir=MODEL_PATH,
+        model="silero_vad",
+        source="local",
+        trust_repo=True
+    )
+
+
+def silero_utils():
+    # 只导入silero的工具函数(get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks)，不加载模型
+    # 与hubconf.py相同，把src加入sys.path后按silero_vad包导入
+    src=os.path.join(MODEL_PATH,"src")
+    if src not in sys.path:
+        sys.path.insert(0,src)
+    from silero_vad.utils_vad import get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks
+    return get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks
+
+
+class PrecomputedProb:
+    # 代替Silero模型交给VADIterator：返回外部(BatchedVAD批量推理)已经算好的人声概率，判定逻辑仍由VADIterator完成
+    # 隐藏状态保存在外部，reset_states不做任何事
+    def __init__(self):
+        self.value=0.0
+
+    def __call__(self,x,sr:int):
+        return torch.tensor(self.value)
+
+    def reset_states(self,batch_size:int=1):
+        pass
+
+
+class UtteranceSegmenter:
+    # 基于Silero VADIterator的人声切分：送入连续的16kHz单声道int16 PCM(长度任意)，得到完整的人声片段
+    # 一个实例对应一路音频流，VADIterator和模型里的隐藏状态都属于这一路，多路音频不能共用同一个模型实例
+    # 人声开始前只在环形缓冲中保留最近pre_roll_frames帧；人声结束后按VADIterator给出的结束位置裁掉尾部静音
+    # model为PrecomputedProb时由调用方用split/feed_scored送入外部算好的概率(多路批量推理)
+    def __init__(self,model,iterator_cls,confidence:float=0.5,silence:float=1,min_cont_frames:int=5,
+                 pre_roll_frames:int=9,max_seconds:float=None,chunk:int=512,sample_rate:int=16000):
+        self.chunk=chunk
+        self.chunk_bytes=chunk*2
+        self.min_speech_samples=min_cont_frames*chunk
+        self.max_samples=int(max_seconds*sample_rate) if max_seconds else None
+        self.model=model
+        self.iterator=iterator_cls(
+            model,
+            threshold=confidence,
+            sampling_rate=sample_rate,
+            min_silence_duration_ms=int(silence*1000)
+        )
+        # 预分配的模型输入，每帧原地转换，不再为每帧分配数组和张量
+        self._input=torch.zeros(chunk)
+        self._input_np=self._input.numpy()
+        self.pre_roll=deque(maxlen=pre_roll_frames)
+        self._pending=bytearray()
+        self.reset()
+
+    @property
+    def triggered(self)->bool:
+        # 当前是否处在一段人声中
+        return self.buffer is not None
+
+    def reset(self):
+        # 音频不连续时(新的录音、新的连接)调用，清空模型状态和所有缓冲
+        self.iterator.reset_states()
+        self.pre_roll.clear()
+        del self._pending[:]
+        self.buffer=None
+        self.buffer_start=0
+        self.speech_start=0
+        self.samples=0
+
+    def feed(self,data)->list:
+        # 用户接口，送入一段PCM，返回其中已经结束的人声片段(bytearray)列表；不足一帧的部分留到下次
+        segments=[]
+        for frame in self.split(data):
+            segment=self._step(frame)
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def split(self,data)->list:
+        # 用户接口，把输入切成完整的帧(bytes)，不足一帧的部分留到下次
+        if not self._pending and len(data)==self.chunk_bytes:
+            return [bytes(data)]
+        self._pending+=data
+        usable=len(self._pending)-len(self._pending)%self.chunk_bytes
+        frames=[bytes(self._pending[offset:offset+self.chunk_bytes]) for offset in range(0,usable,self.chunk_bytes)]
+        del self._pending[:usable]
+        return frames
+
+    def feed_scored(self,frames:list,probs)->list:
+        # 用户接口，送入split得到的帧和外部算好的人声概率(model须为PrecomputedProb)，返回结束的人声片段列表
+        segments=[]
+        for frame,prob in zip(frames,probs):
+            self.model.value=float(prob)
+            segment=self._step(frame,convert=False)
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def flush(self):
+        # 用户接口，流结束或超时时调用：返回进行中的人声片段(太短则为None)，并重置状态
+        segment=None
+        if self.buffer is not None and self.samples-self.speech_start>=self.min_speech_samples:
+            segment=self.buffer
+        self.reset()
+        return segment
+
+    def _step(self,frame,convert:bool=True):
+        if convert:
+            np.copyto(self._input_np,np.frombuffer(frame,dtype=np.int16),casting="unsafe")
+            self._input_np*=1.0/32768.0
+        event=self.iterator(self._input)
+        position=self.samples
+        self.samples+=self.chunk
+
+        if self.buffer is None:
+            if event is None or "start" not in event:
+                self.pre_roll.append(bytes(frame))
+                return None
+            self.buffer=bytearray(b"".join(self.pre_roll))
+            self.buffer_start=position-len(self.pre_roll)*self.chunk
+            self.speech_start=event["start"]
+            self.pre_roll.clear()
+        self.buffer+=frame
+
+        if event is not None and "end" in event:
+            return self._finish(event["end"])
+        if self.max_samples and self.samples-self.buffer_start>=self.max_samples:
+            # 超过最长时长时强制切分，VADIterator仍处在人声中，后面的音频直接开始下一段
+            segment=self.buffer
+            self.buffer=bytearray()
+            self.buffer_start=self.speech_start=self.samples
+            return segment
+        return None
+
+    def _finish(self,end:int):
+        segment=self.buffer
+        self.buffer=None
+        if end-self.speech_start<self.min_speech_samples:
+            # 太短的片段(咳嗽、敲击声)丢弃，继续等待
+            return None
+        keep=max(0,min(len(segment),(end-self.buffer_start)*2))
+        del segment[keep:]
+        return segment
+
+
 class VAD:
     ##
-    # 用户接口：record_audio("这里填写文件名")
+    # 用户接口：record_audio("这里填写文件名")、record_pcm()、utterances()
     # 使用示例:
     # '''
     # with VAD() as v:
     #    v.record_audio("test.wav")
     # '''
+    # '''
+    # async for pcm in v.utterances():  # pcm为16kHz单声道int16的memoryview
+    #    text=await asr.audio_to_text(pcm)
+    # '''
     # #
     def __init__(self):
         #初始化
@@ -25,13 +194,10 @@ class VAD:
         self.TEMP_PATH=TEMP_PATH
         self.logger=logger.bind(tag=TAG)
 
+        # vad.onnx为true时使用silero自带的OnnxWrapper(onnxruntime)推理，否则使用TorchScript模型
+        self.onnx=bool(config.get("vad",{"onnx":False}).get("onnx",False))
         try:
-            self.model, self.utils = torch.hub.load(
-                repo_or_dir=self.MODEL_PATH,
-                model="silero_vad",
-                source="local",
-                trust_repo=True
-            )
+            self.model, self.utils = load_silero(self.onnx)
 
             (self.get_speech_timestamps,
              self.save_audio,
@@ -54,6 +220,19 @@ class VAD:
         self.timeout=config.get("vad",{"timeout":60}).get("timeout",60)
         self.max_temp_num=config.get("vad",{"max_temp_num":15}).get("max_temp_num",15)
         self.min_cont_frames=int(config.get("vad",{"min_cont_frames":5}).get("min_cont_frames",5))
+        # 检测到人声前保留的帧数(约0.3秒)，避免切掉开头的弱音
+        self.pre_roll_frames=int(config.get("vad",{"pre_roll_frames":9}).get("pre_roll_frames",9))
+
+        self.segmenter=UtteranceSegmenter(
+            self.model,
+            self.VADIterator,
+            confidence=self.confidence,
+            silence=self.silence,
+            min_cont_frames=self.min_cont_frames,
+            pre_roll_frames=self.pre_roll_frames,
+            chunk=self.CHUNK,
+            sample_rate=self.SAMPLE_RATE
+        )
 
         self.p=None
         self.stream=None
@@ -68,12 +247,59 @@ class VAD:
         # 用户接口
         # 录音人声片段，人声静默1秒结束并且写入音频wav
         # 注意这里接受的filename不是路径，默认路径是【VAD】TEMP_PATH
+        # 不需要文件时用record_pcm/utterances，直接拿到内存中的PCM
         try:
             os.makedirs(self.TEMP_PATH,exist_ok=True)
             output_file=os.path.join(self.TEMP_PATH,filename)
         except Exception as e:
             self.logger.error(f"创建临时目录时发生错误:{e}")
             return ""
+        pcm=self.record_pcm()
+        if not pcm:
+            return ""
+        try:
+            wf = wave.open(output_file, 'wb')
+            wf.setnchannels(self.CHANNELS)
+            wf.setsampwidth(pyaudio.get_sample_size(self.FORMAT))
+            wf.setframerate(self.SAMPLE_RATE)
+            wf.writeframes(pcm)
+            wf.close()
+            self._audio_temp_manager(output_file)
+            self.logger.success(f"录音文件: {output_file}")
+            return output_file
+        except Exception as e:
+            self.logger.error(f"写入录音文件时发生错误:{e}")
+            return ""
+
+    def record_pcm(self)->memoryview:
+        # 用户接口，录制一段人声，返回16kHz单声道int16 PCM，不写文件；超时仍未检测到人声返回空
+        if not self._open_stream():
+            return memoryview(b"")
+        try:
+            return memoryview(self._capture_utterance()).toreadonly()
+        except Exception as e:
+            self.logger.error(f"录音时发生错误:{e}")
+            return memoryview(b"")
+
+    async def utterances(self,max_count:int=None):
+        # 用户接口，异步生成器：持续监听麦克风，每段人声结束就产出一次它的PCM(memoryview，16kHz单声道int16)
+        # 阻塞的录音在线程池中进行；超时仍没有人声、出错或已产出max_count段后结束
+        if not self._open_stream():
+            return
+        loop=asyncio.get_running_loop()
+        count=0
+        while max_count is None or count<max_count:
+            try:
+                buffer=await loop.run_in_executor(None,self._capture_utterance)
+            except Exception as e:
+                self.logger.error(f"录音时发生错误:{e}")
+                return
+            if not buffer:
+                return
+            count+=1
+            yield memoryview(buffer).toreadonly()
+
+    def _open_stream(self)->bool:
         try:
             if self.p is None:
                 self.p = pyaudio.PyAudio()
@@ -85,57 +311,36 @@ class VAD:
                 input=True,
                 frames_per_buffer=self.CHUNK
             )
+            return True
         except Exception as e:
             self.logger.error(f"初始化音频流出错:{e}")
-            return  ""
+            return False
 
+    def _capture_utterance(self)->bytearray:
+        # 读取麦克风直到一段人声结束(静默silence秒)或超时，返回这段人声的PCM
+        # 每次录音前重置VADIterator的状态：两次录音之间的音频是不连续的
         self.logger.info("开启麦克风,等待人声...")
-        frames=[]
-        silent_frames=0
-        speech_frames=0
-        max_silent_frames=int(self.silence*self.SAMPLE_RATE/self.CHUNK)
+        self.segmenter.reset()
+        bytes_per_second=self.SAMPLE_RATE*self.CHANNELS*np.dtype(self.DTYPE).itemsize
         timeout_frames=int(self.timeout*self.SAMPLE_RATE/self.CHUNK)
-        total_frames=0
-        start_frames=None
-
-        try:
-            while total_frames<timeout_frames:
-                data=self.stream.read(self.CHUNK)
-                frames.append(data)
-                total_frames+=1
-
-                audio_chunk=np.frombuffer(data,dtype=self.DTYPE)
-                speech_prob=self._trust_detection(audio_chunk)
-
-                if speech_prob>self.confidence:
-                    if start_frames is None:
-                        start_frames=max(0,total_frames-10)
-                    self.logger.info(
-                        f"检测到人声 {(total_frames-start_frames) * self.CHUNK / self.SAMPLE_RATE:.2f} 秒，人声概率: {speech_prob:.2f}")
-
-                    silent_frames=0
-                    speech_frames+=1
-                else:
-                    if speech_frames>0:
-                       silent_frames+=1
-
-                if silent_frames>=max_silent_frames and speech_frames>self.min_cont_frames:
-                    self.logger.success(
-                        f"录音结束，已录制 {(total_frames-start_frames) * self.CHUNK / self.SAMPLE_RATE:.2f} 秒 ,录音文件: {output_file}")
-                    break
+        triggered=False
 
-            wf = wave.open(output_file, 'wb')
-            wf.setnchannels(self.CHANNELS)
-            wf.setsampwidth(self.p.get_sample_size(self.FORMAT))
-            wf.setframerate(self.SAMPLE_RATE)
-            wf.writeframes(b''.join(frames[start_frames:]))
-            wf.close()
-            self._audio_temp_manager(output_file)
-            return output_file
-        except Exception as e:
-            self.logger.error(f"录音时发生错误:{e}")
-            return ""
+        for _ in range(timeout_frames):
+            data=self.stream.read(self.CHUNK,exception_on_overflow=False)
+            segments=self.segmenter.feed(data)
+            if segments:
+                self.logger.success(f"录音结束，已录制 {len(segments[0])/bytes_per_second:.2f} 秒")
+                return segments[0]
+            if self.segmenter.triggered and not triggered:
+                self.logger.info("检测到人声")
+            triggered=self.segmenter.triggered
 
+        segment=self.segmenter.flush()
+        if segment is None:
+            self.logger.info("等待人声超时")
+            return bytearray()
+        self.logger.success(f"录音超时结束，已录制 {len(segment)/bytes_per_second:.2f} 秒")
+        return segment
 
     def _audio_temp_manager(self, audio_path):
         # 临时文件管理，最多15个文件，删除最老的
@@ -157,19 +362,6 @@ class VAD:
         except Exception as e:
             self.logger.warning(f"管理临时音频文件出错:{e}")
 
-    def _trust_detection(self,audio_chunk:np.ndarray)->float:
-        # 人声置信度检测
-        try:
-            audio_float=torch.from_numpy(np.array(audio_chunk,copy=True)).float()/32768.0
-            audio_float=audio_float.unsqueeze(0)
-
-            with torch.no_grad():
-                speech_prob = self.model(audio_float, self.SAMPLE_RATE)
-                return speech_prob.item()
-        except Exception as e:
-            self.logger.warning(f"人声置信度检测时未知错误:{e}")
-            return 0.0
-
     def close(self):
         if self.stream:
             try:
@@ -0,0 +1,194 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+from ALT_pure.log.load_log import logger
+from ALT_pure.config.load_config import config
+from .vad import MODEL_PATH
+TAG=__name__
+
+ONNX_PATH=os.path.join(MODEL_PATH,"src","silero_vad","data","silero_vad.onnx")
+SAMPLE_RATE=16000
+CHUNK=512
+CONTEXT=64   # 与OnnxWrapper相同：每帧前面拼上一帧末尾的64个采样
+
+
+class _Request:
+    # 一路流一次提交的若干帧，按顺序在连续的批次中处理
+    __slots__=("frames","probs","index","future")
+
+    def __init__(self,frames:np.ndarray,future:asyncio.Future):
+        self.frames=frames
+        self.probs=np.empty(len(frames),dtype=np.float32)
+        self.index=0
+        self.future=future
+
+
+class BatchedVAD:
+    # 多路音频流共享一个Silero ONNX会话的批量VAD调度器
+    # 每个tick内把所有有待处理帧的流各取一帧拼成一批做一次前向；每一路的隐藏状态和上下文保存在按槽位索引的数组中，
+    # 每批按槽位取出、推理后写回，批次组成可以随时变化，结果与每一路单独使用OnnxWrapper相同
+    # 同一路的多帧在同一个tick内的连续批次中依次处理；推理在单独的线程中进行，不阻塞事件循环
+    def __init__(self,tick:float=0.032,max_streams:int=1024,path:str=ONNX_PATH):
+        import onnxruntime  # 缺少时抛出ImportError，由get_batched_vad退回逐路推理
+        self.logger=logger.bind(tag=TAG)
+        self.tick=tick
+        opts=onnxruntime.SessionOptions()
+        opts.inter_op_num_threads=1
+        opts.intra_op_num_threads=1
+        self.session=onnxruntime.InferenceSession(path,providers=["CPUExecutionProvider"],sess_options=opts)
+        self.sr=np.array(SAMPLE_RATE,dtype=np.int64)
+        self.states=np.zeros((2,max_streams,128),dtype=np.float32)
+        self.contexts=np.zeros((max_streams,CONTEXT),dtype=np.float32)
+        self._free=list(range(max_streams-1,-1,-1))
+        self._closing=[]
+        self._resetting=[]
+        self._queues={}
+        self._busy=False
+        self._wakeup=None
+        self._runner=None
+        self._executor=ThreadPoolExecutor(max_workers=1,thread_name_prefix="vad-batch")
+        self.batches=0
+        self.frames=0
+
+    def open(self)->int:
+        # 用户接口，登记一路新的流，返回它的槽位；状态清零
+        if not self._free:
+            raise RuntimeError("批量VAD的流数量已达上限")
+        slot=self._free.pop()
+        self._reset_slot(slot)
+        self._queues[slot]=deque()
+        if self._runner is None or self._runner.done():
+            self._wakeup=asyncio.Event()
+            self._runner=asyncio.create_task(self._run())
+        return slot
+
+    def reset(self,slot:int):
+        # 用户接口，音频不连续时清空这一路的状态；正在推理的批次可能包含这一路，写回之后再清空
+        if self._busy:
+            self._resetting.append(slot)
+        else:
+            self._reset_slot(slot)
+
+    def close(self,slot:int):
+        # 用户接口，流结束时调用；正在推理的批次写回之后槽位才会被复用
+        queue=self._queues.pop(slot,None)
+        for request in queue or ():
+            if not request.future.done():
+                request.future.cancel()
+        if self._busy:
+            self._closing.append(slot)
+        else:
+            self._free.append(slot)
+
+    async def infer(self,slot:int,frames:np.ndarray)->np.ndarray:
+        # 用户接口，frames为(n,512)的float32，返回n个人声概率；同一路的请求按提交顺序处理
+        if len(frames)==0:
+            return np.zeros(0,dtype=np.float32)
+        request=_Request(frames,asyncio.get_running_loop().create_future())
+        self._queues[slot].append(request)
+        self._wakeup.set()
+        return await request.future
+
+    async def shutdown(self):
+        # 应用关闭时调用
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner=None
+        self._executor.shutdown(wait=False,cancel_futures=True)
+
+    def forward(self,slots:np.ndarray,batch:np.ndarray)->np.ndarray:
+        # 对若干槽位各一帧做一次前向，更新这些槽位的状态，返回人声概率
+        x=np.concatenate([self.contexts[slots],batch],axis=1)
+        out,state=self.session.run(None,{"input": x,"state": self.states[:,slots],"sr": self.sr})
+        self.states[:,slots]=state
+        self.contexts[slots]=x[:,-CONTEXT:]
+        return out[:,0]
+
+    def _reset_slot(self,slot:int):
+        self.states[:,slot]=0
+        self.contexts[slot]=0
+
+    async def _run(self):
+        loop=asyncio.get_running_loop()
+        while True:
+            if not any(self._queues.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            next_tick=loop.time()+self.tick
+            while any(self._queues.values()):
+                await self._run_batch(loop)
+            # 等到下一个tick，期间到达的帧合成同一批
+            await asyncio.sleep(max(0.0,next_tick-loop.time()))
+
+    async def _run_batch(self,loop):
+        slots=[slot for slot,queue in self._queues.items() if queue]
+        requests=[self._queues[slot][0] for slot in slots]
+        batch=np.stack([request.frames[request.index] for request in requests])
+        self._busy=True
+        try:
+            probs=await loop.run_in_executor(self._executor,self.forward,np.array(slots),batch)
+        except Exception as e:
+            self.logger.error(f"批量VAD推理失败: {e}")
+            for slot,request in zip(slots,requests):
+                queue=self._queues.get(slot)
+                if queue and queue[0] is request:
+                    queue.popleft()
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._busy=False
+            for slot in self._resetting:
+                self._reset_slot(slot)
+            self._resetting.clear()
+            self._free.extend(self._closing)
+            self._closing.clear()
+        self.batches+=1
+        self.frames+=len(slots)
+        for slot,request,prob in zip(slots,requests,probs):
+            request.probs[request.index]=prob
+            request.index+=1
+            if request.index==len(request.frames):
+                queue=self._queues.get(slot)
+                if queue and queue[0] is request:
+                    queue.popleft()
+                if not request.future.done():
+                    request.future.set_result(request.probs)
+
+
+_batched_vad=None
+_unavailable=False
+
+
+def get_batched_vad()->Optional[BatchedVAD]:
+    # 进程内共享的批量VAD；config vad.batch.enabled未开启或缺少onnxruntime时返回None，调用方改为每路单独推理
+    global _batched_vad,_unavailable
+    if _batched_vad is None:
+        options=(config.get("vad",{}) or {}).get("batch",{}) or {}
+        if _unavailable or not options.get("enabled",False):
+            return None
+        try:
+            _batched_vad=BatchedVAD(
+                tick=float(options.get("tick",0.032)),
+                max_streams=int(options.get("max_streams",1024))
+            )
+        except ImportError as e:
+            logger.bind(tag=TAG).warning(f"onnxruntime不可用，不使用批量VAD: {e}")
+            _unavailable=True
+            return None
+    return _batched_vad
+
+
+async def shutdown_batched_vad():
+    # 应用关闭时调用
+    global _batched_vad
+    if _batched_vad is not None:
+        await _batched_vad.shutdown()
+        _batched_vad=None
@@ -0,0 +1,135 @@
+# VAD单路CPU占用基准：在server目录下运行 python -m ALT_pure.core.asr.vad_bench [--seconds 60] [--audio test.wav]
+# 对比原来的无状态逐帧调用(每帧复制+新建张量)和基于VADIterator的UtteranceSegmenter，TorchScript和ONNX各测一次
+# 结果是每秒音频消耗的CPU时间，以及单核能实时处理的路数；torch固定为单线程，相当于每一路占一个核的一部分
+# --streams N 时另外比较N路流逐路调用OnnxWrapper和BatchedVAD一次批量前向的每tick(32ms音频)CPU时间
+# --offline 时比较silero的get_speech_timestamps和vad_offline在--minutes分钟音频(重复拼接)上的耗时，并检查时间轴是否相同
+import argparse
+import time
+import wave
+import numpy as np
+import torch
+from .vad import load_silero, UtteranceSegmenter
+
+SAMPLE_RATE=16000
+CHUNK=512
+
+
+def load_pcm(path:str=None,seconds:float=60)->bytes:
+    # 读取16kHz单声道16bit的wav；没有给出文件时生成噪声中夹杂“语音”(调制的谐波)的合成音频
+    if path:
+        with wave.open(path,"rb") as wf:
+            if wf.getframerate()!=SAMPLE_RATE or wf.getnchannels()!=1 or wf.getsampwidth()!=2:
+                raise ValueError("只支持16kHz单声道16bit的wav")
+            return wf.readframes(wf.getnframes())
+    rng=np.random.default_rng(0)
+    t=np.arange(int(seconds*SAMPLE_RATE))/SAMPLE_RATE
+    voiced=(np.sin(2*np.pi*0.3*t)>0).astype(np.float32)
+    pitch=sum(np.sin(2*np.pi*f*t)/k for k,f in enumerate((180,360,540,720),1))
+    audio=voiced*pitch*np.abs(np.sin(2*np.pi*4*t))*6000+rng.normal(0,200,len(t))
+    return np.clip(audio,-32768,32767).astype(np.int16).tobytes()
+
+
+def stateless(model,pcm:bytes):
+    # 原来的_trust_detection：每帧复制、新建张量，模型状态从不重置
+    for offset in range(0,len(pcm)-CHUNK*2+1,CHUNK*2):
+        chunk=np.frombuffer(pcm[offset:offset+CHUNK*2],dtype=np.int16)
+        audio_float=torch.from_numpy(np.array(chunk,copy=True)).float()/32768.0
+        with torch.no_grad():
+            model(audio_float.unsqueeze(0),SAMPLE_RATE).item()
+
+
+def segmenter(model,iterator_cls,pcm:bytes):
+    seg=UtteranceSegmenter(model,iterator_cls)
+    for offset in range(0,len(pcm)-CHUNK*2+1,CHUNK*2):
+        seg.feed(pcm[offset:offset+CHUNK*2])
+    seg.flush()
+
+
+def measure(func,*args)->float:
+    # 返回CPU时间(秒)
+    start=time.process_time()
+    func(*args)
+    return time.process_time()-start
+
+
+def run_streams(pcm:bytes,streams:int,ticks:int=200):
+    # 每路从音频的不同位置开始；逐路为每一路单独的OnnxWrapper(各自的状态)
+    try:
+        from .vad_batch import BatchedVAD
+        batched=BatchedVAD(max_streams=streams)
+    except ImportError:
+        print("onnxruntime不可用，跳过多路基准")
+        return
+    frames=np.frombuffer(pcm,dtype=np.int16)[:len(pcm)//2//CHUNK*CHUNK].astype(np.float32).reshape(-1,CHUNK)/32768.0
+    offsets=np.random.default_rng(0).integers(0,len(frames)-ticks,streams)
+    models=[load_silero(True)[0] for _ in range(streams)]
+    slots=np.arange(streams)  # 直接使用前streams个槽位，状态初始为0
+
+    def per_stream():
+        for tick in range(ticks):
+            for model,offset in zip(models,offsets):
+                model(torch.from_numpy(frames[offset+tick]),SAMPLE_RATE)
+
+    def batch():
+        for tick in range(ticks):
+            batched.forward(slots,frames[offsets+tick])
+
+    tick_seconds=CHUNK/SAMPLE_RATE
+    print(f"\n{streams} streams x {ticks} ticks")
+    print(f"{'mode':28s}{'cpu ms/tick':>12s}{'core %':>9s}")
+    for label,func in (("onnx per stream",per_stream),("onnx BatchedVAD",batch)):
+        cpu=measure(func)/ticks
+        print(f"{label:28s}{cpu*1000:12.2f}{cpu/tick_seconds*100:9.1f}")
+
+
+def run_offline(pcm:bytes,minutes:float):
+    from .vad_offline import get_speech_timestamps
+    repeat=max(1,int(np.ceil(minutes*60*SAMPLE_RATE*2/len(pcm))))
+    audio=np.frombuffer(pcm*repeat,dtype=np.int16)[:int(minutes*60*SAMPLE_RATE)]
+    seconds=len(audio)/SAMPLE_RATE
+    model,utils=load_silero(False)
+    print(f"\noffline get_speech_timestamps, audio {seconds/60:.1f}min, torch threads={torch.get_num_threads()}")
+    print(f"{'mode':28s}{'wall s':>10s}{'x realtime':>12s}")
+    results=[]
+    for label,func,data in (("silero per window",utils[0],torch.from_numpy(audio.astype(np.float32)/32768.0)),
+                            ("vad_offline batched",get_speech_timestamps,audio)):
+        start=time.perf_counter()
+        results.append(func(data,model))
+        wall=time.perf_counter()-start
+        print(f"{label:28s}{wall:10.2f}{seconds/wall:12.1f}")
+    print(f"segments {len(results[0])}, identical: {results[0]==results[1]}")
+
+
+def run(pcm:bytes):
+    torch.set_num_threads(1)
+    seconds=len(pcm)/2/SAMPLE_RATE
+    print(f"audio {seconds:.1f}s, torch threads=1")
+    print(f"{'mode':28s}{'cpu ms/s':>10s}{'core %':>9s}{'streams/core':>14s}")
+    for onnx in (False,True):
+        model,utils=load_silero(onnx)
+        name="onnx" if type(model).__name__=="OnnxWrapper" else "jit"
+        if onnx and name=="jit":
+            continue
+        iterator_cls=utils[3]
+        measure(segmenter,model,iterator_cls,pcm[:SAMPLE_RATE*2])  # 预热
+        for label,func,args in ((f"{name} stateless",stateless,(model,pcm)),
+                                (f"{name} VADIterator segmenter",segmenter,(model,iterator_cls,pcm))):
+            cpu=measure(func,*args)
+            print(f"{label:28s}{cpu/seconds*1000:10.2f}{cpu/seconds*100:9.2f}{seconds/cpu:14.1f}")
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="VAD单路CPU占用基准")
+    parser.add_argument("--seconds",type=float,default=60,help="合成音频的时长(秒)")
+    parser.add_argument("--audio",type=str,default=None,help="16kHz单声道16bit wav，不传则使用合成音频")
+    parser.add_argument("--streams",type=int,default=0,help="多路基准的路数，0为不测")
+    parser.add_argument("--offline",action="store_true",help="只测离线get_speech_timestamps")
+    parser.add_argument("--minutes",type=float,default=10,help="离线基准的音频时长(分钟)")
+    args=parser.parse_args()
+    pcm=load_pcm(args.audio,args.seconds)
+    if args.offline:
+        run_offline(pcm,args.minutes)
+    else:
+        run(pcm)
+    if args.streams>0:
+        run_streams(pcm,args.streams)
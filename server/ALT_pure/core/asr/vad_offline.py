@@ -0,0 +1,268 @@
+# 长录音的离线人声时间轴：与silero的get_speech_timestamps参数和结果相同，但
+# 1.TorchScript模型的stft和encoder不依赖隐藏状态，按block_windows个窗口一批前向；只有LSTM按时间顺序执行(nn.LSTM，C++循环)
+# 2.阈值/滞回判定用NumPy找出人声和静音的帧号，按事件跳转，不再逐窗口循环
+# 3.音频可以直接传入wav/pcm文件路径，用np.memmap按块读取，不会把整段录音载入内存
+# 批量卷积与单窗口卷积的浮点累加顺序不同，概率与逐窗口调用相差约1e-6，时间轴相同
+# 基准: 在server目录下运行 python -m ALT_pure.core.asr.vad_bench --offline [--minutes 10] [--audio test.wav]
+import os
+import warnings
+from typing import Callable, Tuple, Union
+import numpy as np
+import torch
+from .audio_decode import read_wav_header, WAVE_FORMAT_PCM
+
+SAMPLE_RATE=16000
+
+
+def load_pcm_memmap(path:str,sampling_rate:int=SAMPLE_RATE)->Tuple[np.memmap,int]:
+    # 以np.memmap打开单声道16bit的wav(只读data块)或裸pcm文件，返回(int16采样, 采样率)；裸pcm使用传入的采样率
+    with open(path,"rb") as f:
+        info=read_wav_header(f)
+    if info is None:
+        return np.memmap(path,dtype=np.int16,mode="r"),sampling_rate
+    if info.tag!=WAVE_FORMAT_PCM or info.channels!=1 or info.bits!=16:
+        raise ValueError("只支持单声道16bit PCM的wav")
+    # data块的长度可能写错(录音中断)，以文件实际长度为准
+    frames=min(info.size,os.path.getsize(path)-info.offset)//2
+    return np.memmap(path,dtype=np.int16,mode="r",offset=info.offset,shape=(frames,)),info.rate
+
+
+def _as_array(audio)->np.ndarray:
+    # 与原函数相同地去掉多余的维度；int16按/32768归一化(按块转换)，其它类型按float32处理
+    if torch.is_tensor(audio):
+        audio=audio.detach().cpu().numpy()
+    elif not isinstance(audio,np.ndarray):
+        audio=np.asarray(audio,dtype=np.float32)
+    if audio.ndim>1:
+        while audio.ndim>1 and audio.shape[0]==1:
+            audio=audio[0]
+        if audio.ndim>1:
+            raise ValueError("More than one dimension in audio. Are you trying to process audio with 2 channels?")
+    return audio
+
+
+def _block(audio:np.ndarray,start:int,stop:int)->np.ndarray:
+    block=audio[start:stop]
+    if block.dtype==np.int16:
+        return block.astype(np.float32)*np.float32(1/32768)
+    return block.astype(np.float32,copy=False)
+
+
+def speech_probs(audio,model,sampling_rate:int=SAMPLE_RATE,block_windows:int=4096,
+                 progress_tracking_callback:Callable[[float],None]=None)->np.ndarray:
+    # 返回每个窗口(16kHz为512个采样，8kHz为256个)的人声概率，与原函数逐窗口调用model的结果对应
+    # audio为已经按采样率处理过的一维数组；onnx模型没有可拆分的子模块，退回逐窗口调用
+    window=512 if sampling_rate==16000 else 256
+    length=len(audio)
+    count=(length+window-1)//window
+    probs=np.empty(count,dtype=np.float32)
+    model.reset_states()
+    sub=getattr(model,"_model" if sampling_rate==16000 else "_model_8k",None)
+    if sub is None:
+        for i in range(count):
+            chunk=torch.from_numpy(np.pad(_block(audio,i*window,(i+1)*window),(0,max(0,(i+1)*window-length))))
+            probs[i]=model(chunk,sampling_rate).item()
+            if progress_tracking_callback:
+                progress_tracking_callback(min((i+1)*window,length)/length*100)
+        return probs
+
+    context=int(sub.context_size_samples)
+    rnn=sub.decoder.rnn
+    lstm=torch.nn.LSTM(rnn.weight_ih.shape[1],rnn.weight_hh.shape[1])
+    with torch.no_grad():
+        lstm.weight_ih_l0.copy_(rnn.weight_ih)
+        lstm.weight_hh_l0.copy_(rnn.weight_hh)
+        lstm.bias_ih_l0.copy_(rnn.bias_ih)
+        lstm.bias_hh_l0.copy_(rnn.bias_hh)
+    state=None
+    # 每块的输入是前一块最后context个采样+block_windows个窗口，第一块的上下文为0，最后一个窗口补0
+    offsets=np.arange(block_windows)[:,None]*window+np.arange(context+window)[None,:]
+    buffer=np.zeros(context+block_windows*window,dtype=np.float32)
+    with torch.no_grad():
+        for first in range(0,count,block_windows):
+            n=min(block_windows,count-first)
+            samples=_block(audio,first*window,(first+n)*window)
+            buffer[context:context+len(samples)]=samples
+            buffer[context+len(samples):]=0
+            x=torch.from_numpy(buffer[offsets[:n]])
+            features=sub.encoder(sub.run_extractors(x)).squeeze(-1)
+            hidden,state=lstm(features.unsqueeze(1),state)
+            out=sub.decoder.decoder(hidden.squeeze(1).unsqueeze(-1).float())
+            probs[first:first+n]=torch.mean(out.squeeze(1),[1]).numpy()
+            buffer[:context]=buffer[n*window:n*window+context]
+            if progress_tracking_callback:
+                progress_tracking_callback(min((first+n)*window,length)/length*100)
+    return probs
+
+
+def _segments(probs:np.ndarray,window:int,threshold:float,neg_threshold:float,
+              min_speech_samples:float,min_silence_samples:float,audio_length_samples:int)->list:
+    # 没有最长片段限制时原函数的判定，按事件跳转：
+    # 从第一个>=threshold的窗口开始人声；之后第一个<neg_threshold的窗口记为temp_end，
+    # 在temp_end之后至少min_silence的第一个<neg_threshold的窗口处结束，中途出现>=threshold的窗口则temp_end作废
+    probs=probs.astype(np.float64)  # 与原函数相同，用double比较阈值
+    speech=np.flatnonzero(probs>=threshold)
+    silence=np.flatnonzero(probs<neg_threshold)
+    wait=int(min_silence_samples//window)
+    while window*wait<min_silence_samples:
+        wait+=1
+    speeches=[]
+    position=0
+    while True:
+        index=np.searchsorted(speech,position)
+        if index==len(speech):
+            break
+        start=int(speech[index])
+        cursor=start
+        while True:
+            temp_end=np.searchsorted(silence,cursor+1)
+            if temp_end==len(silence):
+                temp_end=None
+                break
+            temp_end=int(silence[temp_end])
+            end=np.searchsorted(silence,temp_end+wait)
+            end=int(silence[end]) if end<len(silence) else len(probs)
+            resume=np.searchsorted(speech,temp_end+1)
+            resume=int(speech[resume]) if resume<len(speech) else len(probs)
+            if resume<end:
+                cursor=resume
+                continue
+            break
+        if temp_end is None or end==len(probs):
+            # 到音频结尾仍在人声中
+            if audio_length_samples-window*start>min_speech_samples:
+                speeches.append({"start": window*start,"end": audio_length_samples})
+            break
+        if window*(temp_end-start)>min_speech_samples:
+            speeches.append({"start": window*start,"end": window*temp_end})
+        position=end+1
+    return speeches
+
+
+def _segments_loop(probs:np.ndarray,window:int,threshold:float,neg_threshold:float,min_speech_samples:float,
+                   min_silence_samples:float,max_speech_samples:float,audio_length_samples:int,
+                   sampling_rate:int)->list:
+    # 有最长片段限制(或neg_threshold高于threshold)时逐窗口执行原函数的判定
+    min_silence_samples_at_max_speech=sampling_rate*98/1000
+    triggered=False
+    speeches=[]
+    current_speech={}
+    temp_end=0
+    prev_end=next_start=0
+    for i,speech_prob in enumerate(probs.tolist()):
+        if (speech_prob>=threshold) and temp_end:
+            temp_end=0
+            if next_start<prev_end:
+                next_start=window*i
+        if (speech_prob>=threshold) and not triggered:
+            triggered=True
+            current_speech["start"]=window*i
+            continue
+        if triggered and (window*i)-current_speech["start"]>max_speech_samples:
+            if prev_end:
+                current_speech["end"]=prev_end
+                speeches.append(current_speech)
+                current_speech={}
+                if next_start<prev_end:
+                    triggered=False
+                else:
+                    current_speech["start"]=next_start
+                prev_end=next_start=temp_end=0
+            else:
+                current_speech["end"]=window*i
+                speeches.append(current_speech)
+                current_speech={}
+                prev_end=next_start=temp_end=0
+                triggered=False
+                continue
+        if (speech_prob<neg_threshold) and triggered:
+            if not temp_end:
+                temp_end=window*i
+            if ((window*i)-temp_end)>min_silence_samples_at_max_speech:
+                prev_end=temp_end
+            if (window*i)-temp_end<min_silence_samples:
+                continue
+            current_speech["end"]=temp_end
+            if (current_speech["end"]-current_speech["start"])>min_speech_samples:
+                speeches.append(current_speech)
+            current_speech={}
+            prev_end=next_start=temp_end=0
+            triggered=False
+    if current_speech and (audio_length_samples-current_speech["start"])>min_speech_samples:
+        current_speech["end"]=audio_length_samples
+        speeches.append(current_speech)
+    return speeches
+
+
+def get_speech_timestamps(audio:Union[torch.Tensor,np.ndarray,str],
+                          model,
+                          threshold:float=0.5,
+                          sampling_rate:int=SAMPLE_RATE,
+                          min_speech_duration_ms:int=250,
+                          max_speech_duration_s:float=float("inf"),
+                          min_silence_duration_ms:int=100,
+                          speech_pad_ms:int=30,
+                          return_seconds:bool=False,
+                          time_resolution:int=1,
+                          progress_tracking_callback:Callable[[float],None]=None,
+                          neg_threshold:float=None,
+                          block_windows:int=4096)->list:
+    # 用户接口，参数和返回值与silero的get_speech_timestamps相同
+    # audio可以是一维tensor/ndarray(int16按/32768归一化)或单声道16bit的wav/pcm文件路径(np.memmap读取，采样率取自wav头)
+    if isinstance(audio,str):
+        audio,sampling_rate=load_pcm_memmap(audio,sampling_rate)
+    audio=_as_array(audio)
+
+    if sampling_rate>16000 and (sampling_rate%16000==0):
+        step=sampling_rate//16000
+        sampling_rate=16000
+        audio=audio[::step]
+        warnings.warn("Sampling rate is a multiply of 16000, casting to 16000 manually!")
+    else:
+        step=1
+
+    if sampling_rate not in [8000,16000]:
+        raise ValueError("Currently silero VAD models support 8000 and 16000 (or multiply of 16000) sample rates")
+
+    window=512 if sampling_rate==16000 else 256
+    min_speech_samples=sampling_rate*min_speech_duration_ms/1000
+    speech_pad_samples=sampling_rate*speech_pad_ms/1000
+    max_speech_samples=sampling_rate*max_speech_duration_s-window-2*speech_pad_samples
+    min_silence_samples=sampling_rate*min_silence_duration_ms/1000
+    audio_length_samples=len(audio)
+    if neg_threshold is None:
+        neg_threshold=max(threshold-0.15,0.01)
+
+    probs=speech_probs(audio,model,sampling_rate,block_windows,progress_tracking_callback)
+    if max_speech_samples==float("inf") and neg_threshold<=threshold:
+        speeches=_segments(probs,window,threshold,neg_threshold,min_speech_samples,min_silence_samples,
+                           audio_length_samples)
+    else:
+        speeches=_segments_loop(probs,window,threshold,neg_threshold,min_speech_samples,min_silence_samples,
+                                max_speech_samples,audio_length_samples,sampling_rate)
+
+    # 以下两端补齐和单位换算与原函数相同
+    for i,speech in enumerate(speeches):
+        if i==0:
+            speech["start"]=int(max(0,speech["start"]-speech_pad_samples))
+        if i!=len(speeches)-1:
+            silence_duration=speeches[i+1]["start"]-speech["end"]
+            if silence_duration<2*speech_pad_samples:
+                speech["end"]+=int(silence_duration//2)
+                speeches[i+1]["start"]=int(max(0,speeches[i+1]["start"]-silence_duration//2))
+            else:
+                speech["end"]=int(min(audio_length_samples,speech["end"]+speech_pad_samples))
+                speeches[i+1]["start"]=int(max(0,speeches[i+1]["start"]-speech_pad_samples))
+        else:
+            speech["end"]=int(min(audio_length_samples,speech["end"]+speech_pad_samples))
+
+    if return_seconds:
+        audio_length_seconds=audio_length_samples/sampling_rate
+        for speech_dict in speeches:
+            speech_dict["start"]=max(round(speech_dict["start"]/sampling_rate,time_resolution),0)
+            speech_dict["end"]=min(round(speech_dict["end"]/sampling_rate,time_resolution),audio_length_seconds)
+    elif step>1:
+        for speech_dict in speeches:
+            speech_dict["start"]*=step
+            speech_dict["end"]*=step
+    return speeches
@@ -1,27 +1,36 @@
 from faster_whisper import WhisperModel
+import numpy as np
 import os
+import threading
+from ALT_pure.log.load_log import logger
+TAG=__name__
 
+# (model_size, device) -> WhisperModel，连续识别(如流式接口的每段人声)不再重复加载
+_models={}
+# 加载耗时较长，锁内加载保证并发的首次调用只加载一次
+_models_lock=threading.Lock()
+MAX_MODELS=2
 
-def audio_to_text(audio_path, model_size="medium", language=None, device="cpu"):
-    """
-    将本地音频文件转为文本（支持中英文）
-
-    参数：
-    - audio_path: 音频文件路径（支持 mp3, wav, m4a 等常见格式）
-    - model_size: 模型大小，可选: 'tiny', 'base', 'small', 'medium', 'large-v2', 'large-v3'
-    - language: 语言代码，如 'zh' 中文, 'en' 英文，设为 None 可自动检测
-    - device: 运行设备，'cuda'（GPU）、'cpu'，'auto' 自动选择
 
-    返回：
-    - 识别出的文本字符串
-    """
+def _load_model(model_size, device):
+    key=(model_size,device)
+    model=_models.get(key)
+    if model is not None:
+        return model
+    with _models_lock:
+        model=_models.get(key)
+        if model is None:
+            model=_create_model(model_size,device)
+            if len(_models)>=MAX_MODELS:
+                _models.pop(next(iter(_models)))
+            _models[key]=model
+    return model
 
-    # 检查音频文件是否存在
-    if not os.path.exists(audio_path):
-        raise FileNotFoundError(f"音频文件未找到: {audio_path}")
 
+def _create_model(model_size, device):
     # 加载模型（首次运行会自动下载模型到缓存目录）
-    print(f"正在加载模型 '{model_size}'...")
+    log=logger.bind(tag=TAG)
+    log.info(f"正在加载模型 '{model_size}'...")
 
     # 处理 CUDA/cuDNN 问题，如果 GPU 不可用则回退到 CPU
     try:
@@ -40,13 +49,38 @@ def audio_to_text(audio_path, model_size="medium", language=None, device="cpu"):
             compute_type = "int8"
 
         model = WhisperModel(model_size, device=device, compute_type=compute_type)
-        print(f"使用设备: {device}")
+        log.info(f"使用设备: {device}")
     except Exception as e:
-        print(f"GPU 加速不可用，回退到 CPU: {e}")
+        log.warning(f"GPU 加速不可用，回退到 CPU: {e}")
         model = WhisperModel(model_size, device="cpu", compute_type="int8")
-        print("使用设备: cpu")
+        log.info("使用设备: cpu")
+    return model
+
+
+def audio_to_text(audio_path, model_size="medium", language=None, device="cpu"):
+    """
+    将本地音频文件转为文本（支持中英文）
+
+    参数：
+    - audio_path: 音频文件路径（支持 mp3, wav, m4a 等常见格式），或内存中的16kHz单声道int16 PCM（bytes/bytearray/memoryview）
+    - model_size: 模型大小，可选: 'tiny', 'base', 'small', 'medium', 'large-v2', 'large-v3'
+    - language: 语言代码，如 'zh' 中文, 'en' 英文，设为 None 可自动检测
+    - device: 运行设备，'cuda'（GPU）、'cpu'，'auto' 自动选择
+
+    返回：
+    - 识别出的文本字符串
+    """
+
+    # PCM缓冲区直接转成float数组交给模型，不写临时文件
+    if isinstance(audio_path, (bytes, bytearray, memoryview)):
+        audio_path = np.frombuffer(audio_path, dtype=np.int16).astype(np.float32) / 32768.0
+    # 检查音频文件是否存在
+    elif not os.path.exists(audio_path):
+        raise FileNotFoundError(f"音频文件未找到: {audio_path}")
+
+    model = _load_model(model_size, device)
 
-    print(f"开始识别音频: {audio_path}")
+    logger.bind(tag=TAG).info(f"开始识别音频: {'<PCM>' if isinstance(audio_path, np.ndarray) else audio_path}")
     segments, info = model.transcribe(
         audio_path,
         language=language,  # 可设为 'zh', 'en'，或 None 自动检测
@@ -59,7 +93,7 @@ def audio_to_text(audio_path, model_size="medium", language=None, device="cpu"):
 
     # 输出检测到的语言
     detected_lang = info.language
-    print(f"检测到的语言: {detected_lang} (置信度: {info.language_probability:.2f})")
+    logger.bind(tag=TAG).info(f"检测到的语言: {detected_lang} (置信度: {info.language_probability:.2f})")
 
     # 拼接所有文本段
     text = "".join(segment.text for segment in segments)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+from ALT_pure.log.load_log import logger
+from .task_manager import TaskManager
+TAG=__name__
+
+
+class JobQueue:
+    # SQLite持久化的后台任务队列，任务交给队列自己的TaskManager执行，同时执行的任务不超过max_workers个
+    # 队列不和其它调用共享并发名额：调用上游时的限流由上游自己的get_guard负责(与交互请求共用令牌桶)
+    # 同一key重复入队只保留最新的payload（如同一篇日记多次保存）；进程重启后未完成的任务继续执行
+    def __init__(self,name:str,handler:Callable[[str,dict],Awaitable[Any]],db_path:Callable[[],Path],
+                 max_workers:int=2,max_attempts:int=3,poll_interval:float=5.0,batch_size:int=8):
+        self.logger=logger.bind(tag=TAG)
+        self.name=name
+        self.handler=handler
+        self.db_path=db_path
+        # 整个队列的并发上限，每批任务一个任务组，任务组依次执行
+        self.max_workers=max(1,int(max_workers))
+        self.max_attempts=max_attempts
+        self.poll_interval=poll_interval
+        self.batch_size=batch_size
+        self.task_manager=None
+        self._runner=None
+        self._wakeup=None
+
+    def enqueue(self,key:str,payload:dict):
+        # 用户接口，入队或覆盖同key未完成的任务；任务进行中被覆盖时，旧结果不会把新任务标记为完成
+        now=time.time()
+        conn=self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO jobs(queue, key, payload, status, attempts, version, next_run_at, updated_at, error)
+                VALUES(?,?,?,'pending',0,1,?,?,NULL)
+                ON CONFLICT(queue, key) DO UPDATE SET
+                    payload=excluded.payload,
+                    status='pending',
+                    attempts=0,
+                    version=jobs.version+1,
+                    next_run_at=excluded.next_run_at,
+                    updated_at=excluded.updated_at,
+                    error=NULL
+                """,
+                (self.name,key,json.dumps(payload,ensure_ascii=False),now,now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def status(self,key:str)->Optional[dict]:
+        # 用户接口，查询某个任务的状态(pending/running/done/failed)
+        conn=self._connect()
+        try:
+            row=conn.execute("SELECT status, attempts, updated_at, error FROM jobs WHERE queue=? AND key=?",(self.name,key)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"status": row[0],"attempts": row[1],"updated_at": row[2],"error": row[3]}
+
+    async def start(self):
+        # 应用启动时调用：上次未执行完的running任务重新置为pending，启动后台执行循环
+        if self._runner is not None:
+            return
+        conn=self._connect()
+        try:
+            conn.execute("UPDATE jobs SET status='pending' WHERE queue=? AND status='running'",(self.name,))
+            conn.commit()
+        finally:
+            conn.close()
+        self._wakeup=asyncio.Event()
+        self.task_manager=TaskManager(self._run_job,max_workers=self.max_workers)
+        self._runner=asyncio.create_task(self._run())
+
+    async def stop(self):
+        # 应用关闭时调用，正在执行的任务下次启动时重新执行
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner=None
+        if self.task_manager is not None:
+            await self.task_manager.close()
+            self.task_manager=None
+
+    async def _run(self):
+        while True:
+            try:
+                jobs=self._claim()
+                if not jobs:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(),self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                group_id=await self.task_manager.add_group(jobs)
+                await self.task_manager.wait_for_group(group_id)
+                await self.task_manager.get_group_results(group_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"{self.name}队列执行出错: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _claim(self)->list:
+        # 取出一批到期的pending任务并标记为running
+        now=time.time()
+        conn=self._connect()
+        try:
+            rows=conn.execute(
+                "SELECT key, version, payload FROM jobs WHERE queue=? AND status='pending' AND next_run_at<=? ORDER BY next_run_at LIMIT ?",
+                (self.name,now,self.batch_size)
+            ).fetchall()
+            for key,version,_ in rows:
+                conn.execute("UPDATE jobs SET status='running', updated_at=? WHERE queue=? AND key=? AND version=?",(now,self.name,key,version))
+            conn.commit()
+        finally:
+            conn.close()
+        return [(key,version,json.loads(payload)) for key,version,payload in rows]
+
+    async def _run_job(self,key:str,version:int,payload:dict):
+        try:
+            await self.handler(key,payload)
+        except Exception as e:
+            self.logger.warning(f"{self.name}任务{key}失败: {e}")
+            self._finish(key,version,error=str(e))
+            return False
+        self._finish(key,version)
+        return True
+
+    def _finish(self,key:str,version:int,error:str=None):
+        # 只更新本次执行的版本，执行期间重新入队的任务保持pending
+        now=time.time()
+        conn=self._connect()
+        try:
+            if error is None:
+                conn.execute("UPDATE jobs SET status='done', updated_at=?, error=NULL WHERE queue=? AND key=? AND version=?",(now,self.name,key,version))
+            else:
+                row=conn.execute("SELECT attempts FROM jobs WHERE queue=? AND key=? AND version=?",(self.name,key,version)).fetchone()
+                if row is not None:
+                    attempts=row[0]+1
+                    status="failed" if attempts>=self.max_attempts else "pending"
+                    # 指数退避：30秒、60秒、120秒...
+                    conn.execute(
+                        "UPDATE jobs SET status=?, attempts=?, next_run_at=?, updated_at=?, error=? WHERE queue=? AND key=? AND version=?",
+                        (status,attempts,now+30*(2**(attempts-1)),now,error[:500],self.name,key,version)
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self)->sqlite3.Connection:
+        conn=sqlite3.connect(str(self.db_path()))
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                queue TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 1,
+                next_run_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                error TEXT,
+                PRIMARY KEY(queue, key)
+            )
+            """
+        )
+        return conn
@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from ALT_pure.log.load_log import logger
+from ALT_pure.config.load_config import config
+from typing import Any, Callable, Optional
+TAG=__name__
+
+# 未在config的rate_limit中配置的provider使用这组默认值
+DEFAULT_LIMITS={
+    "rate":5.0,               # 每秒补充的令牌数（请求数）
+    "burst":10,               # 令牌桶容量，允许的瞬时突发
+    "max_retries":3,          # 可重试错误的最大重试次数
+    "base_delay":0.5,         # 指数退避的基础间隔(秒)
+    "max_delay":8.0,          # 单次退避的最大间隔(秒)
+    "failure_threshold":5,    # 连续失败多少次后熔断
+    "recovery_time":30.0,     # 熔断后多少秒放行一次试探请求
+}
+
+
+class RetriableError(Exception):
+    # 上游限流(429)、服务繁忙(5xx)、网络抖动等可以重试的错误
+    def __init__(self,message:str="",retry_after:Optional[float]=None):
+        super().__init__(message)
+        self.retry_after=retry_after
+
+
+class CircuitOpenError(Exception):
+    # 熔断期间快速失败，不再请求上游
+    pass
+
+
+RETRIABLE_EXCEPTIONS=(RetriableError,ConnectionError,TimeoutError,asyncio.TimeoutError)
+
+
+class TokenBucket:
+    # 令牌桶，线程安全，同一个桶可同时服务于事件循环和工作线程
+    # 采用预约方式：令牌不足时直接透支，并返回需要等待的秒数，等待方按到达顺序排队
+    def __init__(self,rate:float,burst:int):
+        self.rate=max(float(rate),1e-6)
+        self.burst=max(int(burst),1)
+        self.tokens=float(self.burst)
+        self.updated=time.monotonic()
+        self._lock=threading.Lock()
+
+    def reserve(self)->float:
+        with self._lock:
+            now=time.monotonic()
+            self.tokens=min(self.burst,self.tokens+(now-self.updated)*self.rate)
+            self.updated=now
+            self.tokens-=1
+            if self.tokens>=0:
+                return 0.0
+            return -self.tokens/self.rate
+
+    async def acquire(self):
+        wait=self.reserve()
+        if wait>0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        wait=self.reserve()
+        if wait>0:
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    # 连续失败达到阈值后熔断，recovery_time后放行一个试探请求，成功则恢复
+    def __init__(self,failure_threshold:int,recovery_time:float):
+        self.failure_threshold=max(int(failure_threshold),1)
+        self.recovery_time=float(recovery_time)
+        self.failures=0
+        self.opened_at=None
+        self.probing=False
+        self._lock=threading.Lock()
+
+    def allow(self)->bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic()-self.opened_at<self.recovery_time:
+                return False
+            self.probing=True
+            return True
+
+    def release_probe(self):
+        # 试探请求被取消，未得出结论，允许下一次试探
+        with self._lock:
+            self.probing=False
+
+    def record_success(self):
+        with self._lock:
+            self.failures=0
+            self.opened_at=None
+            self.probing=False
+
+    def record_failure(self)->bool:
+        # 返回本次失败是否触发了熔断
+        with self._lock:
+            self.failures+=1
+            if self.probing or self.failures>=self.failure_threshold:
+                tripped=self.opened_at is None or self.probing
+                self.opened_at=time.monotonic()
+                self.probing=False
+                return tripped
+            return False
+
+
+class ProviderGuard:
+    # 上游调用保护：限流 + 抖动指数退避重试 + 熔断
+    # 只有RETRIABLE_EXCEPTIONS会重试并计入熔断，其余异常直接抛给调用方
+    def __init__(self,provider:str,limits:dict):
+        self.logger=logger.bind(tag=TAG)
+        self.provider=provider
+        self.bucket=TokenBucket(limits["rate"],limits["burst"])
+        self.breaker=CircuitBreaker(limits["failure_threshold"],limits["recovery_time"])
+        self.max_retries=int(limits["max_retries"])
+        self.base_delay=float(limits["base_delay"])
+        self.max_delay=float(limits["max_delay"])
+
+    async def call(self,func:Callable,*args,**kwargs)->Any:
+        # 保护一个异步函数调用
+        attempt=0
+        while True:
+            self._check_breaker()
+            await self.bucket.acquire()
+            try:
+                result=await func(*args,**kwargs)
+            except RETRIABLE_EXCEPTIONS as e:
+                delay=self._on_retriable(e,attempt)
+                attempt+=1
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # 上游有响应，只是请求本身有误，说明服务可用
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def call_sync(self,func:Callable,*args,**kwargs)->Any:
+        # 保护一个同步函数调用（在工作线程中使用）
+        attempt=0
+        while True:
+            self._check_breaker()
+            self.bucket.acquire_sync()
+            try:
+                result=func(*args,**kwargs)
+            except RETRIABLE_EXCEPTIONS as e:
+                delay=self._on_retriable(e,attempt)
+                attempt+=1
+                time.sleep(delay)
+                continue
+            except Exception:
+                # 上游有响应，只是请求本身有误，说明服务可用
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def stream(self,factory:Callable,*args,**kwargs):
+        # 保护一个异步流式生成器：首个分片产出之前的错误可以重试，之后的错误直接抛出
+        attempt=0
+        while True:
+            self._check_breaker()
+            await self.bucket.acquire()
+            started=False
+            try:
+                async for item in factory(*args,**kwargs):
+                    if not started:
+                        started=True
+                        self.breaker.record_success()
+                    yield item
+            except RETRIABLE_EXCEPTIONS as e:
+                if started:
+                    self.breaker.record_failure()
+                    raise
+                delay=self._on_retriable(e,attempt)
+                attempt+=1
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            if not started:
+                self.breaker.record_success()
+            return
+
+    def stream_sync(self,factory:Callable,*args,**kwargs):
+        # 保护一个同步流式生成器：首个分片产出之前的错误可以重试，之后的错误直接抛出
+        attempt=0
+        while True:
+            self._check_breaker()
+            self.bucket.acquire_sync()
+            started=False
+            try:
+                for item in factory(*args,**kwargs):
+                    if not started:
+                        started=True
+                        self.breaker.record_success()
+                    yield item
+            except RETRIABLE_EXCEPTIONS as e:
+                if started:
+                    self.breaker.record_failure()
+                    raise
+                delay=self._on_retriable(e,attempt)
+                attempt+=1
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            if not started:
+                self.breaker.record_success()
+            return
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.provider}连续失败已熔断，{self.breaker.recovery_time}秒后再试")
+
+    def _on_retriable(self,error:Exception,attempt:int)->float:
+        # 记录失败，超过重试次数则抛出，否则返回本次退避秒数
+        if attempt>=self.max_retries:
+            if self.breaker.record_failure():
+                self.logger.error(f"{self.provider}连续失败，熔断{self.breaker.recovery_time}秒")
+            raise error
+        delay=random.uniform(0,min(self.max_delay,self.base_delay*(2**attempt)))
+        retry_after=getattr(error,"retry_after",None)
+        if retry_after:
+            delay=max(delay,min(float(retry_after),self.max_delay))
+        self.logger.warning(f"{self.provider}请求失败({error})，{delay:.2f}秒后第{attempt+1}次重试")
+        return delay
+
+
+_guards={}
+_guards_lock=threading.Lock()
+
+
+def get_guard(provider:str,api_key:Optional[str]=None)->ProviderGuard:
+    # 用户接口，按(provider, api_key)获取共享的ProviderGuard，同一个key的所有调用共用一个令牌桶和熔断器
+    key_id=hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else ""
+    with _guards_lock:
+        guard=_guards.get((provider,key_id))
+        if guard is None:
+            limits=dict(DEFAULT_LIMITS)
+            limits.update(config.get("rate_limit",{}).get(provider,{}) or {})
+            guard=ProviderGuard(provider,limits)
+            _guards[(provider,key_id)]=guard
+        return guard
+
+
+def retry_after_seconds(value:Optional[str])->Optional[float]:
+    # 解析Retry-After响应头（只支持秒数形式）
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (TypeError,ValueError):
+        return None
@@ -0,0 +1,219 @@
+# rate_limiter自检：在server目录下运行 python -m ALT_pure.core.common.rate_limiter_check
+# 在本机随机端口启动一个aiohttp假上游(按脚本返回429/5xx、超时不响应、正常200)，用httpx按qwen/ollama的方式把429/5xx和网络错误转换成RetriableError
+# 依次检查：令牌桶的突发和匀速放行、带Retry-After的抖动退避重试、超时重试耗尽、熔断器closed->open->half-open->open/closed的状态变化
+# 全部通过时退出码为0，任一项失败时打印原因并以1退出
+import asyncio
+import socket
+import sys
+import time
+import httpx
+from aiohttp import web
+from .rate_limiter import CircuitBreaker, CircuitOpenError, DEFAULT_LIMITS, ProviderGuard, RetriableError, TokenBucket, retry_after_seconds
+
+RETRIABLE_STATUS={429,500,502,503,504}
+
+
+class FakeUpstream:
+    # 假上游：/script/{key}按预设的状态码序列逐次响应(最后一项重复)，/hang不响应，/slow/{status}延迟后返回status
+    def __init__(self):
+        self.scripts={}
+        self.hits={}
+        self.runner=None
+        self.base_url=None
+
+    def script(self,key:str,responses:list):
+        # responses的每一项为状态码或(状态码, Retry-After秒数)
+        self.scripts[key]=list(responses)
+        self.hits[key]=0
+
+    async def start(self):
+        app=web.Application()
+        app.router.add_get("/script/{key}",self._script)
+        app.router.add_get("/hang",self._hang)
+        app.router.add_get("/slow/{status}",self._slow)
+        self.runner=web.AppRunner(app)
+        await self.runner.setup()
+        sock=socket.socket()
+        sock.bind(("127.0.0.1",0))
+        await web.SockSite(self.runner,sock).start()
+        port=sock.getsockname()[1]
+        self.base_url=f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def _script(self,request):
+        key=request.match_info["key"]
+        self.hits[key]=self.hits.get(key,0)+1
+        queue=self.scripts.setdefault(key,[200])
+        item=queue.pop(0) if len(queue)>1 else queue[0]
+        status,retry_after=item if isinstance(item,tuple) else (item,None)
+        headers={"Retry-After":str(retry_after)} if retry_after is not None else {}
+        return web.json_response({"status":status},status=status,headers=headers)
+
+    async def _hang(self,request):
+        self.hits["hang"]=self.hits.get("hang",0)+1
+        await asyncio.sleep(30)
+        return web.json_response({})
+
+    async def _slow(self,request):
+        self.hits["slow"]=self.hits.get("slow",0)+1
+        await asyncio.sleep(0.2)
+        return web.json_response({},status=int(request.match_info["status"]))
+
+
+async def fetch(client:httpx.AsyncClient,url:str)->int:
+    # 与qwen/ollama相同的错误转换
+    try:
+        response=await client.get(url)
+    except httpx.TransportError as e:
+        raise RetriableError(f"网络错误: {e!r}")
+    if response.status_code in RETRIABLE_STATUS:
+        raise RetriableError(f"HTTP {response.status_code}",retry_after_seconds(response.headers.get("Retry-After")))
+    return response.status_code
+
+
+def make_guard(name:str,**limits)->ProviderGuard:
+    merged=dict(DEFAULT_LIMITS)
+    merged.update(limits)
+    return ProviderGuard(name,merged)
+
+
+def breaker_state(breaker:CircuitBreaker)->str:
+    if breaker.opened_at is None:
+        return "closed"
+    return "half-open" if breaker.probing else "open"
+
+
+async def check_token_bucket(upstream,client):
+    # burst个请求立即放行，其余按rate匀速放行
+    bucket=TokenBucket(rate=20,burst=5)
+    start=time.monotonic()
+    stamps=[]
+    for _ in range(25):
+        await bucket.acquire()
+        stamps.append(time.monotonic()-start)
+    assert stamps[4]<0.05,f"突发的5个请求应立即放行，第5个在{stamps[4]:.3f}s"
+    assert 0.9<=stamps[-1]<=1.3,f"其余20个请求应在约1s内匀速放行，实际{stamps[-1]:.3f}s"
+    # 令牌桶线程安全：工作线程中的同步等待与事件循环共用一个桶
+    bucket=TokenBucket(rate=50,burst=1)
+    start=time.monotonic()
+    await asyncio.gather(*(asyncio.to_thread(bucket.acquire_sync) for _ in range(5)),*(bucket.acquire() for _ in range(5)))
+    elapsed=time.monotonic()-start
+    assert 0.15<=elapsed<=0.35,f"10个请求在rate=50下应约0.18s完成，实际{elapsed:.3f}s"
+    return f"burst 5 at {stamps[4]*1000:.0f}ms, 25 requests in {stamps[-1]:.2f}s; mixed thread/loop 10 requests in {elapsed:.2f}s"
+
+
+async def check_retry(upstream,client):
+    # 429(Retry-After 0.3s)和503之后成功；退避时间带抖动并且不小于Retry-After
+    guard=make_guard("retry",rate=100,burst=100,max_retries=3,base_delay=0.05,max_delay=1.0)
+    upstream.script("retry",[(429,0.3),503,200])
+    start=time.monotonic()
+    status=await guard.call(fetch,client,f"{upstream.base_url}/script/retry")
+    elapsed=time.monotonic()-start
+    assert status==200 and upstream.hits["retry"]==3,f"应在第3次请求成功，实际{upstream.hits['retry']}次，状态{status}"
+    assert elapsed>=0.3,f"应遵守Retry-After=0.3s，实际{elapsed:.3f}s"
+    assert breaker_state(guard.breaker)=="closed"
+    # 抖动：第n次重试的间隔均匀分布在[0, min(max_delay, base_delay*2^n)]
+    delays=[guard._on_retriable(RetriableError("x"),2) for _ in range(200)]
+    assert max(delays)<=0.2 and min(delays)>=0,f"第3次重试的间隔应在[0,0.2]内，实际[{min(delays):.3f},{max(delays):.3f}]"
+    assert len({round(d,4) for d in delays})>100,"重试间隔没有抖动"
+    # 非可重试错误(如400)不重试
+    upstream.script("bad",[400])
+    status=await guard.call(fetch,client,f"{upstream.base_url}/script/bad")
+    assert status==400 and upstream.hits["bad"]==1
+    return f"429+503 then 200 after {elapsed:.2f}s (Retry-After honoured); jitter spread [{min(delays):.3f},{max(delays):.3f}]s"
+
+
+async def check_timeout(upstream,client):
+    # 上游不响应：每次超时都重试，max_retries用完后抛出RetriableError
+    guard=make_guard("timeout",rate=100,burst=100,max_retries=2,base_delay=0.01,max_delay=0.05)
+    short=httpx.AsyncClient(timeout=0.1)
+    try:
+        await guard.call(fetch,short,f"{upstream.base_url}/hang")
+    except RetriableError:
+        pass
+    else:
+        raise AssertionError("超时应在重试耗尽后抛出RetriableError")
+    finally:
+        await short.aclose()
+    assert upstream.hits["hang"]==3,f"应请求3次(1次+2次重试)，实际{upstream.hits['hang']}次"
+    return "3 attempts timed out, RetriableError raised"
+
+
+async def check_breaker(upstream,client):
+    guard=make_guard("breaker",rate=100,burst=100,max_retries=0,failure_threshold=2,recovery_time=0.5)
+    upstream.script("down",[500])
+    states=[breaker_state(guard.breaker)]
+    for _ in range(2):
+        try:
+            await guard.call(fetch,client,f"{upstream.base_url}/script/down")
+        except RetriableError:
+            pass
+    states.append(breaker_state(guard.breaker))
+    assert states[-1]=="open","连续失败2次后应熔断"
+    # 熔断期间快速失败，不请求上游
+    hits=upstream.hits["down"]
+    try:
+        await guard.call(fetch,client,f"{upstream.base_url}/script/down")
+        raise AssertionError("熔断期间应抛出CircuitOpenError")
+    except CircuitOpenError:
+        pass
+    assert upstream.hits["down"]==hits,"熔断期间不应请求上游"
+
+    # recovery_time后只放行一个试探请求；试探失败重新熔断
+    await asyncio.sleep(0.55)
+    probe=asyncio.create_task(guard.call(fetch,client,f"{upstream.base_url}/slow/503"))
+    await asyncio.sleep(0.05)
+    states.append(breaker_state(guard.breaker))
+    assert states[-1]=="half-open","recovery_time后应进入half-open"
+    try:
+        await guard.call(fetch,client,f"{upstream.base_url}/script/down")
+        raise AssertionError("试探期间其它请求应快速失败")
+    except CircuitOpenError:
+        pass
+    try:
+        await probe
+    except RetriableError:
+        pass
+    states.append(breaker_state(guard.breaker))
+    assert states[-1]=="open","试探失败后应重新熔断"
+
+    # 再次等待后试探成功，恢复closed
+    await asyncio.sleep(0.55)
+    status=await guard.call(fetch,client,f"{upstream.base_url}/slow/200")
+    states.append(breaker_state(guard.breaker))
+    assert status==200 and states[-1]=="closed","试探成功后应恢复closed"
+    upstream.script("up",[200])
+    assert await guard.call(fetch,client,f"{upstream.base_url}/script/up")==200
+    return " -> ".join(states)
+
+
+CHECKS=(
+    ("token bucket",check_token_bucket),
+    ("retry with jitter",check_retry),
+    ("timeout",check_timeout),
+    ("circuit breaker",check_breaker),
+)
+
+
+async def run()->bool:
+    upstream=FakeUpstream()
+    await upstream.start()
+    ok=True
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            for name,check in CHECKS:
+                try:
+                    detail=await check(upstream,client)
+                    print(f"[ok]     {name}: {detail}")
+                except AssertionError as e:
+                    ok=False
+                    print(f"[FAILED] {name}: {e}")
+    finally:
+        await upstream.stop()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run()) else 1)
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Abandoned(Exception):
+    # 执行者被取消，等待者需要自己重新发起
+    pass
+
+
+class SingleFlight:
+    # 相同key的并发调用只执行一次，其余调用等待同一个结果；调用结束后key即释放，不做缓存
+    # 只在同一个事件循环内合并，不同事件循环(如工作线程里的asyncio.run)各自执行
+    def __init__(self):
+        self._calls={}
+
+    def in_flight(self,key:Hashable)->bool:
+        future=self._calls.get(key)
+        return future is not None and not future.done()
+
+    async def do(self,key:Hashable,func:Callable[[],Awaitable[Any]])->Any:
+        loop=asyncio.get_running_loop()
+        while True:
+            future=self._calls.get(key)
+            if future is None or future.done() or future.get_loop() is not loop:
+                break
+            try:
+                # shield: 等待者被取消不影响执行者和其他等待者
+                return await asyncio.shield(future)
+            except _Abandoned:
+                continue
+
+        future=loop.create_future()
+        self._calls[key]=future
+        try:
+            result=await func()
+        except asyncio.CancelledError:
+            future.set_exception(_Abandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免"exception was never retrieved"告警
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
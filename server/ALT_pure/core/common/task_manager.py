@@ -1,21 +1,36 @@
 import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
 from ALT_pure.log.load_log import logger
 from typing import List, Any, Callable, Optional
 import uuid
 TAG=__name__
+_GROUP_DONE=object()
+# 任务组优先级对应的轮转权重：interactive每轮最多连续获得4个名额，batch为1个
+PRIORITY_WEIGHTS={"interactive":4,"batch":1}
 
 class TaskGroup:
     group_id:str
     items:List[Any]
     cancel_event:asyncio.Event
-    def __init__(self,items:List[Any],g_id:str=None):
+    def __init__(self,items:List[Any],g_id:str=None,priority:str="interactive"):
         self.logger=logger.bind(tag=TAG)
         self.group_id=str(uuid.uuid4())[:8] if g_id is None else g_id
-        self.items=items
+        if priority not in PRIORITY_WEIGHTS:
+            self.logger.warning(f"未知的任务组优先级 {priority}，按interactive处理")
+            priority="interactive"
+        self.priority=priority
+        self.weight=PRIORITY_WEIGHTS[priority]
+        self.items=list(items)
         self.cancel_event=asyncio.Event()
         self.completion_event=asyncio.Event()
-        self.results={}
+        # 任务项以序号定位，结果按序号预分配，完成一项O(1)
+        self.results=[None]*len(self.items)
+        self.futures=[asyncio.get_running_loop().create_future() for _ in self.items]
         self.completed_count=0
+        # 按完成顺序推送(序号,结果)，任务组结束时推送_GROUP_DONE
+        self.result_queue=asyncio.Queue()
 
     def cancel(self):
         self.logger.info(f"任务组 {self.group_id}被取消")
@@ -25,38 +40,169 @@ class TaskGroup:
         return self.cancel_event.is_set()
 
     def set_completed(self):
+        # 被取消而未执行的任务项，future以None结束，避免等待方永远挂起
+        for future in self.futures:
+            if not future.done():
+                future.set_result(None)
         self.completion_event.set()
+        self.result_queue.put_nowait(_GROUP_DONE)
 
     async def wait_for_completion(self):
         await self.completion_event.wait()
 
-    def add_item(self,item:Any):
+    def add_item(self,item:Any)->asyncio.Future:
         self.items.append(item)
+        self.results.append(None)
+        future=asyncio.get_running_loop().create_future()
+        self.futures.append(future)
+        return future
 
-    def add_result(self,item:Any,result:Any):
-        try:
-            index=self.items.index(item)
-            self.results[index]=result
-            self.completed_count+=1
-        except ValueError:
-            self.logger.warning(f"未能找到任务项 {item} 在任务组 {self.group_id} 中的位置")
+    def add_result(self,index:int,result:Any):
+        self.results[index]=result
+        self.completed_count+=1
+        if not self.futures[index].done():
+            self.futures[index].set_result(result)
+        self.result_queue.put_nowait((index,result))
 
     def get_results(self):
-        ordered_results = []
-        for i in range(len(self.items)):
-            if i in self.results:
-                ordered_results.append(self.results[i])
+        return list(self.results)
+
+
+class FairLimiter:
+    # 并发预算：所有使用者共享limit个名额；按provider在进程内共享一个(见get_limiter)
+    # 名额紧张时，在有任务等待的任务组间按权重轮转分配，长任务组无法饿死新来的任务组
+    # 状态由线程锁保护，可以同时服务多个事件循环(如工作线程里asyncio.run的调用)，名额通过各自循环的call_soon_threadsafe交付
+    def __init__(self,limit:int):
+        self.limit=max(1,int(limit))
+        self.running=0
+        self.waiters={}
+        self.weights={}
+        self.ring=deque()
+        # 队首任务组本轮还能连续获得的名额数
+        self.credit=0
+        self._lock=threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self,group_id:str,weight:int=1):
+        await self.acquire(group_id,weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self,group_id:str,weight:int=1):
+        loop=asyncio.get_running_loop()
+        with self._lock:
+            if self.running<self.limit and not self.ring:
+                self.running+=1
+                return
+            future=loop.create_future()
+            queue=self.waiters.get(group_id)
+            if queue is None:
+                queue=self.waiters[group_id]=deque()
+                self.weights[group_id]=max(1,int(weight))
+                self.ring.append(group_id)
+            queue.append(future)
+            granted=self._dispatch()
+        self._wake(granted)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名额后才被取消，归还名额
+                self.release()
+            else:
+                # 还在排队时移出队列；已分配但还没交付的名额由_grant归还
+                with self._lock:
+                    self._discard(group_id,future)
+            raise
+
+    def release(self):
+        with self._lock:
+            self.running-=1
+            granted=self._dispatch()
+        self._wake(granted)
+
+    def _dispatch(self)->list:
+        # 调用方持有self._lock；返回分配到名额的future，在锁外交付
+        granted=[]
+        while self.running<self.limit and self.ring:
+            group_id=self.ring[0]
+            queue=self.waiters[group_id]
+            future=queue.popleft()
+            if self.credit<=0:
+                self.credit=self.weights[group_id]
+            self.credit-=1
+            if not queue:
+                self._drop_head(group_id)
+            elif self.credit<=0:
+                self.ring.rotate(-1)
+            if future.done():
+                continue
+            self.running+=1
+            granted.append(future)
+        return granted
+
+    def _wake(self,granted:list):
+        for future in granted:
+            loop=future.get_loop()
+            if loop.is_closed():
+                self.release()
+            else:
+                loop.call_soon_threadsafe(self._grant,future)
+
+    def _grant(self,future:asyncio.Future):
+        # 在future所属的事件循环中执行；等待方已被取消时归还名额
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _drop_head(self,group_id:str):
+        self.ring.popleft()
+        self.waiters.pop(group_id,None)
+        self.weights.pop(group_id,None)
+        self.credit=0
+
+    def _discard(self,group_id:str,future:asyncio.Future):
+        queue=self.waiters.get(group_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        if not queue:
+            if self.ring and self.ring[0]==group_id:
+                self._drop_head(group_id)
             else:
-                ordered_results.append(None)
-        return ordered_results
+                self.ring.remove(group_id)
+                self.waiters.pop(group_id,None)
+                self.weights.pop(group_id,None)
+
+
+_limiters={}
+_limiters_lock=threading.Lock()
+
+
+def get_limiter(name:str,limit:int)->FairLimiter:
+    # 用户接口，按名字(通常是provider)获取进程内共享的FairLimiter，所有TaskManager和直接调用共用同一份并发预算
+    # limit只在第一次创建时生效
+    with _limiters_lock:
+        limiter=_limiters.get(name)
+        if limiter is None:
+            limiter=_limiters[name]=FairLimiter(limit)
+        return limiter
 
 
 class TaskManager:
-    def __init__(self,worker:Callable,max_workers:int=3,single:bool=True):
+    def __init__(self,worker:Callable,max_workers:int=3,single:bool=True,limiter:Optional[FairLimiter]=None):
         self.logger=logger.bind(tag=TAG)
         self.worker=worker
-        # max_workers最大并发量
-        self.max_workers=max_workers
+        # max_workers最大并发量，整个管理器共享，与同时运行多少个任务组无关
+        # 传入limiter(get_limiter取得的共享预算)时与其它管理器和直接调用合计，max_workers不再生效
+        self.limiter=limiter if limiter is not None else FairLimiter(max_workers)
+        self.max_workers=self.limiter.limit
 
         self.queue=asyncio.Queue()
         self.task_groups={}
@@ -83,12 +229,13 @@ class TaskManager:
                 self.logger.warning(f"任务组:{group_id} 不存在")
                 return None
 
-    async def add_group(self,items:List[Any],g_id:str=None)-> Optional[str]:
+    async def add_group(self,items:List[Any],g_id:str=None,priority:str="interactive")-> Optional[str]:
         # 用户接口，用于一次添加任务组，返回任务组id
+        # priority为interactive（默认，如对话播报）或batch（如整篇日记朗读），batch在争抢名额时权重更低
         if not items:
             return None
 
-        group = TaskGroup(items,g_id)
+        group = TaskGroup(items,g_id,priority)
         await self.queue.put(group)
 
         async with self.lock:
@@ -106,29 +253,54 @@ class TaskManager:
             else:
                 self.logger.warning(f"[取消]任务组 {group_id}不存在或已完成")
     async def wait_for_group(self,group_id:str):
+        # 锁内只查找任务组，等待放在锁外，避免阻塞其他任务组的添加和查询
         async with self.lock:
             group=self.task_groups.get(group_id)
-            if group:
-                await group.wait_for_completion()
-            else:
-                self.logger.success(f"[等待]任务组 {group_id}不存在或已完成")
+        if group:
+            await group.wait_for_completion()
+        else:
+            self.logger.success(f"[等待]任务组 {group_id}不存在或已完成")
 
-    async def add_items_to_group(self,group_id=None,items:List[Any]=None):
+    async def get_group_futures(self,group_id:str)->Optional[List[asyncio.Future]]:
+        # 用户接口，返回任务组内每个任务项的future（与items同序），可单独await某一项的结果
+        async with self.lock:
+            group=self.task_groups.get(group_id) or self.completed_task_groups.get(group_id)
+        if group is None:
+            self.logger.warning(f"任务组:{group_id} 不存在")
+            return None
+        return list(group.futures)
+
+    async def iter_group_results(self,group_id:str):
+        # 用户接口，按完成顺序逐个产出(序号,结果)，任务组结束后停止；只能有一个消费者
+        async with self.lock:
+            group=self.task_groups.get(group_id) or self.completed_task_groups.get(group_id)
+        if group is None:
+            self.logger.warning(f"任务组:{group_id} 不存在")
+            return
+        while True:
+            item=await group.result_queue.get()
+            if item is _GROUP_DONE:
+                break
+            yield item
+
+    async def add_items_to_group(self,group_id=None,items:List[Any]=None)->Optional[List[asyncio.Future]]:
+        # 返回新增任务项各自的future
         if not items:
             self.logger.warning("没有任务需要添加到任务组")
-            return
+            return None
 
         async with self.lock:
             group=self.task_groups.get(group_id)
             if group:
-                for item in items:
-                    group.add_item(item)
+                futures=[group.add_item(item) for item in items]
                 self.logger.info(f"[新增]{len(items)}个任务到任务组 ({group_id})")
+                return futures
             else:
                 new_group = TaskGroup(items, group_id)
                 await self.queue.put(new_group)
                 self.task_groups[new_group.group_id] = new_group
                 self.logger.info(f"【添加】原任务组 ({group_id}) 已完成，创建了新组 ({new_group.group_id})")
+                return list(new_group.futures)
     async def _consumer(self):
         while True:
             try:
@@ -161,35 +333,35 @@ class TaskManager:
             self.logger.error(e)
     async def _process_group(self,group:TaskGroup):
         try :
-            semaphore=asyncio.Semaphore(self.max_workers)
-            tasks=[]
+            async def wrapped_task(index:int):
+                i=group.items[index]
+                if await group.is_cancelled():
+                    self.logger.info(f"跳过任务: {i}(所属组 {group.group_id}已取消)")
+                    return
 
-            for item in group.items:
-                async def wrapped_task(i=item):
+                async with self.limiter.slot(group.group_id,group.weight):
                     if await group.is_cancelled():
-                        self.logger.info(f"跳过任务: {i}(所属组 {group.group_id}已取消)")
+                        self.logger.info(f'跳过任务：{i}(等待并发名额时候取消)')
                         return
 
-                    async with semaphore:
-                        if await group.is_cancelled():
-                            self.logger.info(f'跳过任务：{i}(等待信号量时候取消)')
-                            return
-
-                        try :
-                            if isinstance(i,(list,tuple)):
-                                result=await self.worker(*i)
-                            elif isinstance(i,dict):
-                                result=await self.worker(**i)
-                            else:
-                                result=await self.worker(i)
-                            group.add_result(i,result)
-                        except Exception as ex:
-                            self.logger.error(f"任务组 {group.group_id}执行任务 {i} 失败: {ex}")
-                            group.add_result(i,None)
-                task=asyncio.create_task(wrapped_task())
-                tasks.append(task)
-
-            await asyncio.gather(*tasks,return_exceptions=True)
+                    try :
+                        if isinstance(i,(list,tuple)):
+                            result=await self.worker(*i)
+                        elif isinstance(i,dict):
+                            result=await self.worker(**i)
+                        else:
+                            result=await self.worker(i)
+                        group.add_result(index,result)
+                    except Exception as ex:
+                        self.logger.error(f"任务组 {group.group_id}执行任务 {i} 失败: {ex}")
+                        group.add_result(index,None)
+
+            # 执行期间通过add_items_to_group追加的任务项，在下一轮中继续执行
+            started=0
+            while started<len(group.items):
+                tasks=[asyncio.create_task(wrapped_task(index)) for index in range(started,len(group.items))]
+                started+=len(tasks)
+                await asyncio.gather(*tasks,return_exceptions=True)
 
         except Exception as e:
             self.logger.error(f"任务组 {group.group_id}执行失败: {e}")
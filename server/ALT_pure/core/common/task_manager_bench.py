@@ -0,0 +1,104 @@
+# TaskManager基准：在server目录下运行 python -m ALT_pure.core.common.task_manager_bench [--items 10000] [--workers 64] [--repeat 3]
+# 用只让出一次事件循环的空worker，分别统计add_group返回、任务组全部完成、按序取回结果的耗时
+# legacy为原来的实现(完成一项用items.index查序号、结果存dict后逐项拼出有序列表、每个任务组一个Semaphore)；current为当前TaskManager
+import argparse
+import asyncio
+import time
+from .task_manager import TaskGroup, TaskManager
+
+
+class LegacyTaskGroup(TaskGroup):
+    # 原来的结果记录方式：按任务项的值查找序号，结果存在dict里
+    def __init__(self,items,g_id=None,priority="interactive"):
+        super().__init__(items,g_id,priority)
+        self.results={}
+
+    def add_result(self,item,result):
+        index=self.items.index(item)
+        self.results[index]=result
+        self.completed_count+=1
+        self.result_queue.put_nowait((index,result))
+
+    def get_results(self):
+        ordered_results=[]
+        for i in range(len(self.items)):
+            if i in self.results:
+                ordered_results.append(self.results[i])
+            else:
+                ordered_results.append(None)
+        return ordered_results
+
+
+class LegacyTaskManager(TaskManager):
+    # 原来的add_group和_process_group
+    async def add_group(self,items,g_id=None,priority="interactive"):
+        if not items:
+            return None
+        group=LegacyTaskGroup(items,g_id,priority)
+        await self.queue.put(group)
+        async with self.lock:
+            self.task_groups[group.group_id]=group
+        return group.group_id
+
+    async def _process_group(self,group):
+        try:
+            semaphore=asyncio.Semaphore(self.max_workers)
+            tasks=[]
+            for item in group.items:
+                async def wrapped_task(i=item):
+                    if await group.is_cancelled():
+                        return
+                    async with semaphore:
+                        if await group.is_cancelled():
+                            return
+                        try:
+                            result=await self.worker(i)
+                            group.add_result(i,result)
+                        except Exception:
+                            group.add_result(i,None)
+                tasks.append(asyncio.create_task(wrapped_task()))
+            await asyncio.gather(*tasks,return_exceptions=True)
+        finally:
+            group.completion_event.set()
+            async with self.lock:
+                self.task_groups.pop(group.group_id,None)
+                self.completed_task_groups[group.group_id]=group
+            self.queue.task_done()
+
+
+async def worker(item):
+    await asyncio.sleep(0)
+    return item
+
+
+async def measure(manager_cls,items:int,workers:int)->tuple:
+    # 返回(add_group, 完成, 按序取结果)的毫秒数
+    manager=manager_cls(worker,max_workers=workers)
+    data=list(range(items))
+    start=time.perf_counter()
+    group_id=await manager.add_group(data)
+    added=time.perf_counter()
+    await manager.wait_for_group(group_id)
+    completed=time.perf_counter()
+    results=await manager.get_group_results(group_id)
+    fetched=time.perf_counter()
+    assert results==data
+    await manager.close()
+    return (added-start)*1000,(completed-added)*1000,(fetched-completed)*1000
+
+
+async def run(items:int,workers:int,repeat:int):
+    print(f"{'impl':10s}{'items':>8s}{'add_group ms':>15s}{'complete ms':>15s}{'results ms':>15s}   (best of {repeat})")
+    for name,manager_cls in (("legacy",LegacyTaskManager),("current",TaskManager)):
+        rows=[await measure(manager_cls,items,workers) for _ in range(repeat)]
+        add_ms,complete_ms,results_ms=(min(column) for column in zip(*rows))
+        print(f"{name:10s}{items:8d}{add_ms:15.2f}{complete_ms:15.2f}{results_ms:15.2f}")
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="TaskManager基准")
+    parser.add_argument("--items",type=int,default=10000,help="任务组内的任务项数")
+    parser.add_argument("--workers",type=int,default=64,help="max_workers")
+    parser.add_argument("--repeat",type=int,default=3,help="每种实现运行的次数，取最短耗时")
+    args=parser.parse_args()
+    asyncio.run(run(args.items,args.workers,args.repeat))
@@ -0,0 +1,103 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Tuple
+from ALT_pure.log.load_log import logger
+from ALT_pure.config.load_config import config
+from .text_processor import TextProcessor
+TAG=__name__
+
+OPS=("clean","cut","merge")
+
+# 每个进程各自的TextProcessor，工作进程第一次执行时创建
+_processor=None
+
+
+def run_chunk(op:str,items:list,language:str="auto")->list:
+    # 在工作进程(或当前线程)中处理一块文本；clean/cut的item是字符串，merge的item是字符串列表
+    global _processor
+    if _processor is None:
+        _processor=TextProcessor()
+    if op=="clean":
+        return [_processor.text_clean(text) for text in items]
+    if op=="cut":
+        return [_processor.text_cutter_by_language(text,language) for text in items]
+    if op=="merge":
+        return [_processor.text_merger(texts) for texts in items]
+    raise ValueError(f"不支持的批量操作: {op}")
+
+
+class TextBatchPool:
+    # 批量文本处理：小批量直接在当前线程处理；大批量按chunk_size分块交给进程池(文本处理是CPU密集的纯Python，线程池无法并行)
+    # 进程池在第一次大批量请求时创建，进程不可用时退回到线程中顺序处理
+    def __init__(self):
+        self.logger=logger.bind(tag=TAG)
+        options=(config.get("text_processor",{}) or {}).get("batch",{}) or {}
+        self.workers=int(options.get("workers",min(4,os.cpu_count() or 1)))
+        self.chunk_size=max(1,int(options.get("chunk_size",256)))
+        self.inline_max=int(options.get("inline_max",64))
+        self.max_items=int(options.get("max_items",100000))
+        self._executor=None
+
+    async def map(self,op:str,items:list,language:str="auto")->list:
+        # 用户接口，返回与items同序的结果列表
+        results=[None]*len(items)
+        async for index,result in self.iter(op,items,language):
+            results[index]=result
+        return results
+
+    async def iter(self,op:str,items:list,language:str="auto")->AsyncIterator[Tuple[int,object]]:
+        # 用户接口，按完成顺序产出(序号, 结果)，块内按原顺序
+        if op not in OPS:
+            raise ValueError(f"不支持的批量操作: {op}")
+        if len(items)<=self.inline_max:
+            for index,result in enumerate(run_chunk(op,items,language)):
+                yield index,result
+            return
+
+        loop=asyncio.get_running_loop()
+        executor=self._get_executor()
+        pending={}
+        for start in range(0,len(items),self.chunk_size):
+            future=loop.run_in_executor(executor,run_chunk,op,items[start:start+self.chunk_size],language)
+            pending[future]=start
+        try:
+            while pending:
+                done,_=await asyncio.wait(pending,return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    start=pending.pop(future)
+                    try:
+                        chunk=future.result()
+                    except BrokenProcessPool:
+                        self.logger.warning("文本处理进程池不可用，改为在线程中处理")
+                        self.shutdown()
+                        chunk=await asyncio.to_thread(run_chunk,op,items[start:start+self.chunk_size],language)
+                    for offset,result in enumerate(chunk):
+                        yield start+offset,result
+        finally:
+            # 客户端断开等情况下取消尚未开始的块
+            for future in pending:
+                future.cancel()
+
+    def _get_executor(self):
+        if self.workers<=0:
+            return None  # 使用事件循环默认的线程池
+        if self._executor is None:
+            try:
+                self._executor=ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError,NotImplementedError) as e:
+                self.logger.warning(f"无法创建文本处理进程池，改用线程池: {e}")
+                self.workers=0
+                return None
+        return self._executor
+
+    def shutdown(self):
+        # 应用关闭时调用；之后再有大批量请求会重新创建进程池
+        if self._executor is not None:
+            self._executor.shutdown(wait=False,cancel_futures=True)
+            self._executor=None
+
+
+# 进程内共享的批量处理池
+text_batch_pool=TextBatchPool()
@@ -4,6 +4,92 @@ import re
 import emoji
 TAG=__name__
 
+# ---- 文本清洗：全部预编译，表情只用一次正则扫描定位 ----
+# 表情：以表情首字符开头，后接零宽连接符/变体选择符/键帽/标签字符或其他表情字符的连续片段，
+# 命中后再交给emoji.replace_emoji判断，保证和逐个替换的结果一致；数字、#、*只在键帽序列中算表情
+def _emoji_start_class()->str:
+    # BMP内的首字符逐个列出；BMP外的首字符合并为少量区间(间隔不超过256的合并)，
+    # sre对BMP外的字符只能逐项比较，区间少时扫描快得多；多匹配到的非表情字符会被replace_emoji原样保留
+    ranges=[]
+    for code in sorted({ord(key[0]) for key in emoji.EMOJI_DATA if ord(key[0])>=128}):
+        gap=1 if code<0x10000 else 257
+        if ranges and code-ranges[-1][1]<=gap:
+            ranges[-1][1]=code
+        else:
+            ranges.append([code,code])
+    # 单独出现的变体选择符(U+FE0F)也会被replace_emoji删除
+    return "[\\ufe0f"+"".join(f"\\U{a:08x}-\\U{b:08x}" if a!=b else f"\\U{a:08x}" for a,b in ranges)+"]"
+
+
+_EMOJI_STARTS_CLASS=_emoji_start_class()
+_EMOJI_JOINERS="[\u200d\ufe0f\u20e3\U000E0020-\U000E007F]"
+_EMOJI_RE=re.compile(rf"{_EMOJI_STARTS_CLASS}(?:{_EMOJI_JOINERS}|{_EMOJI_STARTS_CLASS})*|[0-9#*]\ufe0f?\u20e3")
+# markdown和网址按原先的顺序逐个替换(前一条规则的结果会影响后一条)；
+# 每条规则先用字符串查找判断标记是否存在，不存在就跳过，普通文本不需要正则扫描
+_CLEAN_RULES=[
+    (("*","_"),re.compile(r'(\*{1,2}|_)(.+?)(\*{1,2}|_)'),r'\2'),            # **粗体**、*斜体*、_斜体_
+    (("![",),re.compile(r'!\[.*?]\(.*?\)'),''),                              # ![图片](链接)
+    (("$$",),re.compile(r'\$\$(.+?)\$\$(?:\$\$.*?\$\$)?'),r'\1'),          # $$公式$$
+    (("#",),re.compile(r'^#{1,6}\s*',re.MULTILINE),''),                        # 行首的#标题
+    (("*","-"),re.compile(r'^[*-]\s+',re.MULTILINE),''),                       # 行首的列表符号
+    (("http://","https://"),re.compile(r'https?://\S+'),''),                   # 网址
+]
+
+# ---- 语言判断 ----
+_ZH_RE=re.compile(r'[\u4e00-\u9fff]')
+_LATIN_RE=re.compile(r'[a-zA-Z]')
+_FR_RE=re.compile(r'[À-ÿ]')          # 法语字符(德语的ÄÖÜäöüß也在此范围内，按原规则判为fr)
+_JA_RE=re.compile(r'[ぁ-ゔァ-ヴー]')  # 日语假名
+
+# ---- 分句 ----
+_MIXED_SPLIT_RE=re.compile(
+    r'(?<=[。！？；…])|'  # 中文标点
+    r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s+|'
+    r'(?<=\.")\s+|(?<=\?")\s+|(?<=\!")|'
+    r'(?<=[.!?])(?=[\u4e00-\u9fff])|'
+    r'(?<=[。！？；…])(?=[a-zA-Z])'
+)
+_MIXED_SUB_SPLIT_RE=re.compile(r'(?<=[.!?])|(?<=[。！？；…])')
+_LATIN_END_RE=re.compile(r'[.!?]')
+_CJK_END_RE=re.compile(r'[。！？；…]')
+_ZH_SPLIT_RE=re.compile(r'([。！？；…]+)')
+_JA_SPLIT_RE=re.compile(r'([。！？]+)')
+_WESTERN_SPLIT_RE=re.compile(r'(?<=[.!?]) +|(?<!Mr)(?<!Mrs)(?<!Dr)(?<!Prof)(?<!Rev)(?<!Hon)\. +')
+_DEFAULT_SPLIT_RE=re.compile(r'(?<=[.!?]) +')
+_END_MARKS='。！？；….!?'
+
+# 超长文本切断：在窗口内找最后一个标点(贪婪匹配到窗口末尾再回退，只扫描一次窗口)
+_LAST_PUNCT_RE=re.compile(r'[\s\S]*[，。！？；,…!?;]')
+
+
+def _replace_emoji(match:re.Match)->str:
+    return emoji.replace_emoji(match.group(),replace='')
+
+
+def detect_language(text:str)->tuple:
+    # 判断语言，返回(language, 是否含拉丁字母)，language为zh/fr/ja/en，中英混合为mixed
+    # 每类字符一个预编译的字符集扫描(C层，遇到第一个即停)，比在Python里逐段分类快
+    has_latin=_LATIN_RE.search(text) is not None
+    if _ZH_RE.search(text) is not None:
+        return ("mixed" if has_latin else "zh"),has_latin
+    if _FR_RE.search(text) is not None:
+        return "fr",has_latin
+    if _JA_RE.search(text) is not None:
+        return "ja",has_latin
+    return "en",has_latin
+
+
+def _pair_with_marks(parts:list)->list:
+    # re.split带分组时，文本和标点交替出现，把标点接回前一句
+    result=[]
+    for i in range(0,len(parts),2):
+        if i+1<len(parts):
+            result.append(parts[i]+parts[i+1])
+        else:
+            result.append(parts[i])
+    return result
+
+
 class TextProcessor:
     def __init__(self):
         self.logger = logger.bind(tag=TAG)
@@ -13,13 +99,10 @@ class TextProcessor:
     def text_clean(text: str) -> str:
         # 用户接口
         # 文本清洗，过滤表情包、网址等
-        text = emoji.replace_emoji(text, replace='')
-        text = re.sub(r'(\*{1,2}|_)(.+?)(\*{1,2}|_)', r'\2', text)
-        text = re.sub(r'!\[.*?]\(.*?\)', '', text)
-        text = re.sub(r'\$\$(.+?)\$\$(?:\$\$.*?\$\$)?', r'\1', text)
-        text = re.sub(r'^#{1,6}\s*', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^[*-]\s+', '', text, flags=re.MULTILINE)
-        text = re.sub(r'https?://\S+', '', text)
+        text=_EMOJI_RE.sub(_replace_emoji,text)
+        for markers,pattern,repl in _CLEAN_RULES:
+            if any(marker in text for marker in markers):
+                text=pattern.sub(repl,text)
         return text
 
     @staticmethod
@@ -29,91 +112,40 @@ class TextProcessor:
         # 注意，暂不支持超长文本切断，如果需要请调用函数self._split_long_text
         if text is None or text == "":
             return []
-        mixed_mode = False
         if language == 'auto':
-            has_chinese = re.search(r'[\u4e00-\u9fff]', text)
-            has_latin = re.search(r'[a-zA-Z]', text)
-            if has_chinese and has_latin:
-                mixed_mode = True
-            elif has_chinese:
-                language = 'zh'
-            elif re.search(r'[À-ÿ]', text):  # 法语字符
-                language = 'fr'
-            elif re.search(r'[ÄÖÜäöüß]', text):  # 德语字符
-                language = 'de'
-            elif re.search(r'[ぁ-ゔァ-ヴー]', text):  # 日语假名
-                language = 'ja'
-            else:
-                language = 'en'
-        if mixed_mode or (language == 'zh' and re.search(r'[a-zA-Z]', text)):
-            pattern = (
-                r'(?<=[。！？；…])|'  # 中文标点
-                r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s+|'  
-                r'(?<=\.")\s+|(?<=\?")\s+|(?<=\!")|' 
-                r'(?<=[.!?])(?=[\u4e00-\u9fff])|'  
-                r'(?<=[。！？；…])(?=[a-zA-Z])'
-            )
-            sentences = re.split(pattern, text)
-            sentences = [s.strip() for s in sentences if s.strip()]
+            language,has_latin=detect_language(text)
+        else:
+            has_latin=language=='zh' and _LATIN_RE.search(text) is not None
+
+        if language == 'mixed' or (language == 'zh' and has_latin):
+            sentences = [s.strip() for s in _MIXED_SPLIT_RE.split(text) if s.strip()]
             result = []
             for sentence in sentences:
-                if re.search(r'[.!?]', sentence) and re.search(r'[。！？；…]', sentence):
-                    sub_pattern = (
-                        r'(?<=[.!?])|'  
-                        r'(?<=[。！？；…])'
-                    )
-                    sub_sentences = re.split(sub_pattern, sentence)
-                    sub_sentences = [s.strip() for s in sub_sentences if s.strip()]
-                    merged_sentences = []
+                if _LATIN_END_RE.search(sentence) and _CJK_END_RE.search(sentence):
+                    sub_sentences = [s.strip() for s in _MIXED_SUB_SPLIT_RE.split(sentence) if s.strip()]
                     i = 0
                     while i < len(sub_sentences):
-                        if i + 1 < len(sub_sentences) and len(sub_sentences[i + 1]) == 1 and sub_sentences[
-                            i + 1] in '。！？；….!?':
-                            merged_sentences.append(sub_sentences[i] + sub_sentences[i + 1])
+                        if i + 1 < len(sub_sentences) and len(sub_sentences[i + 1]) == 1 and sub_sentences[i + 1] in _END_MARKS:
+                            result.append(sub_sentences[i] + sub_sentences[i + 1])
                             i += 2
                         else:
-                            merged_sentences.append(sub_sentences[i])
+                            result.append(sub_sentences[i])
                             i += 1
-
-                    result.extend(merged_sentences)
                 else:
                     result.append(sentence)
-
-            result = [s for s in result if s]
-            return result
+            return [s for s in result if s]
 
         if language == 'zh':
-
-            sentences = re.split(r'([。！？；…]+)', text)
-            sentences = [s.strip() for s in sentences if s.strip()]
-            result = []
-            for i in range(0, len(sentences), 2):
-                if i + 1 < len(sentences):
-                    result.append(sentences[i] + sentences[i + 1])
-                else:
-                    result.append(sentences[i])
-            return result
+            return _pair_with_marks([s.strip() for s in _ZH_SPLIT_RE.split(text) if s.strip()])
 
         elif language == 'ja':
-            sentences = re.split(r'([。！？]+)', text)
-            sentences = [s.strip() for s in sentences if s.strip()]
-            result = []
-            for i in range(0, len(sentences), 2):
-                if i + 1 < len(sentences):
-                    result.append(sentences[i] + sentences[i + 1])
-                else:
-                    result.append(sentences[i])
-            return result
+            return _pair_with_marks([s.strip() for s in _JA_SPLIT_RE.split(text) if s.strip()])
 
         elif language in ('en', 'fr', 'de'):
-            abbreviations = r'(?<!Mr)(?<!Mrs)(?<!Dr)(?<!Prof)(?<!Rev)(?<!Hon)\.'
-            pattern = rf'(?<=[.!?]) +|{abbreviations} +'
-            sentences = re.split(pattern, text)
-            return [s.strip() for s in sentences if s.strip()]
+            return [s.strip() for s in _WESTERN_SPLIT_RE.split(text) if s.strip()]
 
         else:
-            sentences = re.split(r'(?<=[.!?]) +', text)
-            return [s.strip() for s in sentences if s.strip()]
+            return [s.strip() for s in _DEFAULT_SPLIT_RE.split(text) if s.strip()]
 
     def text_merger(self,texts: list=None):
         # 用户接口，合并短文本，避免单个长文本,返回足够长的文本段
@@ -155,18 +187,123 @@ class TextProcessor:
         result=[]
         if text is None or text.strip()=="":
             return []
-        while len(text)>self.max_split_len:
-            search_range=text[:self.max_split_len+1]
-            matches=list(re.finditer(r'[，。！？；,…!?;]',search_range))
-            if matches:
-                split_pos=matches[-1].end()
-            else:
-                split_pos=self.max_split_len
-            result.append(text[:split_pos])
-            text=text[split_pos:]
-        if text:
-            result.append(text)
+        max_len=self.max_split_len
+        start=0
+        end=len(text)
+        while end-start>max_len:
+            match=_LAST_PUNCT_RE.match(text,start,start+max_len+1)
+            split_pos=match.end() if match else start+max_len
+            result.append(text[start:split_pos])
+            start=split_pos
+        if start<end:
+            result.append(text[start:])
 
         return result
 
 
+# ---- 流式分句 ----
+# 句末标点后面必须已经出现下一个字符才算一句结束：中文标点连续出现时(如“！？”)不会被拆开，
+# 英文句点后面跟空白或中文才算句末，3.14、网址里的点不会断句
+_STREAM_END_RE=re.compile(r'[。！？；…\n]+(?=[^。！？；…\n])|[.!?]+(?=\s|[\u4e00-\u9fff])')
+_STREAM_END_CHARS=frozenset('。！？；…\n.!?')
+_ABBREVIATION_RE=re.compile(r'(?:\b(?:Mr|Mrs|Dr|Prof|Rev|Hon)|\w\.\w)\.\Z')
+# 首段快速切分时可以断开的标点(含逗号、顿号等)
+_FAST_START_CUT_RE=re.compile(r'[.?!。？！,，;；:：、\n]')
+
+
+class StreamSegmenter:
+    # 增量分句器：feed()逐段送入LLM的流式输出，返回已经完整、可以直接送TTS的文本段，结束时调用flush()取剩余部分
+    # 每个字符只扫描一次(未确认的句末标点除外)，总耗时与文本长度成正比
+    # 规则：句末标点断句 -> 每句text_clean -> 超过max_split_len的长句按标点切断，每句确认后立即产出；
+    # merge=True时再按max_split_len合并短句(与text_merger一致)，句子要等到合并长度溢出或flush才产出，流式送TTS时不要开启；
+    # 第一段走“快速首段”：缓冲区去空白后达到fast_start_min_chars即在前fast_start_max_chars个字符内的第一个标点处切出，尽快出声
+    def __init__(self,processor:TextProcessor=None,fast_start:bool=True,fast_start_min_chars:int=None,
+                 fast_start_max_chars:int=None,clean:bool=True,merge:bool=False):
+        self.processor=processor or TextProcessor()
+        options=(config.get("text_processor",{}) or {}).get("stream",{}) or {}
+        self.fast_start=fast_start
+        self.fast_start_min_chars=fast_start_min_chars or options.get("fast_start_min_chars",8)
+        self.fast_start_max_chars=fast_start_max_chars or options.get("fast_start_max_chars",20)
+        self.clean=clean
+        self.merge=merge
+        self.max_len=self.processor.max_split_len
+        self._buffer=""     # 尚未断句的文本
+        self._scan=0        # _buffer中已确认不含句末的位置
+        self._pending=""    # 已断句、等待和后续短句合并的文本(仅merge)
+        self._started=False # 是否已经产出过文本段
+
+    def feed(self,chunk:str)->list:
+        # 用户接口，送入一段文本，返回新产生的完整文本段(可能为空列表)
+        if not chunk:
+            return []
+        self._buffer+=chunk
+        out=[]
+        if not self._started and self.fast_start:
+            self._fast_start(out)
+        while True:
+            match=_STREAM_END_RE.search(self._buffer,self._scan)
+            if match is None:
+                break
+            end=match.end()
+            if _ABBREVIATION_RE.search(self._buffer,max(0,end-8),end):
+                self._scan=end
+                continue
+            self._add_sentence(self._buffer[:end],out)
+            self._buffer=self._buffer[end:]
+            self._scan=0
+        # 末尾的句末标点还要等下一个字符确认，下次从它们开始扫描
+        scan=len(self._buffer)
+        while scan>self._scan and self._buffer[scan-1] in _STREAM_END_CHARS:
+            scan-=1
+        self._scan=scan
+        # 迟迟没有句末的长句，按标点切出max_split_len以内的部分
+        if len(self._buffer)>self.max_len:
+            pieces=self.processor._split_long_text(self._buffer)
+            for piece in pieces[:-1]:
+                self._add_sentence(piece,out)
+            rest=pieces[-1] if pieces else ""
+            self._scan=max(0,self._scan-(len(self._buffer)-len(rest)))
+            self._buffer=rest
+        return out
+
+    def flush(self)->list:
+        # 用户接口，文本结束，返回剩余的所有文本段，之后可以继续复用
+        out=[]
+        self._add_sentence(self._buffer,out)
+        self._emit(self._pending,out)
+        self._buffer=""
+        self._scan=0
+        self._pending=""
+        self._started=False
+        return out
+
+    def _fast_start(self,out:list):
+        if len(self._buffer.strip())<self.fast_start_min_chars:
+            return
+        match=_FAST_START_CUT_RE.search(self._buffer,0,self.fast_start_max_chars)
+        cut=match.end() if match else min(len(self._buffer),self.fast_start_max_chars)
+        head=self._buffer[:cut]
+        self._buffer=self._buffer[cut:]
+        self._scan=0
+        self._emit(self.processor.text_clean(head) if self.clean else head,out)
+
+    def _add_sentence(self,sentence:str,out:list):
+        if self.clean:
+            sentence=self.processor.text_clean(sentence)
+        if not sentence.strip():
+            return
+        for piece in self.processor._split_long_text(sentence) if len(sentence)>self.max_len else (sentence,):
+            if not self.merge or not self._started:
+                # 不合并时每句立即产出；首段不等待合并
+                self._emit(piece,out)
+            elif len(self._pending)+len(piece)<=self.max_len:
+                self._pending+=piece
+            else:
+                self._emit(self._pending,out)
+                self._pending=piece
+
+    def _emit(self,text:str,out:list):
+        text=text.strip()
+        if text:
+            out.append(text)
+            self._started=True
@@ -0,0 +1,39 @@
+# text_processor微基准：在server目录下运行 python -m ALT_pure.core.common.text_processor_bench [--number 200]
+# 覆盖中文、英文、中英混合、markdown(含表情和网址)四类语料，分别统计清洗、分句、合并和完整TTS预处理流程的耗时
+import argparse
+import timeit
+from .text_processor import TextProcessor
+
+CORPORA={
+    "zh": "今天天气很好，我们一起去公园散步吧！你觉得怎么样？我觉得非常不错。晚上回来再写日记……",
+    "en": "Hello world. Mr. Smith went to Washington yesterday! Is it really ok? Yes, it is fine. ",
+    "mixed": "我今天学习了Python编程。It is really great! 真的很棒吗？Yes, of course. 明天继续学习FastAPI。",
+    "markdown": "## 今日总结\n- **学习**：完成了 *Python* 练习 😀\n- 阅读 ![图](http://a.com/x.png) 参考 https://example.com/a_b\n$$x^2$$ 结束👍🏽\n",
+}
+
+
+def bench(func,number:int,repeat:int=5)->float:
+    # 返回单次调用的最短耗时(微秒)
+    return min(timeit.repeat(func,number=number,repeat=repeat))/number*1e6
+
+
+def run(number:int=200,scale:int=20):
+    processor=TextProcessor()
+    print(f"{'corpus':10s}{'chars':>8s}{'clean':>12s}{'cut':>12s}{'merge':>12s}{'pipeline':>12s}   (us/op)")
+    for name,sample in CORPORA.items():
+        text=sample*scale
+        cleaned=processor.text_clean(text)
+        sentences=processor.text_cutter_by_language(cleaned)
+        clean_us=bench(lambda: processor.text_clean(text),number)
+        cut_us=bench(lambda: processor.text_cutter_by_language(cleaned),number)
+        merge_us=bench(lambda: processor.text_merger(sentences),number)
+        pipeline_us=bench(lambda: processor.text_merger(processor.text_cutter_by_language(processor.text_clean(text))),number)
+        print(f"{name:10s}{len(text):8d}{clean_us:12.1f}{cut_us:12.1f}{merge_us:12.1f}{pipeline_us:12.1f}")
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="text_processor微基准")
+    parser.add_argument("--number",type=int,default=200,help="每轮调用次数")
+    parser.add_argument("--scale",type=int,default=20,help="每类语料重复的倍数")
+    args=parser.parse_args()
+    run(args.number,args.scale)
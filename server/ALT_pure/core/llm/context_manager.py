@@ -1,29 +1,112 @@
 from ALT_pure.log.load_log import logger
 from ALT_pure.config.load_config import config
-from dashscope import Generation
-from concurrent.futures import ThreadPoolExecutor
+from .http_client import get_client
+from ..common.rate_limiter import get_guard, RetriableError, retry_after_seconds
+from httpx import AsyncClient, TransportError
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from collections import OrderedDict, deque
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import threading
 import time
 
 
 TAG=__name__
+# 没有事件循环可用时(脚本中同步调用)，摘要任务在这个线程池里单独运行
+_summary_executor=ThreadPoolExecutor(max_workers=2,thread_name_prefix="summary_worker")
+# 上下文日志的后台压缩
+_io_executor=ThreadPoolExecutor(max_workers=1,thread_name_prefix="context_io")
+
+# 项目根目录，与diary_api一致
+BASE_DIR=Path(__file__).resolve().parent.parent.parent.parent.parent
+
+DEFAULT_ROLE="我是一个充满活力的AI数字人伙伴,🌐 服务准则「专业不过度，亲切不越界」——用18岁的心境，做100分的服务不话唠，不话唠，不话唠"
+ROLE_ACK={'role': 'assistant', 'content': '我已了解我的身份，可以开始对话！'}
+# 每条消息的格式开销(role、分隔符等)
+MESSAGE_OVERHEAD=4
+QWEN_API_URL=r'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+# 这些HTTP状态码视为可重试：限流和上游繁忙
+RETRIABLE_STATUS={429,500,502,503,504}
+
+def estimate_tokens(text:str)->int:
+    # 近似分词：中日韩等UTF-8下占3字节以上的字符按每字1个token，其余按每4个字符1个token，只用于预算，不追求精确
+    if not text:
+        return 0
+    wide=(len(text.encode("utf-8"))-len(text))//2
+    return wide+(len(text)-wide+3)//4
+
+
+def truncate_tokens(text:str,max_tokens:int,keep_tail:bool=False)->str:
+    # 按estimate_tokens把文本截断到max_tokens以内，keep_tail为True时保留末尾；估算值随长度单调，二分查找
+    if estimate_tokens(text)<=max_tokens:
+        return text
+    if max_tokens<=0:
+        return ""
+    low,high=0,len(text)
+    while low<high:
+        mid=(low+high+1)//2
+        part=text[len(text)-mid:] if keep_tail else text[:mid]
+        if estimate_tokens(part)<=max_tokens:
+            low=mid
+        else:
+            high=mid-1
+    return text[len(text)-low:] if keep_tail else text[:low]
+
+
+def message_tokens(message:dict)->int:
+    return estimate_tokens(message.get("content") or "")+MESSAGE_OVERHEAD
+
+
 class ContextManager:
-    def __init__(self, user_id="default"):
+    # 对话上下文：角色设定 + 滚动摘要 + 最近history_length轮对话的环形缓冲
+    # 移出环形缓冲的消息进入待摘要队列，由后台线程并入滚动摘要；每次请求的提示词都不超过max_prompt_tokens
+    def __init__(self, user_id="default", conversation_id="default", persist=True):
         self.logger = logger.bind(tag=TAG)
         self.user_id = user_id
-        self.context = None
-        self.history = None
+        self.conversation_id = conversation_id
+        options=config.get("context_manager",{}) or {}
 
+        self.role=None
         self.summary=None
+        self.turns=deque()        # 最近的对话消息
+        self.pending=[]           # 已移出turns、尚未并入摘要的消息
+        self.pending_tokens=0
+        self.history = None
         self.request_cnt = 0
-        self.summary_api_key = None
-        self.summary_freq = config.get("context_manager",{"summary_freq":5}).get("summary_freq",5)
-
-        self.history_length=config.get("context_manager",{"history_length":3}).get("history_length",3)
-        self.role=None
-        self.summary_api_key = None
         self.time= None
 
-        self.executor=ThreadPoolExecutor(max_workers=1,thread_name_prefix="summary_worker")
+        self.summary_freq = options.get("summary_freq",5)
+        self.history_length=options.get("history_length",3)
+        # 单次请求提示词的token上限（近似值），包含角色设定、摘要、历史和本次问题
+        self.max_prompt_tokens=int(options.get("max_prompt_tokens",3000))
+        # 滚动摘要的token上限
+        self.summary_max_tokens=int(options.get("summary_max_tokens",500))
+        # 单次摘要请求最多并入的历史token数，超出部分留给下一次
+        self.summary_batch_tokens=int(options.get("summary_batch_tokens",2000))
+
+        self._lock=threading.Lock()
+        self._summarizing=False
+        self._summary_dirty=False
+
+        # 每个会话一个追加写的JSONL日志，记录消息、角色和摘要事件；超过compact_every行后在后台压缩成一条快照
+        # persist为False(如未登录用户的会话)时只保存在内存中
+        self.log_path=None
+        if persist and options.get("persist",True):
+            persist_dir=Path(options.get("persist_dir",BASE_DIR/"data"/"contexts"))
+            key=hashlib.sha256(f"{user_id}\0{conversation_id}".encode("utf-8")).hexdigest()[:32]
+            self.log_path=persist_dir/f"{key}.jsonl"
+        self.compact_every=int(options.get("compact_every",200))
+        self._log_lines=0
+        self._compacting=False
+        # 压缩期间追加的事件，替换日志文件前补写到新文件末尾；不在压缩时为None
+        self._compact_buffer=None
+        self._compact_lock=threading.Lock()
+        # 通过context_store.hold持有的次数，持有中的上下文不会被淘汰
+        self._holds=0
 
     def __enter__(self):
         return self
@@ -31,115 +114,511 @@ class ContextManager:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._close()
 
+    def in_use(self)->bool:
+        # 被持有、摘要或日志压缩进行中时为True，此时从ContextStore淘汰会导致同一会话出现两个实例写同一个日志
+        with self._lock:
+            return self._holds>0 or self._summarizing or self._compacting
+
+    @property
+    def context(self):
+        # 兼容旧接口：角色设定 + 环形缓冲中的最近对话
+        if self.role is None:
+            self.role=self._load_role()
+        return [{"role": "system", "content": self.role},dict(ROLE_ACK)]+list(self.turns)
+
     def set_role(self,role:str=None):
         # 用户接口，动态更改角色设定,注意：角色设定会覆盖之前的设定
-        if self.context is None:
-            self.context = self._load_role()
-        elif role is not None:
-            self.role = role
-            self.context[0]["content"] = self.role
+        if role is not None:
+            if role!=self.role:
+                self._record({"t": "role","content": role})
         else:
+            if self.role is None:
+                self.role=self._load_role()
             logger.warning("运行时角色设定出错")
+
     def add_question(self,question):
-        # 用户接口，添加user问题,返回history
-        if self.context is None:
-            self.context = self._load_role()
-        self.context.append({"role": "user", "content": question})
+        # 用户接口，添加user问题,返回本次请求应发送的history
+        self._record({"t": "msg","role": "user","content": question})
         return self._get_history()
 
     def add_answer(self,answer):
-        # 用户接口，添加答案,返回history
-        if self.context is None:
-            self.context = self._load_role()
-        self.context.append({"role": "assistant", "content": answer})
-        self.request_cnt+=1
+        # 用户接口，添加答案
+        self._record({"t": "msg","role": "assistant","content": answer})
         self._generate_summary_async()
 
+    def _record(self,event:dict):
+        # 应用一个事件并追加到日志
+        with self._lock:
+            self._apply(event)
+            self._append_log(event)
+
+    def _apply(self,event:dict):
+        # 事件是上下文状态变化的唯一入口，实时调用和从日志重放走同一套逻辑
+        kind=event.get("t")
+        if kind=="msg":
+            self.turns.append({"role": event["role"],"content": event["content"]})
+            if event["role"]=="assistant":
+                self.request_cnt+=1
+            self._rotate()
+        elif kind=="role":
+            self.role=event["content"]
+        elif kind=="summary":
+            self.summary=event["content"]
+            self._drop_pending(int(event.get("consumed",0)))
+        elif kind=="snapshot":
+            self.role=event.get("role")
+            self.summary=event.get("summary")
+            self.turns=deque(event.get("turns") or [])
+            self.pending=list(event.get("pending") or [])
+            self.pending_tokens=sum(message_tokens(m) for m in self.pending)
+            self.request_cnt=int(event.get("request_cnt",0))
+
+    def _rotate(self):
+        # 环形缓冲只保留最近history_length轮，超出的移入待摘要队列
+        limit=max(int(self.history_length),1)*2
+        while len(self.turns)>limit:
+            message=self.turns.popleft()
+            self.pending.append(message)
+            self.pending_tokens+=message_tokens(message)
+        # 摘要长期失败时待摘要队列也不会无限增长，丢弃最早的
+        while self.pending and self.pending_tokens>self.summary_batch_tokens*2:
+            self._drop_pending(1)
+
+    def _drop_pending(self,count:int):
+        count=min(count,len(self.pending))
+        for message in self.pending[:count]:
+            self.pending_tokens-=message_tokens(message)
+        del self.pending[:count]
+
     def _get_time(self):
         self.time=str(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
 
     def _get_history(self):
-        if self.context is None:
-            self.context = self._load_role()
+        # 每次按预算重新组装，不修改保存的角色设定
+        if self.role is None:
+            self.role=self._load_role()
+        self._get_time()
+        suffix=f"，当前时间是{str(self.time)}，这个时间会实时更新，后续回答问及今天时间请用这个时间。"
+        budget=self.max_prompt_tokens
 
-        if len(self.context)<self.history_length*2+1:
-            self.history=self.context
-        else:
-            if self.history is None:
-                self.history = self.context[:1]
+        # 角色设定过长时截断，至少给其余内容留一半预算
+        role=truncate_tokens(self.role,budget//2-estimate_tokens(suffix)-MESSAGE_OVERHEAD)
+        head=[{"role": "system", "content": role+suffix},dict(ROLE_ACK)]
+        budget-=sum(message_tokens(m) for m in head)
+
+        with self._lock:
+            turns=list(self.turns)
+            summary=self.summary
+
+        # 本次问题一定保留，过长时保留末尾
+        question=turns.pop() if turns and turns[-1]["role"]=="user" else None
+        if question is not None:
+            limit=budget-MESSAGE_OVERHEAD
+            if estimate_tokens(question["content"])>limit:
+                question={"role": "user","content": truncate_tokens(question["content"],limit,keep_tail=True)}
+            budget-=message_tokens(question)
+
+        summary_message=None
+        if summary:
+            summary_message={"role": "system", "content": f"此前的对话摘要: {summary}"}
+            if message_tokens(summary_message)>budget:
+                summary_message=None
             else:
-                self.history=self.context[:1]
-            if self.summary is not None:
-                self.history.append({"role": "system", "content": f"此前的对话摘要: {self.summary}"})
+                budget-=message_tokens(summary_message)
 
-            self.history.extend((self.context[-self.history_length*2:]))
+        # 从最近往前放入历史，直到预算用完
+        recent=[]
+        for message in reversed(turns):
+            cost=message_tokens(message)
+            if cost>budget:
+                break
+            recent.append(message)
+            budget-=cost
+        recent.reverse()
 
-        self._get_time()
-        self.history[0]["content"]=self.history[0]["content"]+f"，当前时间是{str(self.time)}，这个时间会实时更新，后续回答问及今天时间请用这个时间。"
+        self.history=head+([summary_message] if summary_message else [])+recent+([question] if question else [])
         return self.history
 
     def _generate_summary_async(self):
+        # 满足条件时交给summary_scheduler；同一会话同时只有一个摘要任务，任务进行中的新请求合并进该任务
+        with self._lock:
+            if not self.pending:
+                return
+            if self.request_cnt % self.summary_freq != 0 and self.pending_tokens<self.summary_batch_tokens:
+                return
+            if self._summarizing:
+                self._summary_dirty=True
+                return
+            self._summarizing=True
         try:
-            if self.summary_api_key is None:
-                self.summary_api_key = config.get('llm', {'qwen': {"api_key": None}}).get('qwen',{'api_key': None}).get('api_key', None)
-            if len(self.context) >= self.summary_freq * 2 + 1 and self.request_cnt % self.summary_freq == 0:
-                self.executor.submit(self._generate_summary)
+            summary_scheduler.schedule(self)
         except Exception as e:
+            with self._lock:
+                self._summarizing=False
             self.logger.warning(f"启动后台摘要生成失败: {e}")
 
+    def _take_batch(self):
+        # 从待摘要队列头部取出不超过summary_batch_tokens的一批
+        batch=[]
+        total=0
+        for message in self.pending:
+            cost=message_tokens(message)
+            if batch and total+cost>self.summary_batch_tokens:
+                break
+            batch.append(message)
+            total+=cost
+        return batch
 
-    def _generate_summary(self):
+    def _summary_messages(self,previous,batch):
+        lines="\n".join(f"{m['role']}: {truncate_tokens(m['content'] or '',self.summary_batch_tokens)}" for m in batch)
+        prompt=f"已有摘要：{previous}\n\n新增对话：\n{lines}" if previous else f"对话：\n{lines}"
+        return [
+            {"role": "system","content": f"你的职责是把已有摘要和新增对话合并成一段新的摘要短文，保留关键事实和用户偏好，不超过{self.summary_max_tokens}字。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def _summarize(self,client:AsyncClient=None):
+        # 滚动摘要：旧摘要 + 上次摘要之后移出的一批对话 -> 新摘要，在锁内原子替换
+        # 请求期间又有摘要请求或积压超过一批时继续下一轮，失败则等下一次add_answer再触发
         try:
-            start_idx = 1
-            end_idx = len(self.context) - self.history_length * 2
-            if end_idx > start_idx:
-                summary_context = self.context[start_idx:end_idx]
-                summary_messages = [
-                    {"role": "system","content": "你的职责是根据与用户的对话历史生成一段短文，用于总结对话历史。"},
-                    {"role": "user", "content": f"请总结以下对话历史：{str(summary_context)}"}
-                ]
-                try:
-                    response = Generation.call(
-                        api_key=self.summary_api_key,
-                        model="qwen-turbo",
-                        messages=summary_messages,
-                        result_format="message",
-                        temperature=0.6,
-                        top_p=0.9,
-                        max_tokens=500
-                    )
-                    if response and response.output and response.output.choices:
-                        result = response.output.choices[0].message.content
-                        self.summary = result
-                    else:
-                        self.logger.warning(f"生成摘要失败: {response}")
-                except Exception as e:
-                    self.logger.warning(f"生成摘要失败: {e}")
-                    self.summary = None
+            while True:
+                with self._lock:
+                    self._summary_dirty=False
+                    batch=self._take_batch()
+                    previous=self.summary
+                if not batch:
+                    return
+                result=await request_summary(self._summary_messages(previous,batch),self.summary_max_tokens,client)
+                if not result:
+                    return
+                with self._lock:
+                    # 只移除已并入摘要的消息，期间可能已有消息因队列过长被丢弃
+                    consumed=0
+                    for message in batch:
+                        if consumed<len(self.pending) and self.pending[consumed] is message:
+                            consumed+=1
+                    event={"t": "summary","content": truncate_tokens(result,self.summary_max_tokens),"consumed": consumed}
+                    self._apply(event)
+                    self._append_log(event)
+                    if not self.pending or not (self._summary_dirty or self.pending_tokens>=self.summary_batch_tokens):
+                        return
         except Exception as e:
             self.logger.warning(f"生成摘要失败: {e}")
-            self.summary = None
-
+        finally:
+            with self._lock:
+                self._summarizing=False
 
     def _load_role(self):
         # 初始化角色设定
-        self.role = config.get("context_manager",{"role":"我是一个充满活力的AI数字人伙伴,🌐 服务准则「专业不过度，亲切不越界」——用18岁的心境，做100分的服务不话唠，不话唠，不话唠"}).get("role","我是一个充满活力的AI数字人伙伴,🌐 服务准则「专业不过度，亲切不越界」——用18岁的心境，做100分的服务不话唠，不话唠，不话唠")
-        context = [{"role": "system", "content": self.role},
-                   {'role': 'assistant', 'content': '我已了解我的身份，可以开始对话！'}]
-        return context
+        return config.get("context_manager",{"role":DEFAULT_ROLE}).get("role",DEFAULT_ROLE)
+
+    def _append_log(self,event:dict):
+        # 调用方持有self._lock
+        if self.log_path is None:
+            return
+        try:
+            if self._log_lines==0:
+                self.log_path.parent.mkdir(parents=True,exist_ok=True)
+            with open(self.log_path,"a",encoding="utf-8") as f:
+                f.write(json.dumps(event,ensure_ascii=False)+"\n")
+            self._log_lines+=1
+            if self._compact_buffer is not None:
+                self._compact_buffer.append(event)
+        except Exception as e:
+            self.logger.warning(f"写入上下文日志失败: {e}")
+            return
+        if self._log_lines>=self.compact_every and not self._compacting:
+            self._compacting=True
+            _io_executor.submit(self._save_context)
 
     def _save_context(self):
-        # 存储上下文到磁盘
-        logger.error("存储失败！这里的世界以后再来探索吧")
-        pass
+        # 把当前状态压缩成一条快照，原子替换日志文件
+        # 锁内只复制状态，序列化和写文件在锁外进行；期间追加的事件记入_compact_buffer，替换前在锁内补写到新文件末尾
+        if self.log_path is None:
+            return
+        with self._compact_lock:
+            try:
+                with self._lock:
+                    snapshot={"t": "snapshot","role": self.role,"summary": self.summary,
+                              "turns": list(self.turns),"pending": list(self.pending),"request_cnt": self.request_cnt}
+                    self._compact_buffer=[]
+                self.log_path.parent.mkdir(parents=True,exist_ok=True)
+                tmp_path=self.log_path.with_suffix(".jsonl.tmp")
+                with open(tmp_path,"w",encoding="utf-8") as f:
+                    f.write(json.dumps(snapshot,ensure_ascii=False)+"\n")
+                with self._lock:
+                    if self._compact_buffer:
+                        with open(tmp_path,"a",encoding="utf-8") as f:
+                            f.writelines(json.dumps(event,ensure_ascii=False)+"\n" for event in self._compact_buffer)
+                    os.replace(tmp_path,self.log_path)
+                    self._log_lines=1+len(self._compact_buffer)
+            except Exception as e:
+                self.logger.warning(f"压缩上下文日志失败: {e}")
+            finally:
+                with self._lock:
+                    self._compact_buffer=None
+                    self._compacting=False
 
     def _load_context(self):
-        # 从磁盘中加载上下文
-        logger.error("加载失败！这里的世界以后再来探索吧")
-        pass
+        # 从日志重放恢复上下文，末尾写了一半的行会被跳过
+        if self.log_path is None or not self.log_path.exists():
+            return
+        start=time.perf_counter()
+        lines=0
+        try:
+            with self._lock:
+                with open(self.log_path,"r",encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            event=json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        self._apply(event)
+                        lines+=1
+                self._log_lines=max(lines,1)
+        except Exception as e:
+            self.logger.warning(f"加载上下文日志失败: {e}")
+            return
+        self.logger.debug(f"加载上下文{self.user_id}/{self.conversation_id}: {lines}条记录，耗时{(time.perf_counter()-start)*1000:.1f}ms")
 
     def _close(self):
-        self._save_context()
         self._save_context()
         self.logger.info("成功关闭上下文管理器")
 
+
+async def request_summary(messages:list,max_tokens:int,client:AsyncClient=None)->str:
+    # 按choose.llm选择qwen或ollama生成摘要，经过共享的限流/重试/熔断，失败返回""
+    platform=config.get("choose",{"llm": None}).get("llm",None)
+    llm_config=(config.get("llm",{}) or {}).get(platform,{}) or {}
+    summary_model=(config.get("context_manager",{}) or {}).get("summary_model")
+    try:
+        if platform=="qwen":
+            api_key=llm_config.get("api_key")
+            if not api_key:
+                return ""
+            payload={
+                "model": summary_model or "qwen-turbo",
+                "input": {"messages": messages},
+                "parameters": {"result_format": "message","temperature": 0.6,"top_p": 0.9,"max_tokens": max_tokens}
+            }
+            return await get_guard("qwen",api_key).call(_qwen_summary_once,client or get_client("qwen"),api_key,payload)
+        if platform=="ollama":
+            base_url=llm_config.get("base_url","http://localhost:11434")
+            base_url=base_url if base_url.startswith(("http://","https://")) else f"http://{base_url}"
+            payload={
+                "model": summary_model or llm_config.get("model"),
+                "messages": messages,
+                "stream": False,
+                "options": {"temperature": 0.6,"top_p": 0.9,"num_predict": max_tokens}
+            }
+            return await get_guard("ollama",base_url).call(_ollama_summary_once,client or get_client("ollama"),f"{base_url}/api/chat",payload)
+    except Exception as e:
+        logger.bind(tag=TAG).warning(f"生成摘要失败: {e}")
+    return ""
+
+
+async def _qwen_summary_once(client:AsyncClient,api_key:str,payload:dict)->str:
+    try:
+        response=await client.post(QWEN_API_URL,headers={"Content-Type": "application/json","Authorization": f"Bearer {api_key}"},json=payload)
+    except TransportError as e:
+        raise RetriableError(f"网络错误: {e}")
+    if response.status_code in RETRIABLE_STATUS:
+        raise RetriableError(f"HTTP {response.status_code}",retry_after_seconds(response.headers.get("Retry-After")))
+    response.raise_for_status()
+    choices=(response.json().get("output") or {}).get("choices") or []
+    if not choices:
+        return ""
+    return (choices[0].get("message") or {}).get("content") or ""
+
+
+async def _ollama_summary_once(client:AsyncClient,url:str,payload:dict)->str:
+    try:
+        response=await client.post(url,json=payload)
+    except TransportError as e:
+        raise RetriableError(f"网络错误: {e}")
+    if response.status_code in RETRIABLE_STATUS or response.status_code>=500:
+        raise RetriableError(f"HTTP {response.status_code}",retry_after_seconds(response.headers.get("Retry-After")))
+    response.raise_for_status()
+    return (response.json().get("message") or {}).get("content") or ""
+
+
+class SummaryScheduler:
+    # 把摘要任务投递到服务的事件循环里运行，复用共享的异步HTTP客户端，不占用工作线程
+    # 工作线程(如chat_stream)中触发时通过call_soon_threadsafe投递；没有事件循环时在线程池中用临时客户端运行
+    def __init__(self):
+        self._loop=None
+        self._tasks=set()  # 持有任务引用，避免被回收
+
+    def bind(self,loop:asyncio.AbstractEventLoop):
+        self._loop=loop
+
+    def schedule(self,manager:ContextManager):
+        try:
+            running=asyncio.get_running_loop()
+        except RuntimeError:
+            running=None
+        target=self._loop if self._loop is not None and self._loop.is_running() else running
+        if target is None:
+            _summary_executor.submit(asyncio.run,self._run_standalone(manager))
+        elif target is running:
+            self._spawn(manager)
+        else:
+            target.call_soon_threadsafe(self._spawn,manager)
+
+    def _spawn(self,manager:ContextManager):
+        task=asyncio.get_running_loop().create_task(manager._summarize())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run_standalone(manager:ContextManager):
+        async with AsyncClient(timeout=30.0) as client:
+            await manager._summarize(client)
+
+
+summary_scheduler=SummaryScheduler()
+
+
+async def startup():
+    # 应用启动时调用，让工作线程里触发的摘要任务投递到服务的事件循环
+    summary_scheduler.bind(asyncio.get_running_loop())
+
+
+class ContextStore:
+    # 按(user_id, conversation_id)保存对话上下文，超出max_contexts时淘汰最久未使用的，空闲超过idle_ttl秒的也会被淘汰
+    # 正在使用的上下文(hold持有中、摘要或日志压缩进行中)不会被淘汰，保证同一会话在进程内只有一个实例
+    def __init__(self):
+        self.logger = logger.bind(tag=TAG)
+        options=config.get("context_manager",{}) or {}
+        self.max_contexts=int(options.get("max_contexts",1000))
+        self.idle_ttl=float(options.get("idle_ttl",3600))
+        self._contexts=OrderedDict()  # key -> (ContextManager, 最近使用时间)
+        self._lock=threading.Lock()
+        self._loading={}  # key -> Future，正在从磁盘加载的会话，加载结束(成功或失败)时完成
+
+    def get(self,user_id="default",conversation_id="default",persist=True)->ContextManager:
+        # 用户接口，获取(不存在则创建)某个用户某个会话的上下文，persist只在创建时生效
+        # 返回后不保证不被淘汰，跨await或在生成器中使用请用hold
+        return self._get(user_id,conversation_id,persist,hold=False)
+
+    @contextmanager
+    def hold(self,user_id="default",conversation_id="default",persist=True):
+        # 用户接口，with context_store.hold(...) as manager: 在with块内持有上下文，期间不会被淘汰
+        # 首次访问会在当前线程读上下文日志，协程中请用hold_async
+        manager=self._get(user_id,conversation_id,persist,hold=True)
+        try:
+            yield manager
+        finally:
+            self._release(user_id,conversation_id,manager)
+
+    @asynccontextmanager
+    async def hold_async(self,user_id="default",conversation_id="default",persist=True):
+        # 用户接口，async with context_store.hold_async(...) as manager: 同hold，首次访问时在线程中加载，不阻塞事件循环
+        key=(str(user_id),str(conversation_id))
+        while True:
+            with self._lock:
+                manager=self._lookup(key,hold=True)
+                loading=self._loading.get(key)
+            if manager is not None:
+                break
+            if loading is not None:
+                # 同一会话正在加载，在事件循环上等待，不占用线程池
+                await asyncio.shield(asyncio.wrap_future(loading))
+            else:
+                # 线程中只加载不持有，等待被取消时不会留下持有计数；加载后到持有前被淘汰则重新加载
+                await asyncio.to_thread(self.get,user_id,conversation_id,persist)
+        try:
+            yield manager
+        finally:
+            self._release(user_id,conversation_id,manager)
+
+    def _release(self,user_id,conversation_id,manager:ContextManager):
+        with manager._lock:
+            manager._holds-=1
+        key=(str(user_id),str(conversation_id))
+        with self._lock:
+            entry=self._contexts.get(key)
+            if entry is not None and entry[0] is manager:
+                # 空闲时间从释放时算起
+                self._contexts[key]=(manager,time.monotonic())
+                self._contexts.move_to_end(key)
+
+    def _lookup(self,key,hold:bool):
+        # 调用方持有self._lock；已在内存中时标记为最近使用并返回，否则返回None
+        entry=self._contexts.pop(key,None)
+        if entry is None:
+            return None
+        manager=entry[0]
+        if hold:
+            with manager._lock:
+                manager._holds+=1
+        now=time.monotonic()
+        self._contexts[key]=(manager,now)
+        self._evict(now,keep=key)
+        return manager
+
+    def _get(self,user_id,conversation_id,persist,hold:bool)->ContextManager:
+        key=(str(user_id),str(conversation_id))
+        while True:
+            with self._lock:
+                manager=self._lookup(key,hold)
+                if manager is not None:
+                    return manager
+                loading=self._loading.get(key)
+                owner=loading is None
+                if owner:
+                    loading=self._loading[key]=Future()
+            if not owner:
+                # 同一会话正由其它线程加载，等它放入后再取
+                loading.result()
+                continue
+            try:
+                # 首次访问时才从磁盘加载，读日志不占用全局锁，其它会话的访问不受影响
+                manager=ContextManager(user_id=key[0],conversation_id=key[1],persist=persist)
+                manager._load_context()
+                with self._lock:
+                    if hold:
+                        with manager._lock:
+                            manager._holds+=1
+                    now=time.monotonic()
+                    self._contexts[key]=(manager,now)
+                    self._evict(now,keep=key)
+                return manager
+            finally:
+                with self._lock:
+                    del self._loading[key]
+                loading.set_result(None)
+
+    def drop(self,user_id="default",conversation_id="default"):
+        # 用户接口，从内存中丢弃某个会话的上下文，磁盘上的日志保留；正在使用的上下文不会丢弃
+        key=(str(user_id),str(conversation_id))
+        with self._lock:
+            entry=self._contexts.get(key)
+            if entry is None:
+                return
+            if entry[0].in_use():
+                self.logger.warning(f"上下文{key}正在使用，未丢弃")
+                return
+            del self._contexts[key]
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def _evict(self,now:float,keep=None):
+        # 调用方持有self._lock；OrderedDict按最近使用排序，从最旧的开始淘汰空闲超时的和超出max_contexts的部分，跳过正在使用的
+        expired=[]
+        excess=len(self._contexts)-self.max_contexts
+        for key,(manager,last_used) in self._contexts.items():
+            idle=now-last_used>=self.idle_ttl
+            if not idle and len(expired)>=excess:
+                break
+            if key!=keep and not manager.in_use():
+                expired.append(key)
+        for key in expired:
+            del self._contexts[key]
+        if excess>0:
+            self.logger.info(f"上下文过多，淘汰{len(expired)}个")
+
+
+# 进程内共享的上下文存储
+context_store=ContextStore()
@@ -0,0 +1,141 @@
+# 上下文提示词大小基准：在server目录下运行 python -m ALT_pure.core.llm.context_manager_bench [--turns 1000] [--every 100]
+# 模拟一段长对话，每every轮打印一次本轮发送给模型的提示词token数(estimate_tokens估算)
+# legacy为原来的ContextManager(整段context保留max_context_len条，时间后缀每轮追加到保存的角色设定上)；current为当前实现(环形缓冲+滚动摘要+max_prompt_tokens预算)
+# 两者的摘要都用本地桩代替模型：取摘要请求内容的末尾summary_max_tokens个token，不请求上游
+# --reload：写出一段--turns轮(默认500)对话的上下文日志，测量新实例从日志恢复(_load_context)的耗时，目标<10ms；分别测压缩后(compact_every默认值)和从不压缩的日志
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from . import context_manager
+from .context_manager import ContextManager, ROLE_ACK, message_tokens, truncate_tokens
+
+SUMMARY_MAX_TOKENS=500
+
+
+def question(turn:int)->str:
+    return f"第{turn}轮：今天写日记的时候想到一件事，能帮我分析一下为什么最近总是睡不好吗？"
+
+
+def answer(turn:int)->str:
+    return f"第{turn}轮回答：睡眠不好可能和作息、压力、饮食有关。"+"建议睡前一小时放下手机，保持固定的起床时间，白天适量运动。"*3
+
+
+class LegacyContext:
+    # 原来的ContextManager中与提示词有关的部分
+    def __init__(self,role:str,summary_freq:int=5,history_length:int=3,max_context_len:int=100):
+        self.context=[{"role": "system","content": role},dict(ROLE_ACK)]
+        self.summary=None
+        self.history=None
+        self.request_cnt=0
+        self.summary_freq=summary_freq
+        self.history_length=history_length
+        self.max_context_len=max_context_len
+
+    def add_question(self,text:str)->list:
+        self.context.append({"role": "user","content": text})
+        if len(self.context)<self.history_length*2+1:
+            self.history=self.context
+        else:
+            self.history=self.context[:1]
+            if self.summary is not None:
+                self.history.append({"role": "system","content": f"此前的对话摘要: {self.summary}"})
+            self.history.extend(self.context[-self.history_length*2:])
+        # 原实现直接修改共享的角色设定字典，时间后缀逐轮累积
+        self.history[0]["content"]=self.history[0]["content"]+f"，当前时间是{time.strftime('%Y-%m-%d %H:%M:%S')}，这个时间会实时更新，后续回答问及今天时间请用这个时间。"
+        return self.history
+
+    def add_answer(self,text:str):
+        self.context.append({"role": "assistant","content": text})
+        self.request_cnt+=1
+        overflow=len(self.context)-2-self.max_context_len
+        if overflow>0:
+            del self.context[2:2+overflow]
+        if len(self.context)>=self.summary_freq*2+1 and self.request_cnt%self.summary_freq==0:
+            end=len(self.context)-self.history_length*2
+            self.summary=truncate_tokens(str(self.context[1:end]),SUMMARY_MAX_TOKENS,keep_tail=True)
+
+
+def current_context()->ContextManager:
+    # 摘要改为同步调用本地桩，便于逐轮观察
+    async def request_summary(messages,max_tokens,client=None):
+        return truncate_tokens(messages[-1]["content"],max_tokens,keep_tail=True)
+
+    def schedule(manager):
+        asyncio.run(manager._summarize())
+
+    context_manager.request_summary=request_summary
+    context_manager.summary_scheduler.schedule=schedule
+    manager=ContextManager(user_id="bench",conversation_id="bench",persist=False)
+    manager.summary_max_tokens=SUMMARY_MAX_TOKENS
+    return manager
+
+
+def prompt_tokens(messages:list)->int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def run(turns:int,every:int):
+    current=current_context()
+    legacy=LegacyContext(current._load_role())
+    print(f"max_prompt_tokens={current.max_prompt_tokens} history_length={current.history_length} summary_freq={current.summary_freq}")
+    print(f"{'turns':>6s}{'legacy':>10s}{'current':>10s}{'current max':>14s}   (estimated prompt tokens)")
+    peak=0
+    for turn in range(1,turns+1):
+        legacy_tokens=prompt_tokens(legacy.add_question(question(turn)))
+        legacy.add_answer(answer(turn))
+        current_tokens=prompt_tokens(current.add_question(question(turn)))
+        current.add_answer(answer(turn))
+        peak=max(peak,current_tokens)
+        if turn%every==0:
+            print(f"{turn:6d}{legacy_tokens:10d}{current_tokens:10d}{peak:14d}")
+
+
+def write_log(path:Path,turns:int,compact_every:int)->ContextManager:
+    manager=current_context()
+    manager.log_path=path
+    manager.compact_every=compact_every
+    for turn in range(1,turns+1):
+        manager.add_question(question(turn))
+        manager.add_answer(answer(turn))
+    # 等待后台压缩结束
+    while manager.in_use():
+        time.sleep(0.01)
+    return manager
+
+
+def run_reload(turns:int,repeat:int,target_ms:float=10.0):
+    print(f"{'log':14s}{'lines':>8s}{'KB':>8s}{'median ms':>12s}{'max ms':>10s}   (reload {turns} turns, {repeat} runs, target <{target_ms:g}ms)")
+    with tempfile.TemporaryDirectory() as directory:
+        for label,compact_every in (("compacted",ContextManager(persist=False).compact_every),("uncompacted",10**9)):
+            path=Path(directory)/f"{label}.jsonl"
+            written=write_log(path,turns,compact_every)
+            with open(path,encoding="utf-8") as f:
+                lines=sum(1 for _ in f)
+            timings=[]
+            for _ in range(repeat):
+                manager=ContextManager(user_id="bench",conversation_id="bench",persist=False)
+                manager.log_path=path
+                start=time.perf_counter()
+                manager._load_context()
+                timings.append((time.perf_counter()-start)*1000)
+                assert list(manager.turns)==list(written.turns) and manager.summary==written.summary
+            median=statistics.median(timings)
+            verdict="ok" if median<target_ms else "SLOW"
+            print(f"{label:14s}{lines:8d}{os.path.getsize(path)/1024:8.0f}{median:12.2f}{max(timings):10.2f}   {verdict}")
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="上下文提示词大小基准")
+    parser.add_argument("--turns",type=int,default=None,help="对话轮数(默认1000，--reload时500)")
+    parser.add_argument("--every",type=int,default=100,help="每隔多少轮打印一次")
+    parser.add_argument("--reload",action="store_true",help="测量从上下文日志恢复的耗时")
+    parser.add_argument("--repeat",type=int,default=20,help="--reload时恢复的次数")
+    args=parser.parse_args()
+    if args.reload:
+        run_reload(args.turns or 500,args.repeat)
+    else:
+        run(args.turns or 1000,args.every)
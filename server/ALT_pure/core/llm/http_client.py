@@ -0,0 +1,55 @@
+from httpx import AsyncClient, Limits, Timeout
+from ...config.load_config import config
+from ...log.load_log import logger
+TAG=__name__
+
+# 应用启动时预先创建的provider
+PROVIDERS=("qwen","ollama")
+
+try:
+    import h2  # noqa: F401 httpx的HTTP/2支持依赖h2(pip install httpx[http2])
+    _HTTP2_AVAILABLE=True
+except ImportError:
+    _HTTP2_AVAILABLE=False
+
+# 每个provider一个应用生命周期的AsyncClient，复用连接池和keep-alive；只在服务的事件循环中使用
+_clients={}
+
+
+def _build_client(provider:str)->AsyncClient:
+    options=config.get("http_client",{}).get(provider,{}) or {}
+    http2=bool(options.get("http2",True)) and _HTTP2_AVAILABLE
+    limits=Limits(
+        max_connections=int(options.get("max_connections",100)),
+        max_keepalive_connections=int(options.get("max_keepalive_connections",20)),
+        keepalive_expiry=float(options.get("keepalive_expiry",60.0)),
+    )
+    # 流式响应两次分片之间最多等待read秒
+    timeout=Timeout(float(options.get("timeout",30.0)),connect=float(options.get("connect_timeout",10.0)))
+    logger.bind(tag=TAG).info(f"创建{provider}连接池(http2={http2})")
+    return AsyncClient(http2=http2,limits=limits,timeout=timeout)
+
+
+def get_client(provider:str)->AsyncClient:
+    # 用户接口，获取provider共享的异步HTTP客户端，未在启动时创建的会在首次使用时创建
+    client=_clients.get(provider)
+    if client is None or client.is_closed:
+        client=_build_client(provider)
+        _clients[provider]=client
+    return client
+
+
+async def startup():
+    # 应用启动时调用，预先创建连接池
+    for provider in PROVIDERS:
+        get_client(provider)
+
+
+async def shutdown():
+    # 应用关闭时调用，关闭所有连接池
+    for provider,client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.bind(tag=TAG).warning(f"关闭{provider}连接池失败: {e}")
+    _clients.clear()
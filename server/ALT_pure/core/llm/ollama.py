@@ -1,16 +1,26 @@
-import asyncio
 from ...config.load_config import config
 from ...log.load_log import logger
 from httpx import AsyncClient, HTTPError
-from .context_manager import ContextManager
+from .context_manager import context_store
+from ..common.rate_limiter import get_guard, RetriableError, CircuitOpenError, retry_after_seconds
+from .http_client import get_client
+from .response_cache import normalize_content
+from ..common.single_flight import SingleFlight
 import httpx
+import json
+import time
 
 TAG = __name__
+# base_url -> (过期时间, 模型名集合)，所有Ollama实例共享
+_model_cache = {}
+# 这些HTTP状态码视为可重试：限流和服务端繁忙
+RETRIABLE_STATUS = {429, 502, 503, 504}
+# 进行中的请求，相同(会话、角色、规范化问题、模型)的并发请求共用一次上游调用
+_inflight = SingleFlight()
 
 
 class Ollama:
     def __init__(self):
-        self.context_manager = ContextManager(user_id="default")
         self.logger = logger.bind(tag=TAG)
 
         self.platform = config.get("choose", {"llm": None}).get("llm", None)
@@ -18,6 +28,7 @@ class Ollama:
         self.model = None
         self.base_url = config.get("llm", {"ollama": {"base_url": "http://localhost:11434"}}).get("ollama", {"base_url": "http://localhost:11434"}).get("base_url", "http://localhost:11434")
         self._is_loaded = False
+        self.model_check_ttl = config.get("llm", {"ollama": {"model_check_ttl": 300}}).get("ollama", {"model_check_ttl": 300}).get("model_check_ttl", 300)
 
     def __enter__(self):
         return self
@@ -25,8 +36,8 @@ class Ollama:
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
-    async def chat(self, text: str, change_role: str = None) -> str:
-        # 用户接口，带记忆一次性请求
+    async def chat(self, text: str, change_role: str = None, user_id: str = "default", conversation_id: str = "default", persist: bool = True) -> str:
+        # 用户接口，带记忆一次性请求，记忆按(user_id, conversation_id)隔离，persist为False时记忆不写入磁盘
         if not self._is_loaded:
             if self.platform == "ollama":
                 self._load_ollama()
@@ -39,18 +50,48 @@ class Ollama:
 
         if self._is_loaded:
             if self.platform == "ollama":
-                if change_role is not None:
-                    self.context_manager.set_role(change_role)
-                context = self.context_manager.add_question(text)
-                answer = await self._request_ollama_by_http(context)
-                self.context_manager.add_answer(answer)
-                return answer
+                key = ("chat", self.base_url, str(user_id), str(conversation_id), change_role, normalize_content(text), self.model)
+                return await _inflight.do(key, lambda: self._chat_ollama(text, change_role, user_id, conversation_id, persist))
             else:
                 self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
                 return ""
         else:
             return ""
 
+    async def _chat_ollama(self, text: str, change_role: str, user_id: str, conversation_id: str, persist: bool = True) -> str:
+        # 请求期间持有上下文，避免被淘汰后同一会话出现第二个实例
+        async with context_store.hold_async(user_id, conversation_id, persist=persist) as context_manager:
+            if change_role is not None:
+                context_manager.set_role(change_role)
+            context = context_manager.add_question(text)
+            answer = await self._request_ollama_by_http(context)
+            context_manager.add_answer(answer)
+        return answer
+
+    async def complete(self, role: str, text: str, json_mode: bool = False) -> str:
+        # 用户接口，不带记忆的一次性请求；json_mode为True时要求模型只输出JSON(format: json)
+        messages = [
+            {"role": "system", "content": role},
+            {"role": "user", "content": text}
+        ]
+
+        if not self._is_loaded:
+            if self.platform == "ollama":
+                self._load_ollama()
+            if not self._check():
+                self.logger.error("请于config完整配置llm,未发送llm请求")
+                self._is_loaded = False
+                return ""
+            else:
+                self._is_loaded = True
+
+        if self.platform == "ollama":
+            key = ("complete", self.base_url, role, normalize_content(text), self.model, json_mode)
+            return await _inflight.do(key, lambda: self._request_ollama_by_http(messages, json_mode=json_mode))
+        else:
+            self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
+            return ""
+
     def request(self, role: str, text: str, model=None):
         # 用户接口，不带记忆的请求，默认流式
         messages = [
@@ -78,8 +119,67 @@ class Ollama:
         else:
             return
 
-    def chat_stream(self, text: str, model=None, change_role: str = None, temperature: float = 0.7, top_p: float = 0.9):
-        # 用户接口，带记忆的请求，默认流式
+    async def request_async(self, role: str, text: str, model=None, json_mode: bool = False):
+        # 用户接口，request的异步版本：不带记忆，逐个产出增量文本，不阻塞事件循环
+        messages = [
+            {"role": "system", "content": role},
+            {"role": "user", "content": text}
+        ]
+
+        if not self._is_loaded:
+            if self.platform == "ollama":
+                self._load_ollama()
+            if not self._check():
+                self.logger.error("请于config完整配置llm,未发送llm请求")
+                self._is_loaded = False
+                return
+            else:
+                self._is_loaded = True
+
+        if self.platform != "ollama":
+            self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
+            return
+
+        base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": True
+        }
+        if json_mode:
+            payload["format"] = "json"
+        try:
+            async for delta in get_guard("ollama", base_url).stream(self._ollama_ndjson_once, f"{base_url}/api/chat", payload):
+                yield delta
+        except Exception as e:
+            self.logger.error(f"Ollama流式请求错误: {e}")
+
+    @staticmethod
+    async def _ollama_ndjson_once(url: str, payload: dict):
+        try:
+            async with get_client("ollama").stream("POST", url, json=payload) as response:
+                if response.status_code in RETRIABLE_STATUS:
+                    raise RetriableError(f"HTTP {response.status_code}", retry_after_seconds(response.headers.get("Retry-After")))
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise Exception(f"请求失败: {response.status_code} {body.decode('utf-8', 'ignore')}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    content = (data.get("message") or {}).get("content")
+                    if content:
+                        yield content
+                    if data.get("done", False):
+                        break
+        except httpx.TransportError as e:
+            raise RetriableError(f"网络错误: {e}")
+
+    def chat_stream(self, text: str, model=None, change_role: str = None, temperature: float = 0.7, top_p: float = 0.9, user_id: str = "default", conversation_id: str = "default"):
+        # 用户接口，带记忆的请求，默认流式，记忆按(user_id, conversation_id)隔离
         if not self._is_loaded:
             if self.platform == "ollama":
                 self._load_ollama()
@@ -92,15 +192,16 @@ class Ollama:
 
         if self._is_loaded:
             if self.platform == "ollama":
-                if change_role is not None:
-                    self.context_manager.set_role(change_role)
-                context = self.context_manager.add_question(text)
-                model = model or self.model
-                answer = ""
-                for item in self._request_ollama_stream(context, model=model, temperature=temperature, top_p=top_p):
-                    yield item
-                    answer += item
-                self.context_manager.add_answer(answer)
+                with context_store.hold(user_id, conversation_id) as context_manager:
+                    if change_role is not None:
+                        context_manager.set_role(change_role)
+                    context = context_manager.add_question(text)
+                    model = model or self.model
+                    answer = ""
+                    for item in self._request_ollama_stream(context, model=model, temperature=temperature, top_p=top_p):
+                        yield item
+                        answer += item
+                    context_manager.add_answer(answer)
             else:
                 self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
                 return
@@ -108,28 +209,26 @@ class Ollama:
             return
 
     async def _check_model_exists(self, model_name):
-        """检查模型是否存在"""
+        """检查模型是否存在，/api/tags的结果按base_url缓存model_check_ttl秒"""
+        # 确保base_url包含协议
+        base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
+        cached = _model_cache.get(base_url)
+        if cached is not None and cached[0] > time.monotonic() and model_name in cached[1]:
+            return True
+        # 未命中（包括刚拉取的新模型）时重新查询
         try:
-            # 确保base_url包含协议
-            base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
-            url = f"{base_url}/api/tags"
-            
-            async with AsyncClient(timeout=10) as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                data = response.json()
-                
-                if "models" in data:
-                    model_names = [m["name"] for m in data["models"]]
-                    return model_name in model_names
-                return False
+            response = await get_client("ollama").get(f"{base_url}/api/tags", timeout=10)
+            response.raise_for_status()
+            data = response.json()
+
+            model_names = {m["name"] for m in data.get("models", [])}
+            _model_cache[base_url] = (time.monotonic() + self.model_check_ttl, model_names)
+            return model_name in model_names
         except Exception as e:
             self.logger.warning(f"检查模型时出错: {e}")
             return False
 
     def _request_ollama_stream(self, context: list, model=None, temperature: float = 0.7, top_p: float = 0.9):
-        import json
-
         model = model or self.model
         # 确保base_url包含协议
         base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
@@ -152,8 +251,17 @@ class Ollama:
             }
         }
 
+        try:
+            yield from get_guard("ollama", base_url).stream_sync(self._ollama_stream_once, url, payload)
+        except Exception as e:
+            self.logger.error(f"Ollama流式请求错误: {e}")
+
+    @staticmethod
+    def _ollama_stream_once(url: str, payload: dict):
         try:
             with httpx.stream("POST", url, json=payload, timeout=30.0) as response:
+                if response.status_code in RETRIABLE_STATUS:
+                    raise RetriableError(f"HTTP {response.status_code}", retry_after_seconds(response.headers.get("Retry-After")))
                 for line in response.iter_lines():
                     if line:
                         try:
@@ -164,63 +272,79 @@ class Ollama:
                                 break
                         except json.JSONDecodeError:
                             continue
-        except Exception as e:
-            self.logger.error(f"Ollama流式请求错误: {e}")
+        except httpx.TransportError as e:
+            raise RetriableError(f"网络错误: {e}")
+
+    async def _request_ollama_by_http(self, context: list, json_mode: bool = False):
+        client = get_client("ollama")
+        try:
+            model = self.model
+            # 确保base_url包含协议
+            base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
+            url = f"{base_url}/api/chat"
+
+            # 转换消息格式
+            messages = []
+            if isinstance(context, list):
+                messages = context
+            elif isinstance(context, str):
+                messages = [{"role": "user", "content": context}]
 
-    async def _request_ollama_by_http(self, context: list):
-        async with AsyncClient(timeout=30) as client:
-            try:
-                model = self.model
-                # 确保base_url包含协议
-                base_url = self.base_url if self.base_url.startswith(("http://", "https://")) else f"http://{self.base_url}"
-                url = f"{base_url}/api/chat"
-
-                # 转换消息格式
-                messages = []
-                if isinstance(context, list):
-                    messages = context
-                elif isinstance(context, str):
-                    messages = [{"role": "user", "content": context}]
-
-                # 检查模型是否存在
-                if not await self._check_model_exists(model):
-                    self.logger.warning(f"模型 '{model}' 不存在于Ollama中，请确认模型名称或先拉取模型: ollama pull {model}")
-                    return f"错误：模型 '{model}' 不存在，请先拉取模型"
-
-                response = await client.post(
-                    url,
-                    json={
-                        "model": model,
-                        "messages": messages,
-                        "stream": False
-                    }
-                )
+            # 检查模型是否存在
+            if not await self._check_model_exists(model):
+                self.logger.warning(f"模型 '{model}' 不存在于Ollama中，请确认模型名称或先拉取模型: ollama pull {model}")
+                return f"错误：模型 '{model}' 不存在，请先拉取模型"
+
+            payload = {
+                "model": model,
+                "messages": messages,
+                "stream": False
+            }
+            if json_mode:
+                payload["format"] = "json"
+            response = await get_guard("ollama", base_url).call(self._ollama_post_once, client, url, payload)
+            
+            # 更详细的错误处理
+            if response.status_code == 400:
+                error_detail = response.text
+                self.logger.error(f"HTTP 400 错误，请求内容有误: {error_detail}")
+                return f"请求错误: {error_detail}"
+            elif response.status_code == 404:
+                self.logger.error("指定的模型未找到，请确认模型名称")
+                return "错误：指定的模型未找到"
+            elif response.status_code >= 500:
+                self.logger.error(f"Ollama服务器内部错误: {response.status_code}")
+                return "服务器内部错误"
                 
-                # 更详细的错误处理
-                if response.status_code == 400:
-                    error_detail = response.text
-                    self.logger.error(f"HTTP 400 错误，请求内容有误: {error_detail}")
-                    return f"请求错误: {error_detail}"
-                elif response.status_code == 404:
-                    self.logger.error("指定的模型未找到，请确认模型名称")
-                    return "错误：指定的模型未找到"
-                elif response.status_code >= 500:
-                    self.logger.error(f"Ollama服务器内部错误: {response.status_code}")
-                    return "服务器内部错误"
-                    
-                response.raise_for_status()
-                result = response.json()
-                if "message" in result and "content" in result["message"]:
-                    return result["message"]["content"]
-                else:
-                    self.logger.warning("模型返回格式不正确或无内容。")
-                    return ""
-            except HTTPError as e:
-                self.logger.error(f"HTTP错误: {e}")
-                return ""
-            except Exception as e:
-                self.logger.error(f"请求错误: {e}")
+            response.raise_for_status()
+            result = response.json()
+            if "message" in result and "content" in result["message"]:
+                return result["message"]["content"]
+            else:
+                self.logger.warning("模型返回格式不正确或无内容。")
                 return ""
+        except CircuitOpenError as e:
+            self.logger.error(f"{e}")
+            return ""
+        except RetriableError as e:
+            self.logger.error(f"Ollama多次重试后仍失败: {e}")
+            return "服务器内部错误"
+        except HTTPError as e:
+            self.logger.error(f"HTTP错误: {e}")
+            return ""
+        except Exception as e:
+            self.logger.error(f"请求错误: {e}")
+            return ""
+
+    @staticmethod
+    async def _ollama_post_once(client: AsyncClient, url: str, payload: dict):
+        try:
+            response = await client.post(url, json=payload)
+        except httpx.TransportError as e:
+            raise RetriableError(f"网络错误: {e}")
+        if response.status_code in RETRIABLE_STATUS:
+            raise RetriableError(f"HTTP {response.status_code}", retry_after_seconds(response.headers.get("Retry-After")))
+        return response
 
     def _check(self) -> bool:
         flag = True
@@ -2,13 +2,22 @@ from .ollama import Ollama
 from ...config.load_config import config
 from ...log.load_log import logger
 from httpx import AsyncClient,HTTPError
-from .context_manager import ContextManager
+from .context_manager import context_store
+from ..common.rate_limiter import get_guard, RetriableError, CircuitOpenError, retry_after_seconds
+from .http_client import get_client
+from .response_cache import normalize_content
+from ..common.single_flight import SingleFlight
+from httpx import TransportError
 import dashscope
+import json
 TAG=__name__
+# 这些HTTP状态码视为可重试：限流和上游繁忙
+RETRIABLE_STATUS={429,500,502,503,504}
+# 进行中的请求，相同(会话、角色、规范化问题、模型)的并发请求共用一次上游调用
+_inflight=SingleFlight()
 
 class LLM:
     def __init__(self):
-        self.context_manager=ContextManager(user_id="default")
         self.logger=logger.bind(tag=TAG)
 
         self.platform=config.get("choose",{"llm": None}).get("llm",None)
@@ -26,8 +35,8 @@ class LLM:
         pass
 
 
-    async def chat(self,text:str,change_role:str= None)->str:
-        # 用户接口，带记忆一次性请求
+    async def chat(self,text:str,change_role:str= None,user_id:str="default",conversation_id:str="default",persist:bool=True)->str:
+        # 用户接口，带记忆一次性请求，记忆按(user_id, conversation_id)隔离，persist为False时记忆不写入磁盘
         if self.platform=="ollama":
             self._is_loaded = True
         else:
@@ -43,26 +52,60 @@ class LLM:
 
         if self._is_loaded:
             if self.platform=="qwen":
-                if change_role is not None:
-                    self.context_manager.set_role(change_role)
-                context=self.context_manager.add_question(text)
-                answer=await self._request_qwen_by_http(context)
-                self.context_manager.add_answer(answer)
-                # self.logger.success(f"summary: {self.context_manager.summary}")
-                # self.logger.warning(f"context: {self.context_manager.history}")
-                return answer
+                key=("chat",str(user_id),str(conversation_id),change_role,normalize_content(text),self.model)
+                return await _inflight.do(key,lambda: self._chat_qwen(text,change_role,user_id,conversation_id,persist))
             elif self.platform=="ollama":
-                if change_role is not None:
-                    self.context_manager.set_role(change_role)
                 if self.ollama is None:
                     self.ollama=Ollama()
-                return await self.ollama.chat(text)
+                return await self.ollama.chat(text,change_role,user_id=user_id,conversation_id=conversation_id,persist=persist)
             else:
                 self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
                 return ""
         else:
             return  ""
 
+    async def _chat_qwen(self,text:str,change_role:str,user_id:str,conversation_id:str,persist:bool=True)->str:
+        # 请求期间持有上下文，避免被淘汰后同一会话出现第二个实例
+        async with context_store.hold_async(user_id,conversation_id,persist=persist) as context_manager:
+            if change_role is not None:
+                context_manager.set_role(change_role)
+            context=context_manager.add_question(text)
+            answer=await self._request_qwen_by_http(context)
+            context_manager.add_answer(answer)
+        # self.logger.success(f"summary: {context_manager.summary}")
+        # self.logger.warning(f"context: {context_manager.history}")
+        return answer
+
+    async def complete(self,role:str,text:str,json_mode:bool=False)->str:
+        # 用户接口，不带记忆的一次性请求，只发送角色设定和本次问题，适合结构化、提取要点等工具类调用
+        # json_mode为True时要求模型只输出JSON对象(qwen的response_format/ollama的format)
+        messages=[
+            {"role": "system", "content": role},
+            {"role": "user", "content": text}
+        ]
+
+        if self.platform=="ollama":
+            if self.ollama is None:
+                self.ollama=Ollama()
+            return await self.ollama.complete(role,text,json_mode=json_mode)
+
+        if not self._is_loaded:
+            if self.platform=="qwen":
+                self._load_qwen()
+            if not self._check():
+                self.logger.error("请于config完整配置llm,未发送llm请求")
+                self._is_loaded=False
+                return ""
+            else:
+                self._is_loaded=True
+
+        if self.platform=="qwen":
+            key=("complete",role,normalize_content(text),self.model,json_mode)
+            return await _inflight.do(key,lambda: self._request_qwen_by_http(messages,json_mode=json_mode))
+        else:
+            self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
+            return ""
+
     def request(self,role:str,text:str,model="qwen-turbo"):
         # 用户接口，不带记忆的请求，默认流式
         messages=[
@@ -89,8 +132,85 @@ class LLM:
         else:
             return
 
-    def chat_stream(self,text:str,model="qwen-turbo",change_role:str= None,search:bool=True,temperature:float = 0.7,top_p:float = 0.9):
-        # 用户接口，带记忆的请求，默认流式
+    async def request_async(self,role:str,text:str,model="qwen-turbo",json_mode:bool=False):
+        # 用户接口，request的异步版本：不带记忆，逐个产出增量文本，不阻塞事件循环
+        messages=[
+            {"role": "system", "content": role},
+            {"role": "user", "content": text}
+        ]
+
+        if self.platform=="ollama":
+            if self.ollama is None:
+                self.ollama=Ollama()
+            async for delta in self.ollama.request_async(role,text,json_mode=json_mode):
+                yield delta
+            return
+
+        if not self._is_loaded:
+            if self.platform == "qwen":
+                self._load_qwen()
+            if not self._check():
+                self.logger.error("请于config完整配置llm,未发送llm请求")
+                self._is_loaded = False
+                return
+            else:
+                self._is_loaded = True
+
+        if self.platform == "qwen":
+            try:
+                async for delta in get_guard("qwen",self.api_key).stream(self._qwen_sse_once,messages,model=model,json_mode=json_mode):
+                    yield delta
+            except Exception as e:
+                self.logger.error(f"调用失败: {e}")
+        else:
+            self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
+
+    async def _qwen_sse_once(self,context: list,model="qwen-turbo",search:bool = False,temperature:float = 0.7,top_p:float = 0.9,json_mode:bool = False):
+        # DashScope SSE接口，incremental_output下每个事件就是一段增量
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "Accept": "text/event-stream",
+            "X-DashScope-SSE": "enable"
+        }
+        payload={
+            "model": model,
+            "input": {'messages':context},
+            "parameters": {"temperature": temperature,
+                           "top_p": top_p,
+                           "result_format": "message",
+                           "incremental_output": True,
+                           "enable_search": search}
+        }
+        if json_mode:
+            # JSON模式下不能同时开启联网搜索
+            payload["parameters"]["response_format"]={"type": "json_object"}
+            payload["parameters"]["enable_search"]=False
+        try:
+            async with get_client("qwen").stream("POST",self.API_URL,headers=headers,json=payload) as response:
+                if response.status_code in RETRIABLE_STATUS:
+                    raise RetriableError(f"HTTP {response.status_code}",retry_after_seconds(response.headers.get("Retry-After")))
+                if response.status_code != 200:
+                    body=await response.aread()
+                    raise Exception(f"请求失败: {response.status_code} {body.decode('utf-8','ignore')}")
+                event=None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event=line[6:].strip()
+                    elif line.startswith("data:"):
+                        data=json.loads(line[5:])
+                        if event=="error":
+                            raise Exception(f"请求失败: {data.get('message', data)}")
+                        choices=(data.get("output") or {}).get("choices") or []
+                        if choices:
+                            delta=(choices[0].get("message") or {}).get("content") or ""
+                            if delta:
+                                yield delta
+        except TransportError as e:
+            raise RetriableError(f"网络错误: {e}")
+
+    def chat_stream(self,text:str,model="qwen-turbo",change_role:str= None,search:bool=True,temperature:float = 0.7,top_p:float = 0.9,user_id:str="default",conversation_id:str="default"):
+        # 用户接口，带记忆的请求，默认流式，记忆按(user_id, conversation_id)隔离
         if not self._is_loaded:
             if self.platform == "qwen":
                 self._load_qwen()
@@ -103,14 +223,15 @@ class LLM:
 
         if self._is_loaded:
             if self.platform == "qwen":
-                if change_role is not None:
-                    self.context_manager.set_role(change_role)
-                context=self.context_manager.add_question(text)
-                answer=""
-                for item in self._request_qwen_stream(context,model=model,search=search,temperature=temperature,top_p=top_p):
-                    yield item
-                    answer+= item
-                self.context_manager.add_answer(answer)
+                with context_store.hold(user_id,conversation_id) as context_manager:
+                    if change_role is not None:
+                        context_manager.set_role(change_role)
+                    context=context_manager.add_question(text)
+                    answer=""
+                    for item in self._request_qwen_stream(context,model=model,search=search,temperature=temperature,top_p=top_p):
+                        yield item
+                        answer+= item
+                    context_manager.add_answer(answer)
             else:
                 self.logger.warning("未选择llm平台或llm平台不被支持，未发送llm请求")
                 return
@@ -118,60 +239,52 @@ class LLM:
             return
     def _request_qwen_stream(self, context: list,model="qwen-turbo",search:bool = False,temperature:float = 0.7,top_p:float = 0.9):
         try:
-            response = dashscope.Generation.call(
-                api_key=self.api_key,
-                model=model,
-                messages=context,
-                stream=True,
-                temperature=temperature,
-                top_p=top_p,
-                enable_search=search,
-                search_options={
-                    "forced_search": False,
-                    "enable_source": False,
-                    "enable_citation": False,
-                    # "citation_format": "[ref_<number>]",
-                    "search_strategy": "turbo",
-                },
-                result_format="message"
+            yield from get_guard("qwen",self.api_key).stream_sync(
+                self._qwen_stream_once,context,model=model,search=search,temperature=temperature,top_p=top_p
             )
-
-            last_content = ""
-            for chunk in response:
-                # print( chunk)
-                if chunk.status_code != 200:
-                    error_msg = f"请求失败: {chunk.message}"
-                    self.logger.error(error_msg)
-                    raise Exception(error_msg)
-
-                if chunk.output and chunk.output.choices:
-                    current_content = chunk.output.choices[0].message.content or ""
-
-                    if len(current_content) > len(last_content):
-                        delta = current_content[len(last_content):]
-                        yield delta
-                    last_content = current_content
         except Exception as e:
             self.logger.error(f"调用失败: {e}")
 
+    def _qwen_stream_once(self, context: list,model="qwen-turbo",search:bool = False,temperature:float = 0.7,top_p:float = 0.9):
+        response = dashscope.Generation.call(
+            api_key=self.api_key,
+            model=model,
+            messages=context,
+            stream=True,
+            temperature=temperature,
+            top_p=top_p,
+            enable_search=search,
+            search_options={
+                "forced_search": False,
+                "enable_source": False,
+                "enable_citation": False,
+                # "citation_format": "[ref_<number>]",
+                "search_strategy": "turbo",
+            },
+            result_format="message"
+        )
+
+        last_content = ""
+        for chunk in response:
+            # print( chunk)
+            if chunk.status_code != 200:
+                error_msg = f"请求失败: {chunk.message}"
+                self.logger.error(error_msg)
+                if chunk.status_code in RETRIABLE_STATUS:
+                    raise RetriableError(error_msg)
+                raise Exception(error_msg)
+
+            if chunk.output and chunk.output.choices:
+                current_content = chunk.output.choices[0].message.content or ""
+
+                if len(current_content) > len(last_content):
+                    delta = current_content[len(last_content):]
+                    yield delta
+                last_content = current_content
+
     def _request_qwen(self,context: list):
         try:
-            response=dashscope.Generation.call(
-                api_key=self.api_key,
-                model=self.model,
-                messages=context,
-                temperature=0.7,
-                top_p=0.9,
-                enable_search=False,
-                search_options={
-                    "forced_search": False,
-                    "enable_source": False,
-                    "enable_citation": False,
-                    # "citation_format": "[ref_<number>]",
-                    "search_strategy": "turbo",
-                },
-                result_format="message"
-            )
+            response=get_guard("qwen",self.api_key).call_sync(self._qwen_call_once,context)
             if response and response.output and response.output.choices:
                 result=response.output.choices[0].message.content
                 logger.bind(tag=TAG).info(f"模型返回：{result}")
@@ -184,49 +297,87 @@ class LLM:
             logger.bind(tag=TAG).error(f"模型调用错误：{e}")
             return ""
 
-    async def _request_qwen_by_http(self,context: list):
-        async with AsyncClient(timeout=30) as client:
-            try:
-                if not self.model:
-                    self.logger.error("模型名称未设置")
-                    return ""
-                response=await client.post(
-                    self.API_URL,
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.api_key}"
-                    },
-                    json={
-                        "model": self.model,
-                        "input": {'messages':context},
-                        "parameters": {"temperature": 0.3,
-                                       "top_p": 0.9,
-                                       "result_format": "message",
-                                       "enable_search":True,
-                                       "search_options":{
-                                           "forced_search": False,
-                                           "enable_source": False,
-                                           "enable_citation": False,
-                                           # "citation_format": "[ref_<number>]",
-                                           "search_strategy": "max"
-                                       }
-
-                       }
-                    }
-                )
-                response.raise_for_status()
-                result=response.json()
-                if "output" in result and "choices" in result['output'] and len(result['output']['choices']) > 0:
-                    return result['output']['choices'][0]['message']['content']
-                else:
-                    self.logger.warning("模型返回格式不正确或无内容。")
-                    return ""
-            except HTTPError as e:
-                self.logger.error(f"HTTP错误: {e}")
+    def _qwen_call_once(self,context: list):
+        response=dashscope.Generation.call(
+            api_key=self.api_key,
+            model=self.model,
+            messages=context,
+            temperature=0.7,
+            top_p=0.9,
+            enable_search=False,
+            search_options={
+                "forced_search": False,
+                "enable_source": False,
+                "enable_citation": False,
+                # "citation_format": "[ref_<number>]",
+                "search_strategy": "turbo",
+            },
+            result_format="message"
+        )
+        if response is not None and getattr(response,"status_code",200) in RETRIABLE_STATUS:
+            raise RetriableError(f"qwen返回{response.status_code}: {getattr(response,'message','')}")
+        return response
+
+    async def _request_qwen_by_http(self,context: list,json_mode:bool=False):
+        client=get_client("qwen")
+        try:
+            if not self.model:
+                self.logger.error("模型名称未设置")
                 return ""
-            except Exception as e:
-                self.logger.error(f"请求错误: {e}")
+            result=await get_guard("qwen",self.api_key).call(self._qwen_post_once,client,context,json_mode)
+            if "output" in result and "choices" in result['output'] and len(result['output']['choices']) > 0:
+                return result['output']['choices'][0]['message']['content']
+            else:
+                self.logger.warning("模型返回格式不正确或无内容。")
                 return ""
+        except CircuitOpenError as e:
+            self.logger.error(f"{e}")
+            return ""
+        except HTTPError as e:
+            self.logger.error(f"HTTP错误: {e}")
+            return ""
+        except Exception as e:
+            self.logger.error(f"请求错误: {e}")
+            return ""
+
+    async def _qwen_post_once(self,client:AsyncClient,context: list,json_mode:bool=False)->dict:
+        payload={
+            "model": self.model,
+            "input": {'messages':context},
+            "parameters": {"temperature": 0.3,
+                           "top_p": 0.9,
+                           "result_format": "message",
+                           "enable_search":True,
+                           "search_options":{
+                               "forced_search": False,
+                               "enable_source": False,
+                               "enable_citation": False,
+                               # "citation_format": "[ref_<number>]",
+                               "search_strategy": "max"
+                           }
+
+           }
+        }
+        if json_mode:
+            # JSON模式下不能同时开启联网搜索
+            payload["parameters"]["response_format"]={"type": "json_object"}
+            payload["parameters"]["enable_search"]=False
+            del payload["parameters"]["search_options"]
+        try:
+            response=await client.post(
+                self.API_URL,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}"
+                },
+                json=payload
+            )
+        except TransportError as e:
+            raise RetriableError(f"网络错误: {e}")
+        if response.status_code in RETRIABLE_STATUS:
+            raise RetriableError(f"HTTP {response.status_code}",retry_after_seconds(response.headers.get("Retry-After")))
+        response.raise_for_status()
+        return response.json()
 
 
     def _check(self)->bool:
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from ...config.load_config import config
+from ...log.load_log import logger
+from ..common.single_flight import SingleFlight
+TAG=__name__
+
+# 项目根目录，与diary_api一致
+BASE_DIR=Path(__file__).resolve().parent.parent.parent.parent.parent
+
+_WHITESPACE=re.compile(r"\s+")
+
+
+def normalize_content(text:str)->str:
+    # 统一全半角、合并空白，前端重试或重新打开同一篇日记时得到相同的key
+    return _WHITESPACE.sub(" ",unicodedata.normalize("NFKC",text or "")).strip()
+
+
+def current_model()->str:
+    # 当前配置的llm平台和模型，切换模型后旧缓存自然失效
+    platform=config.get("choose",{"llm": None}).get("llm",None)
+    model=((config.get("llm",{}) or {}).get(platform,{}) or {}).get("model")
+    return f"{platform}:{model}"
+
+
+class ResponseCache:
+    # 确定性AI接口(结构化、要点提取、学习助手、情绪炼金、任务规划)的响应缓存
+    # key为(endpoint, template, model, 规范化内容的哈希)；内存LRU + TTL，可选SQLite持久化；相同请求并发时只请求一次上游
+    def __init__(self):
+        self.logger=logger.bind(tag=TAG)
+        options=config.get("response_cache",{}) or {}
+        self.enabled=bool(options.get("enabled",True))
+        self.max_entries=int(options.get("max_entries",1000))
+        self.ttl=float(options.get("ttl",86400))
+        self.db_path=None
+        if options.get("sqlite",False):
+            self.db_path=Path(options.get("sqlite_path",BASE_DIR/"data"/"response_cache.db"))
+            self._ensure_schema()
+        self._entries=OrderedDict()  # key -> (过期时间, 响应)
+        self._flight=SingleFlight()
+        self._stats={}               # endpoint -> 计数
+        self._lock=threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint:str,template:str,model:str,content:str)->str:
+        digest=hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+        return hashlib.sha256(json.dumps([endpoint,template,model,digest],ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self,endpoint:str,template:str,content:str,compute:Callable[[],Awaitable[str]])->str:
+        # 用户接口，命中则直接返回；未命中时调用compute，非空结果写入缓存，空结果和异常不缓存
+        if not self.enabled:
+            return await compute()
+        key=self.make_key(endpoint,template,current_model(),content)
+
+        value=self._get_memory(key)
+        if value is not None:
+            self._count(endpoint,"hits")
+            return value
+
+        if self._flight.in_flight(key):
+            self._count(endpoint,"coalesced")
+        try:
+            return await self._flight.do(key,lambda: self._load_or_compute(key,endpoint,compute))
+        except Exception:
+            self._count(endpoint,"errors")
+            raise
+
+    async def _load_or_compute(self,key:str,endpoint:str,compute:Callable[[],Awaitable[str]])->str:
+        value=self._get_disk(key)
+        if value is not None:
+            self._count(endpoint,"disk_hits")
+        else:
+            self._count(endpoint,"misses")
+            value=await compute()
+            if value:
+                self._put_disk(key,endpoint,value)
+        if value:
+            self._put_memory(key,value)
+        return value
+
+    def stats(self)->dict:
+        # 用户接口，按endpoint返回命中统计
+        with self._lock:
+            result={}
+            for endpoint,counts in self._stats.items():
+                total=counts["hits"]+counts["disk_hits"]+counts["coalesced"]+counts["misses"]
+                served=total-counts["misses"]
+                result[endpoint]=dict(counts,hit_rate=round(served/total,4) if total else 0.0)
+            return {"entries": len(self._entries),"endpoints": result}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _count(self,endpoint:str,name:str):
+        with self._lock:
+            counts=self._stats.setdefault(endpoint,{"hits": 0,"disk_hits": 0,"coalesced": 0,"misses": 0,"errors": 0})
+            counts[name]+=1
+
+    def _get_memory(self,key:str)->Optional[str]:
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0]<time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put_memory(self,key:str,value:str):
+        with self._lock:
+            self._entries[key]=(time.time()+self.ttl,value)
+            self._entries.move_to_end(key)
+            while len(self._entries)>self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _ensure_schema(self):
+        try:
+            self.db_path.parent.mkdir(parents=True,exist_ok=True)
+            conn=sqlite3.connect(str(self.db_path))
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT,
+                    value TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+                """
+            )
+            # 启动时清理已过期的记录
+            conn.execute("DELETE FROM response_cache WHERE expires<?",(time.time(),))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            self.logger.warning(f"初始化响应缓存数据库失败，仅使用内存缓存: {e}")
+            self.db_path=None
+
+    def _get_disk(self,key:str)->Optional[str]:
+        if self.db_path is None:
+            return None
+        try:
+            conn=sqlite3.connect(str(self.db_path))
+            row=conn.execute("SELECT value, expires FROM response_cache WHERE key=?",(key,)).fetchone()
+            if row is not None and row[1]<time.time():
+                conn.execute("DELETE FROM response_cache WHERE key=?",(key,))
+                conn.commit()
+                row=None
+            conn.close()
+        except Exception as e:
+            self.logger.warning(f"读取响应缓存失败: {e}")
+            return None
+        return row[0] if row is not None else None
+
+    def _put_disk(self,key:str,endpoint:str,value:str):
+        if self.db_path is None:
+            return
+        try:
+            conn=sqlite3.connect(str(self.db_path))
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, endpoint, value, expires) VALUES (?, ?, ?, ?)",
+                (key,endpoint,value,time.time()+self.ttl)
+            )
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            self.logger.warning(f"写入响应缓存失败: {e}")
+
+
+# 进程内共享的响应缓存
+response_cache=ResponseCache()
@@ -0,0 +1,192 @@
+import json
+from typing import Any, Optional, Type
+from pydantic import BaseModel, ValidationError
+from ...log.load_log import logger
+from .response_cache import response_cache
+TAG=__name__
+
+# 解析失败时追加在原问题后面，要求模型重新只输出JSON
+REASK_SUFFIX="\n\n上一次的输出无法解析为要求的JSON（{error}）。请严格按上面的JSON结构重新输出，只返回JSON本身，不要任何其他文字。"
+
+
+class IncrementalJSONParser:
+    # 增量JSON解析器：逐段feed流式输出，随时可以取到“到目前为止”的部分对象
+    # 只扫描新到达的字符，记录容器栈和最近一个可安全截断的位置；取部分对象时截断/补全后再json.loads
+    # 第一个{或[之前的内容(如```json)会被跳过，顶层对象闭合后的内容被忽略
+    def __init__(self):
+        self.buffer=[]
+        self.stack=[]            # 每层为[容器类型, 期待的下一个元素: key/colon/value/comma]
+        self.in_string=False
+        self.escape=False
+        self.string_is_key=False
+        self.in_literal=False    # 数字、true/false/null
+        self.started=False
+        self.done=False
+        self.safe_end=0          # buffer[:safe_end]去掉末尾逗号并补全括号后是合法JSON
+        self.safe_stack=[]
+        self._cache_len=-1
+        self._cache=None
+
+    def feed(self,chunk:str)->Optional[Any]:
+        # 用户接口，送入一段文本，返回当前的部分对象(尚未出现{时返回None)
+        for ch in chunk:
+            if self.done:
+                break
+            if not self.started:
+                if ch in "{[":
+                    self.started=True
+                else:
+                    continue
+            self.buffer.append(ch)
+            self._step(ch)
+        return self.partial()
+
+    def partial(self)->Optional[Any]:
+        # 用户接口，当前的部分对象；未完成的字符串值会以已到达的前缀出现，未完成的键和数字会被省略
+        if not self.started:
+            return None
+        if self._cache_len==len(self.buffer):
+            return self._cache
+        text="".join(self.buffer)
+        if self.done:
+            candidate=text
+        elif self.in_string and not self.string_is_key:
+            # 未闭合的字符串值：去掉末尾悬空的转义符后补引号
+            body=text[:-1] if self.escape else text
+            candidate=body+'"'+self._closers(self.stack)
+        else:
+            candidate=text[:self.safe_end].rstrip()
+            if candidate.endswith(","):
+                candidate=candidate[:-1]
+            candidate+=self._closers(self.safe_stack)
+        try:
+            value=json.loads(candidate)
+        except json.JSONDecodeError:
+            value=self._cache
+        self._cache_len=len(self.buffer)
+        self._cache=value
+        return value
+
+    def result(self)->Optional[Any]:
+        # 用户接口，完整解析结果；顶层对象未闭合时返回None
+        if not self.done:
+            return None
+        return self.partial()
+
+    @staticmethod
+    def _closers(stack:list)->str:
+        return "".join("}" if frame[0]=="{" else "]" for frame in reversed(stack))
+
+    def _mark_safe(self):
+        self.safe_end=len(self.buffer)
+        self.safe_stack=[list(frame) for frame in self.stack]
+
+    def _value_done(self):
+        if self.stack:
+            self.stack[-1][1]="comma"
+            self._mark_safe()
+        else:
+            self.done=True
+
+    def _step(self,ch:str):
+        if self.in_string:
+            if self.escape:
+                self.escape=False
+            elif ch=="\\":
+                self.escape=True
+            elif ch=='"':
+                self.in_string=False
+                if self.string_is_key:
+                    self.stack[-1][1]="colon"
+                else:
+                    self._value_done()
+            return
+        if self.in_literal:
+            if ch in ",}] \t\r\n":
+                self.in_literal=False
+                self._value_done()
+                # 结束数字的这个字符本身还需要处理
+            else:
+                return
+        if ch in " \t\r\n":
+            return
+        top=self.stack[-1] if self.stack else None
+        if ch=='"':
+            self.in_string=True
+            self.string_is_key=top is not None and top[0]=="{" and top[1]=="key"
+        elif ch in "{[":
+            self.stack.append([ch,"key" if ch=="{" else "value"])
+            self._mark_safe()
+        elif ch in "}]":
+            if self.stack:
+                self.stack.pop()
+            self._value_done()
+        elif ch==":":
+            if top is not None:
+                top[1]="value"
+        elif ch==",":
+            if top is not None:
+                top[1]="key" if top[0]=="{" else "value"
+                self._mark_safe()
+        else:
+            self.in_literal=True
+
+
+def parse_json(text:str)->Optional[Any]:
+    # 从LLM输出中解析JSON，兼容```代码块和前后多余文字
+    parser=IncrementalJSONParser()
+    parser.feed(text or "")
+    return parser.result()
+
+
+def parse_model(text:str,model_cls:Type[BaseModel])->Optional[BaseModel]:
+    # 解析并按Pydantic模型校验，失败返回None
+    model,_=_validate(text,model_cls)
+    return model
+
+
+def _validate(text:str,model_cls:Type[BaseModel]):
+    data=parse_json(text)
+    if not isinstance(data,dict):
+        return None,"不是JSON对象"
+    try:
+        return model_cls(**data),None
+    except ValidationError as e:
+        return None,str(e).replace("\n"," ")[:200]
+    except TypeError as e:
+        return None,str(e)[:200]
+
+
+async def complete_model(llm,role:str,prompt:str,model_cls:Type[BaseModel],
+                         endpoint:Optional[str]=None,template:str="default",retries:int=1)->Optional[BaseModel]:
+    # 用户接口，以JSON模式请求并校验为model_cls；校验失败时带上错误信息重新询问retries次
+    # 给出endpoint时经过response_cache，只有校验通过的结果才会被缓存
+    async def compute()->str:
+        text=await llm.complete(role,prompt,json_mode=True)
+        for attempt in range(retries+1):
+            model,error=_validate(text,model_cls)
+            if model is not None:
+                return json.dumps(parse_json(text),ensure_ascii=False)
+            logger.bind(tag=TAG).warning(f"结构化输出校验失败({error})，第{attempt+1}次")
+            if attempt<retries:
+                text=await llm.complete(role,prompt+REASK_SUFFIX.format(error=error),json_mode=True)
+        return ""
+
+    if endpoint is not None:
+        text=await response_cache.get_or_compute(endpoint,template,prompt,compute)
+    else:
+        text=await compute()
+    return parse_model(text,model_cls) if text else None
+
+
+async def stream_partial(llm,role:str,prompt:str):
+    # 用户接口，以JSON模式流式请求，每当部分对象发生变化时产出一次（最后一次即完整对象）
+    parser=IncrementalJSONParser()
+    last=None
+    async for delta in llm.request_async(role,prompt,json_mode=True):
+        current=parser.feed(delta)
+        if current is not None and current!=last:
+            last=current
+            yield current
+        if parser.done:
+            break
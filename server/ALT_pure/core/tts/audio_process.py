@@ -1,5 +1,9 @@
 import subprocess
 import os
+import tempfile
+import uuid
+import wave
+import numpy as np
 import simpleaudio as sa
 from typing import List
 from pathlib import Path
@@ -13,6 +17,9 @@ class AudioProcessor:
         self.logger=logger.bind(tag=TAG)
         self.OUT_PATH=OUT_PATH
         self.max_temp_num=50
+        self.sample_rate=16000
+        # 拼接时每次读写的帧数
+        self.block_frames=65536
 
     def play(self, audio_path):
         if audio_path is None:
@@ -50,20 +57,113 @@ class AudioProcessor:
         output_path_obj = Path(output_path)
         output_path_obj.parent.mkdir(parents=True, exist_ok=True)
 
+        # 全部是PCM wav时进程内直接拼接，只有外来格式才交给ffmpeg
+        if all(self._check_wav_file(fl) for fl in true_files):
+            try:
+                if self._concat_wav_files(true_files, output_path_obj):
+                    self.logger.success(f"音频合并完成: {output_path_obj}")
+                    self._audio_temp_manager(output_path_obj)
+                    return output_path_obj
+            except Exception as e:
+                self.logger.warning(f"进程内合并wav失败，回退到ffmpeg: {e}")
+        return self._merge_by_ffmpeg(true_files, output_path_obj)
+
+    def _concat_wav_files(self,true_files:List[str],output_path_obj:Path)->bool:
+        # 流式拼接PCM wav，采样率不一致时才重采样；参数不受支持时返回False交给ffmpeg
+        channels=None
+        total_frames=0
+        for fl in true_files:
+            with wave.open(fl, "rb") as src:
+                if src.getcomptype()!="NONE" or src.getsampwidth()!=2 or src.getnframes()==0:
+                    return False
+                if channels is None:
+                    channels=src.getnchannels()
+                elif src.getnchannels()!=channels:
+                    return False
+                total_frames+=self._resampled_length(src.getnframes(),src.getframerate())
+
+        temp_path=output_path_obj.with_name(f"{output_path_obj.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with wave.open(str(temp_path), "wb") as out:
+                out.setnchannels(channels)
+                out.setsampwidth(2)
+                out.setframerate(self.sample_rate)
+                out.setnframes(total_frames)
+                for fl in true_files:
+                    with wave.open(fl, "rb") as src:
+                        rate=src.getframerate()
+                        if rate==self.sample_rate:
+                            while True:
+                                block=src.readframes(self.block_frames)
+                                if not block:
+                                    break
+                                out.writeframes(block)
+                        else:
+                            for block in self._resample_blocks(src,channels,rate):
+                                out.writeframes(block)
+            os.replace(temp_path, output_path_obj)
+        finally:
+            if temp_path.exists():
+                try:
+                    os.remove(temp_path)
+                except Exception as e:
+                    self.logger.warning(f"删除临时文件失败: {e}")
+        return True
+
+    def _resampled_length(self,nframes:int,rate:int)->int:
+        if rate==self.sample_rate:
+            return nframes
+        return int(round(nframes*self.sample_rate/rate))
+
+    def _resample_blocks(self,src,channels:int,rate:int):
+        # 线性插值重采样到self.sample_rate，按block_frames分块读取，内存占用与文件长度无关
+        # 输出第k帧对应源位置k*rate/sample_rate；块之间保留上一块的最后一个采样，跨块的插值点与整段一次插值结果相同
+        n_dst=self._resampled_length(src.getnframes(),rate)
+        step=rate/self.sample_rate
+        produced=0
+        carry=np.empty((0,channels),dtype=np.float32)
+        start=0    # carry第一个采样在源文件中的序号
+        while produced<n_dst:
+            data=src.readframes(self.block_frames)
+            samples=np.frombuffer(data,dtype="<i2").reshape(-1,channels).astype(np.float32)
+            eof=samples.shape[0]<self.block_frames
+            buf=np.concatenate((carry,samples)) if carry.shape[0] else samples
+            if buf.shape[0]==0:
+                break
+            last=start+buf.shape[0]-1
+            # 未到文件末尾时只输出源位置不超过本块最后一个采样的帧，其余留给下一块
+            end=n_dst if eof else min(n_dst,int(np.floor(last/step))+1)
+            if end>produced:
+                src_pos=np.arange(produced,end,dtype=np.float64)*step-start
+                src_idx=np.arange(buf.shape[0],dtype=np.float64)
+                out=np.empty((end-produced,channels),dtype=np.float32)
+                for ch in range(channels):
+                    out[:,ch]=np.interp(src_pos,src_idx,buf[:,ch])
+                yield np.clip(np.rint(out),-32768,32767).astype("<i2").tobytes()
+                produced=end
+            if eof:
+                break
+            carry=buf[-1:]
+            start=last
+
+    def _merge_by_ffmpeg(self,true_files:List[str],output_path_obj:Path):
         ffmpeg_executable = imageio_ffmpeg.get_ffmpeg_exe()
+        temp_list_file = None
         if len(true_files)==1:
             cmd = [
                 ffmpeg_executable,
                 "-i", true_files[0],
                 "-acodec", "pcm_s16le",
-                "-ar", "16000",
+                "-ar", str(self.sample_rate),
                 "-y",
                 str(output_path_obj)
             ]
         else:
-            temp_list_file = Path("temp_audio_list.txt").resolve()
             try:
-                with open(temp_list_file, "w", encoding="utf-8", newline="") as fil:
+                # 每次调用独立的列表文件，避免并发调用互相覆盖
+                fd, temp_name = tempfile.mkstemp(prefix="audio_list_", suffix=".txt")
+                temp_list_file = Path(temp_name)
+                with os.fdopen(fd, "w", encoding="utf-8", newline="") as fil:
                     for pth in true_files:
                         safe_path = Path(pth).resolve().as_posix()
                         fil.write(f"file '{safe_path}'\n")
@@ -74,12 +174,14 @@ class AudioProcessor:
                     "-safe", "0",
                     "-i", str(temp_list_file),
                     "-acodec", "pcm_s16le",
-                    "-ar", "16000",
+                    "-ar", str(self.sample_rate),
                     "-y",
                     str(output_path_obj)
                 ]
             except Exception as e:
                 self.logger.warning(f"创建临时文件失败: {e}")
+                if temp_list_file is not None and temp_list_file.exists():
+                    os.remove(temp_list_file)
                 return None
         try:
             result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", check=False)
@@ -93,7 +195,7 @@ class AudioProcessor:
             self.logger.warning(f"执行失败: {e}")
             return None
         finally:
-            if 'temp_list_file' in locals() and temp_list_file.exists():
+            if temp_list_file is not None and temp_list_file.exists():
                 try:
                     os.remove(temp_list_file)
                 except Exception as e:
@@ -8,12 +8,26 @@ from ...log.load_log import logger
 from ...config.load_config import config
 import uuid
 import glob
-from ...core.common.text_processor import TextProcessor
-from ...core.common.task_manager import TaskManager
+from ...core.common.text_processor import TextProcessor, StreamSegmenter
+from ...core.common.task_manager import TaskManager, PRIORITY_WEIGHTS, get_limiter
 import os
 from ...core.tts.gpt_sovits import GPTSoVITS
+from ...core.common.rate_limiter import get_guard, RetriableError
 TAG=__name__
+# 火山TTS中可重试的错误码：并发超限、服务繁忙、处理超时/错误、后端链路错误
+RETRIABLE_CODES={3003,3005,3030,3031,3032,3040}
 TEMP_PATH=os.path.join(os.path.dirname(__file__), "temp")
+# 每个平台在进程内共享的TTS并发量(所有TTS实例、任务管理器和text_to_audio合计)，默认是4，根据需求！api限制，不得超10，除非你充钱任性【Doge】
+MAX_WORKERS=4
+# 后台释放任务组的任务，完成后自动移除
+_background_tasks=set()
+
+
+def _on_background_done(task:asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.bind(tag=TAG).error(f"释放TTS任务组失败: {task.exception()}")
+
 
 class TTS:
     def __init__(self):
@@ -46,8 +60,9 @@ class TTS:
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         self._close()
 
-    def text_to_audio(self,text:str,filename:str="output.wav"):
-        # 用户接口，文本转语音
+    def text_to_audio(self,text:str,filename:str="output.wav",priority:str="interactive"):
+        # 用户接口，文本转语音，在工作线程中调用(内部使用asyncio.run)
+        # priority: interactive（对话等需要尽快出声）或batch（整篇朗读等长文本），与其它TTS请求共享平台的并发量
         if self.platform=="gpt_sovits":
             self._is_loaded=True
         else:
@@ -65,18 +80,18 @@ class TTS:
             self._audio_temp_manager()
             if self.platform=="huoshan":
                 try:
-                    asyncio.run(self._request_huoshan(text,filename))
+                    result=asyncio.run(self._limited(self._request_huoshan,text,filename,priority))
                 except Exception as e:
                     self.logger.error(f"huoshan请求失败:{e}")
                     return  False
-                return True
+                return result is not None
             elif self.platform=="gpt_sovits":
                 try:
-                    asyncio.run(self._request_gpt_sovits(text,filename))
+                    result=asyncio.run(self._limited(self._request_gpt_sovits,text,filename,priority))
                 except Exception as e:
                     self.logger.error(f"gpt_sovits请求失败:{e}")
                     return  False
-                return True
+                return result is not None
 
             else:
                 self.logger.warning("未选择tts平台或tts平台不被支持，未发送llm请求")
@@ -84,7 +99,62 @@ class TTS:
         else:
             return  False
 
-    async def smart_request_huoshan(self,raw_text):
+    async def smart_request_huoshan(self,raw_text,priority:str="interactive"):
+        # 用户接口，智能分割文本，智能并发，全部完成后返回音频路径列表
+        # priority: interactive（对话等需要尽快出声）或batch（整篇朗读等长文本）
+        task_manager=self._get_smart_task_manager()
+        if task_manager is None:
+            return None
+        pieces=self._split_to_pieces(raw_text)
+        task1 = await task_manager.add_group(pieces,priority=priority)
+        if task1 is None:
+            return None
+        # await task_manager.cancel_group(task1)
+        await task_manager.wait_for_group(task1)
+        results = await task_manager.get_group_results(task1)
+        # 检查是否有任何结果为None
+        if any(result is None for result in results):
+            self.logger.error(f"部分{self.platform} TTS请求失败，返回了None结果")
+            return None
+        return results
+
+    async def smart_request_huoshan_stream(self,raw_text,priority:str="interactive"):
+        # 用户接口，smart_request_huoshan的异步迭代器版本
+        # 按原文顺序产出音频路径，某段及其之前的段全部完成即产出，首段延迟只取决于首句
+        # 某段失败或任务组提前结束时抛出RuntimeError，已产出的段不完整
+        task_manager=self._get_smart_task_manager()
+        if task_manager is None:
+            return
+        pieces=self._split_to_pieces(raw_text)
+        group_id=await task_manager.add_group(pieces,priority=priority)
+        if group_id is None:
+            return
+        # 提前完成的段暂存于此，等待前面的段到齐
+        reorder_buffer={}
+        next_index=0
+        try:
+            async for index,result in task_manager.iter_group_results(group_id):
+                if result is None:
+                    self.logger.error(f"第{index}段{self.platform} TTS请求失败，已产出{next_index}/{len(pieces)}段，停止产出后续音频")
+                    raise RuntimeError(f"第{index}段{self.platform} TTS请求失败")
+                reorder_buffer[index]=result
+                while next_index in reorder_buffer:
+                    yield reorder_buffer.pop(next_index)
+                    next_index+=1
+            if next_index<len(pieces):
+                # 任务组被取消等情况下提前结束，调用方拿到的音频不完整
+                self.logger.error(f"{self.platform} TTS任务组 {group_id} 提前结束，只产出了{next_index}/{len(pieces)}段")
+                raise RuntimeError(f"{self.platform} TTS只完成了{next_index}/{len(pieces)}段")
+        finally:
+            if next_index<len(pieces):
+                await task_manager.cancel_group(group_id)
+            # 任务组结束后取一次结果，释放任务组内存；保留任务引用，避免任务在执行前被回收
+            task=asyncio.create_task(self._release_group(task_manager,group_id))
+            _background_tasks.add(task)
+            task.add_done_callback(_on_background_done)
+
+    def _get_smart_task_manager(self):
+        # 返回当前平台的任务管理器，配置不完整或平台不支持时返回None
         # 当平台是gpt_sovits时，不需要进行huoshan的配置检查
         if self.platform!="gpt_sovits":
             if not self._is_loaded:
@@ -100,51 +170,39 @@ class TTS:
             # 对于gpt_sovits平台，直接标记为已加载
             self._is_loaded=True
 
-        if self._is_loaded:
-            self._audio_temp_manager()
-            if self.platform=="huoshan":
-                if self.ts_huoshan is None:
-                    # 这里的worker是并发量，默认是4，根据需求！api限制，不得超10，除非你充钱任性【Doge】
-                    self.ts_huoshan = TaskManager(self._request_huoshan, max_workers=4, single=False)
-                cleaned_text = self.text_processor.text_clean(raw_text)
-                texts = self.text_processor.text_merger(self.text_processor.text_cutter_by_language(cleaned_text))
-                pieces_num=len(texts)
-                self.logger.info(f"文本切分为 {pieces_num} 段: {texts}")
-                paths=[f"audio_pieces_{uuid.uuid4()}.wav" for i in range(pieces_num)]
-                task1 = await self.ts_huoshan.add_group([(text, path) for (text,path) in zip(texts,paths)])
-                # await self.ts_huoshan.cancel_group(task1)
-                await self.ts_huoshan.wait_for_group(task1)
-                results = await self.ts_huoshan.get_group_results(task1)
-                # 检查是否有任何结果为None
-                if any(result is None for result in results):
-                    self.logger.error("部分TTS请求失败，返回了None结果")
-                    return None
-                return results
-            elif self.platform == "gpt_sovits":
-                if self.ts_gpt is None:
-                    # 这里的worker是并发量，默认是4，根据需求！api限制，不得超10，除非你充钱任性【Doge】
-                    self.ts_gpt = TaskManager(self._request_gpt_sovits, max_workers=4, single=False)
-                cleaned_text = self.text_processor.text_clean(raw_text)
-                texts = self.text_processor.text_merger(self.text_processor.text_cutter_by_language(cleaned_text))
-                pieces_num=len(texts)
-                self.logger.info(f"文本切分为 {pieces_num} 段: {texts}")
-                paths=[f"audio_pieces_{uuid.uuid4()}.wav" for i in range(pieces_num)]
-                task1 = await self.ts_gpt.add_group([(text, path) for (text,path) in zip(texts,paths)])
-                # await self.ts_huoshan.cancel_group(task1)
-                await self.ts_gpt.wait_for_group(task1)
-                results = await self.ts_gpt.get_group_results(task1)
-                # 检查是否有任何结果为None
-                if any(result is None for result in results):
-                    self.logger.error("部分GPT-SoVITS TTS请求失败，返回了None结果")
-                    return None
-                return results
+        self._audio_temp_manager()
+        if self.platform=="huoshan":
+            if self.ts_huoshan is None:
+                # 并发量由平台共享的limiter控制，见MAX_WORKERS
+                self.ts_huoshan = TaskManager(self._request_huoshan, single=False, limiter=get_limiter(self.platform,MAX_WORKERS))
+            return self.ts_huoshan
+        elif self.platform == "gpt_sovits":
+            if self.ts_gpt is None:
+                # 并发量由平台共享的limiter控制，见MAX_WORKERS
+                self.ts_gpt = TaskManager(self._request_gpt_sovits, single=False, limiter=get_limiter(self.platform,MAX_WORKERS))
+            return self.ts_gpt
+        else:
+            self.logger.warning("未选择tts平台或tts平台不被支持，未发送tts请求")
+            return None
 
-            else:
-                self.logger.warning("未选择tts平台或tts平台不被支持，未发送tts请求")
-                return None
+    def _split_to_pieces(self,raw_text):
+        # 清洗、切分、合并文本，返回[(文本段,音频文件名)]
+        # 与流式对话(process_api)使用同一个分句器，首段较短以尽快出声
+        segmenter = StreamSegmenter(self.text_processor)
+        texts = segmenter.feed(raw_text) + segmenter.flush()
+        self.logger.info(f"文本切分为 {len(texts)} 段: {texts}")
+        return [(text, f"audio_pieces_{uuid.uuid4()}.wav") for text in texts]
 
-        else:
-            return  None
+    async def _limited(self,request,text,filename,priority):
+        # 单条请求占用平台共享limiter的一个名额，每次调用按一个单项任务组参与轮转
+        weight=PRIORITY_WEIGHTS.get(priority,PRIORITY_WEIGHTS["interactive"])
+        async with get_limiter(self.platform,MAX_WORKERS).slot(f"direct_{uuid.uuid4().hex[:8]}",weight):
+            return await request(text,filename)
+
+    @staticmethod
+    async def _release_group(task_manager:TaskManager,group_id:str):
+        await task_manager.wait_for_group(group_id)
+        await task_manager.get_group_results(group_id)
 
     async def _request_gpt_sovits(self,text,filename):
         self._audio_temp_manager()
@@ -176,16 +234,26 @@ class TTS:
             self.logger.error(f"创建TTS缓存文件夹时发生错误: {e}")
             return None
         try:
-            request_json=self._json_process(text)
-            submit_json=copy.deepcopy(request_json)
+            await get_guard("huoshan",self.token).call(self._huoshan_once,text,output_file)
+            self.logger.success(f"TTS文件{filename}已保存至{output_file}")
+            # self._audio_temp_manager(output_file)
+            return output_file
+        except Exception as e:
+            self.logger.error(f"TTS请求发生错误: {e}")
+            return None
 
-            payload_bytes = json.dumps(submit_json).encode('utf-8')
-            payload_bytes = gzip.compress(payload_bytes)
-            default_header = bytearray(b'\x11\x10\x11\x00')
-            full_client_request = bytearray(default_header)
-            full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-            full_client_request.extend(payload_bytes)
+    async def _huoshan_once(self,text,output_file):
+        request_json=self._json_process(text)
+        submit_json=copy.deepcopy(request_json)
 
+        payload_bytes = json.dumps(submit_json).encode('utf-8')
+        payload_bytes = gzip.compress(payload_bytes)
+        default_header = bytearray(b'\x11\x10\x11\x00')
+        full_client_request = bytearray(default_header)
+        full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
+        full_client_request.extend(payload_bytes)
+
+        try:
             async with websockets.connect(
                     "wss://openspeech.bytedance.com/api/v1/tts/ws_binary",
                     additional_headers={"Authorization": f"Bearer; {self.token}"},
@@ -200,12 +268,13 @@ class TTS:
                             await file.write(payload)
                         if done:
                             break
-            self.logger.success(f"TTS文件{filename}已保存至{output_file}")
-            # self._audio_temp_manager(output_file)
-            return output_file
-        except Exception as e:
-            self.logger.error(f"TTS请求发生错误: {e}")
-            return None
+        except websockets.exceptions.InvalidStatus as e:
+            status=getattr(getattr(e,"response",None),"status_code",None)
+            if status==429 or (status is not None and status>=500):
+                raise RetriableError(f"TTS握手被拒绝: {status}")
+            raise
+        except (OSError, websockets.exceptions.ConnectionClosedError) as e:
+            raise RetriableError(f"TTS连接错误: {e}")
 
     def _parse_response(self,res,file):
         header_size = res[0] & 0x0f
@@ -221,6 +290,8 @@ class TTS:
             error_msg = payload[8:]
             error_msg = gzip.decompress(error_msg) if res[2] & 0x0f == 1 else error_msg
             self.logger.error(f"[TTS Error] Code: {code}, Message: {error_msg.decode('utf-8')}")
+            if code in RETRIABLE_CODES:
+                raise RetriableError(f"TTS错误码{code}")
             # 返回正确的元组格式，表示已完成但有错误
             return None, True
         else: